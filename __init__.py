@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .progress_stats.graphs import progressGraphs
+from .progress_stats.graphs import on_answer_card, progressGraphs, rebuild_rollup
 
 import anki.stats
 from anki.hooks import wrap
@@ -20,3 +20,16 @@ from anki.hooks import wrap
 
 anki.stats.CollectionStats.easeGraph = \
     wrap(anki.stats.CollectionStats.easeGraph, progressGraphs, pos="")
+
+try:
+    from aqt import gui_hooks, mw
+    from aqt.qt import QAction
+
+    gui_hooks.reviewer_did_answer_card.append(on_answer_card)
+
+    _rebuild_action = QAction("Rebuild Progress Stats Rollup", mw)
+    _rebuild_action.triggered.connect(rebuild_rollup)
+    mw.form.menuTools.addAction(_rebuild_action)
+except ImportError:
+    # Older versions of Anki don't have gui_hooks, so the rollup is only brought up to date when the stats are shown.
+    pass
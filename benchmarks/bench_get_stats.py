@@ -0,0 +1,236 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks computing the stats on synthetic collections of increasing size.  For each collection size and each
+period shown in the stats window the time and peak Python memory of each phase are measured separately:
+
+fetch: fetching and bucketing the reviews (_get_reviews)
+aggregate: computing the stats from the bucketed reviews
+render: generating the HTML for the graphs (_plot), which requires Anki to be importable
+get_stats[engine]: the whole computation with each of the requested engines
+
+The results can be saved as JSON and compared against a previous run to catch regressions.
+
+Usage: python -m benchmarks.bench_get_stats [--reviews 10000,100000,1000000] [--output results.json]
+                                            [--baseline previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from progress_stats.compute import _aggregate, _get_reviews, get_stats
+from tests.helpers import Table
+
+from .synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+
+# (name, bucket_size_days, num_buckets) for the periods shown in the stats window.
+PERIODS = [("1 month", 1, 31), ("1 year", 7, 52), ("deck life", 31, None)]
+
+ENGINES = ["python", "streaming", "sql", "numpy"]
+
+
+class _StatsPage:
+    """Stands in for Anki's CollectionStats when rendering the graphs.  The HTML is built the same way Anki does it,
+    with the graph data and configuration encoded as JSON."""
+
+    def _title(self, title, subtitle=""):
+        return "<h1>%s</h1>%s" % (title, subtitle)
+
+    def _graph(self, id, data, conf=None, xunit=1):
+        return """<div id="%s"></div><script>$(function () { $.plot($("#%s"), %s, %s); });</script>""" % (
+            id, id, json.dumps(data), json.dumps(conf or {}))
+
+    def _line(self, i, a, b, bold=True):
+        i.append("<tr><td width=200 align=right>%s:</td><td><b>%s</b></td></tr>" % (a, b))
+
+    def _lineTbl(self, i):
+        return "<table width=400>" + "".join(i) + "</table>"
+
+
+def _render(stats, bucket_size_days):
+    "Renders the same graphs as progressGraphs."
+
+    from progress_stats.graphs import _plot
+
+    page = _StatsPage()
+    html = _plot(page, stats["learned_cards"], "Learned Cards", "", bucket_size_days, include_cumulative=True)
+    html += _plot(page, stats["net_matured_cards"], "Net Matured Cards", "", bucket_size_days,
+                  include_cumulative=True)
+    html += _plot(page, stats["matured_cards"], "Matured Cards", "", bucket_size_days)
+    html += _plot(page, stats["lost_matured_card"], "Matured Cards Lost", "", bucket_size_days)
+    return html
+
+
+def _can_render():
+    try:
+        import progress_stats.graphs  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _measure(fn, repeat):
+    """Returns (result, best seconds, peak bytes).  The peak is the most memory allocated by Python at any point
+    while fn runs, measured in a separate run because tracing slows everything down."""
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del result
+
+    tracemalloc.start()
+    try:
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, best, peak
+
+
+def run(db_table, num_reviews, repeat=3, engines=("python",), render=True):
+    "Returns a list of dicts with the time and peak memory of each phase for each period."
+
+    results = []
+
+    def add(period, phase, seconds, peak_bytes, **extra):
+        result = dict(reviews=num_reviews, period=period, phase=phase, seconds=seconds, peak_bytes=peak_bytes)
+        result.update(extra)
+        results.append(result)
+
+    for name, bucket_size_days, num_buckets in PERIODS:
+        args = (db_table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+        reviews, seconds, peak = _measure(lambda: _get_reviews(*args), repeat)
+        add(name, "fetch", seconds, peak, rows=reviews.num_reviews(), groups=len(reviews))
+
+        stats, seconds, peak = _measure(lambda: _aggregate(reviews, num_buckets), repeat)
+        add(name, "aggregate", seconds, peak, buckets=len(stats["learned_cards"]))
+        reviews = None
+
+        if render:
+            html, seconds, peak = _measure(lambda: _render(stats, bucket_size_days), repeat)
+            add(name, "render", seconds, peak, html_bytes=len(html))
+
+        for engine in engines:
+            _, seconds, peak = _measure(lambda: get_stats(*args, engine=engine), repeat)
+            add(name, "get_stats[%s]" % engine, seconds, peak)
+
+    return results
+
+
+def _collection(num_reviews, seed, cache_dir):
+    "Returns the connection to a synthetic collection, reusing one from cache_dir if it was already generated."
+
+    path = os.path.join(cache_dir, "synthetic-%d-%d.anki2" % (num_reviews, seed))
+    if os.path.exists(path):
+        return sqlite3.connect(path)
+
+    print("Generating %d reviews in %s" % (num_reviews, path), file=sys.stderr)
+    try:
+        return create_collection(path, num_reviews, seed)
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change in time of each phase relative to the baseline results and returns the phases that got
+    slower by more than tolerance (e.g. 0.25 for 25%)."""
+
+    baseline_seconds = dict(((r["reviews"], r["period"], r["phase"]), r["seconds"]) for r in baseline["results"])
+
+    regressions = []
+    for result in results:
+        key = (result["reviews"], result["period"], result["phase"])
+        if not baseline_seconds.get(key):
+            continue
+        ratio = result["seconds"] / baseline_seconds[key]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print("%10d %-10s %-22s %6.2fx%s" % (key + (ratio, flag)))
+    return regressions
+
+
+def _environment():
+    return dict(python=platform.python_version(), sqlite=sqlite3.sqlite_version, platform=platform.platform(),
+                time=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", default="10000,100000,1000000",
+                        help="comma separated numbers of synthetic reviews, up to e.g. 50000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engines", default="python", help="comma separated engines, any of %s" % ",".join(ENGINES))
+    parser.add_argument("--cache-dir", help="keep the generated collections here to reuse them in later runs")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--baseline", help="compare against results saved by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown relative to the baseline reported as a regression (default 0.25)")
+    args = parser.parse_args()
+
+    engines = [engine for engine in args.engines.split(",") if engine]
+    render = _can_render()
+    if not render:
+        print("Anki isn't importable, so rendering won't be measured", file=sys.stderr)
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp()
+    if args.cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    results = []
+    try:
+        for num_reviews in [int(n) for n in args.reviews.split(",")]:
+            conn = _collection(num_reviews, args.seed, cache_dir)
+            try:
+                for result in run(Table(conn), num_reviews, args.repeat, engines, render):
+                    print("%10d %-10s %-22s %9.4fs %10.1f MB" % (
+                        result["reviews"], result["period"], result["phase"], result["seconds"],
+                        result["peak_bytes"] / 1e6))
+                    results.append(result)
+            finally:
+                conn.close()
+    finally:
+        if not args.cache_dir:
+            shutil.rmtree(cache_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(environment=_environment(), results=results), f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
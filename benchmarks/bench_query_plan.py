@@ -0,0 +1,114 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the time to fetch the reviews with the original single query, which has to scan all of revlog to find
+when cards were first learned, against the range scan plus first learned lookup, with and without the optional
+first learned index.
+
+Usage: python -m benchmarks.bench_query_plan [--reviews N] [--path collection.anki2]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from progress_stats.compute import _first_learned, _review_filters, _reviews_query, create_first_learned_index, \
+    drop_first_learned_index
+from tests.helpers import Table
+
+from .synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+
+# (name, bucket_size_days, num_buckets) for the periods shown in the stats window.
+PERIODS = [("1 month", 1, 31), ("1 year", 7, 52), ("deck life", 31, None)]
+
+
+def _original_fetch(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    "Fetches the reviews with the query used before the range scan and integer bucketing."
+
+    filters = []
+    if num_buckets:
+        id_cutoff = (day_cutoff_seconds - (bucket_size_days * num_buckets * 86400)) * 1000
+        filters.append("(rl.id >= %d OR (rl.id < %d AND rl.ivl > 0 AND rl.lastIvl < 0))" % (id_cutoff, id_cutoff))
+    if additional_filter:
+        filters.append(additional_filter)
+    where_clause = "WHERE %s" % (" AND ".join(filters)) if filters else ""
+
+    return db_table.all("""\
+      SELECT rl.id,
+             CAST(round(( (rl.id/1000.0 - %d) / 86400.0 / %d ) + 0.5) as int)
+               as bucket_index,
+             rl.cid, rl.ease, rl.ivl, rl.lastIvl, rl.type
+      FROM revlog rl
+      %s
+      ORDER BY rl.id ASC;
+      """ % (day_cutoff_seconds, bucket_size_days, where_clause))
+
+
+def _fetch(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    "Fetches the reviews with the range scan and separate first learned lookup."
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+    first_learned = _first_learned(db_table, id_cutoff, additional_filter)
+    return first_learned, db_table.all(_reviews_query(bucket_size_days, day_cutoff_seconds, filters))
+
+
+def _best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(db_table, repeat=3, additional_filter=None):
+    "Returns a list of (period, method, seconds)."
+
+    results = []
+    for name, bucket_size_days, num_buckets in PERIODS:
+        args = (db_table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, additional_filter)
+        drop_first_learned_index(db_table)
+        results.append((name, "original query", _best_time(lambda: _original_fetch(*args), repeat)))
+        results.append((name, "range scan + lookup", _best_time(lambda: _fetch(*args), repeat)))
+        create_first_learned_index(db_table)
+        results.append((name, "range scan + indexed lookup", _best_time(lambda: _fetch(*args), repeat)))
+        drop_first_learned_index(db_table)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=1000000, help="number of synthetic reviews to generate")
+    parser.add_argument("--path", help="existing collection to benchmark instead of a synthetic one")
+    parser.add_argument("--deck-filter", help="additional filter, e.g. \"cid in (select id from cards where did = 1)\"")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.path:
+        import sqlite3
+        conn = sqlite3.connect(args.path)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.anki2")
+        print("Generating %d reviews in %s" % (args.reviews, path))
+        conn = create_collection(path, args.reviews)
+
+    for period, method, seconds in run(Table(conn), args.repeat, args.deck_filter):
+        print("%-10s %-30s %8.3fs" % (period, method, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks every engine for computing the stats against the frozen reference implementation (benchmarks.reference)
+on randomly generated review histories that are full of the cases that are easy to get wrong:
+
+- lastIvl values that don't match the ivl of the card's previous review, including 0
+- cards that are relearned, so that only the first time they were learned counts
+- review types that don't match what the review did, as with filtered decks
+- intervals right at the maturity threshold, crossing it back and forth within a bucket
+- reviews exactly on the bucket boundaries, at the start of the graphed period and after the day cutoff
+
+Each failure is shrunk to as few cards and reviews as still fail and printed as the rows to insert into revlog.
+The time each engine takes is recorded along with its speedup over the reference on the same inputs, which with
+--reviews is measured on a synthetic collection of that size instead.
+
+Usage: python -m benchmarks.fuzz [--seeds 200] [--start-seed 0] [--engines python,sql,...] [--reviews N]
+"""
+
+import argparse
+import functools
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+
+from progress_stats.checkpoint import StatsCheckpoint
+from progress_stats.cid_index import CidIndex
+from progress_stats.compute import STANDARD_METRICS, get_metric_stats, get_multi_stats, get_stats, \
+    get_stats_by_deck
+from progress_stats.partial import PartialStats, get_partial_stats, iter_deck_life_stats
+from progress_stats.rollup import StatsRollup
+from tests.helpers import Table
+
+from . import reference
+from .synthetic import DAY_CUTOFF_SECONDS, _SCHEMA, create_collection
+
+
+# The (bucket_size_days, num_buckets) to check, which include the periods shown in the stats window along with
+# periods short enough that most reviews are before them.  The reference only supports whole days per bucket.
+PARAMS = [(1, 31), (7, 52), (31, None), (1, None), (3, 10), (1, 3)]
+
+DECK_FILTER = "cid in (select id from cards where did = 1)"
+
+FILTERS = [None, DECK_FILTER]
+
+_DAY_MS = 86400000
+
+# The intervals the reviews jump between, which cover learning intervals (negative), 0, and both sides of the
+# maturity threshold.
+_IVLS = [-1200, -600, -60, 0, 1, 2, 3, 20, 21, 22, 30, 100]
+
+
+def _partial_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    "Merges the PartialStats for the reviews split into three time ranges."
+    ids = [_id for (_id,) in db_table.all("SELECT id FROM revlog ORDER BY id")]
+    bounds = [None] + sorted(set(ids[len(ids) * i // 3] for i in (1, 2))) + [None]
+    partials = [get_partial_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter,
+                                  start_id, end_id)
+                for start_id, end_id in zip(bounds, bounds[1:])]
+    return functools.reduce(PartialStats.merge, partials).stats_by_name(num_buckets)
+
+
+def _checkpoint_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    "Computes the stats a bucket earlier first, so that the checkpoint is moved forward a bucket."
+    checkpoint = StatsCheckpoint()
+    checkpoint.get_stats(db_table, bucket_size_days, day_cutoff_seconds - bucket_size_days * 86400, num_buckets,
+                         additional_filter)
+    return checkpoint.get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+
+
+# The stats of an engine that is checked against the reference at some other point than once all the reviews are
+# in, along with the stats of the reference for the same reviews.
+Compared = namedtuple('Compared', ['stats', 'expected'])
+
+
+def _table_with_rows(db_table, rows):
+    "Returns a Table for an in-memory collection with the cards of db_table and the given revlog rows."
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(_SCHEMA)
+    with conn:
+        conn.executemany("INSERT INTO cards VALUES (?, ?)", db_table.all("SELECT id, did FROM cards"))
+        conn.executemany("INSERT INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return Table(conn)
+
+
+def _rollup_replay_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    """Brings a rollup up to date through a random sequence of the ways reviews reach revlog.  Going through the
+    reviews in order, each is either answered here and added with add_latest or answered on another device, and
+    answers here may be undone.  Syncs bring in the reviews from the other device, which are older than those
+    answered here since, and like Anki set the usn of all the reviews they bring in or send.  The stats are checked
+    against the reference every few steps and once all the reviews are in.  The first stats that differ are
+    returned, or the final stats."""
+
+    pending = db_table.all("SELECT * FROM revlog ORDER BY id")
+    table = _table_with_rows(db_table, [])
+    args = (table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+    rollup = StatsRollup()
+    if rollup.get_stats(*args) is None:
+        return None
+
+    rng = random.Random(len(pending))
+    answered = []
+    undone = []
+    elsewhere = []
+    usn = 0
+    while True:
+        action = rng.random()
+        if (pending or undone) and action < 0.5:
+            # Undone answers are answered again first, so they are still newer than the reviews made elsewhere.
+            row = undone.pop() if undone else pending.pop(0)
+            table.conn.execute("INSERT INTO revlog VALUES (?, ?, -1, ?, ?, ?, ?, ?, ?)", row[:2] + row[3:])
+            rollup.add_latest(table, row[1])
+            answered.append(row)
+        elif pending and not undone and action < 0.7:
+            elsewhere.append(pending.pop(0))
+        elif answered and action < 0.85 and not (elsewhere and elsewhere[-1][0] > answered[-1][0]):
+            row = answered.pop()
+            table.conn.execute("DELETE FROM revlog WHERE id = ?", (row[0],))
+            undone.append(row)
+        elif action < 0.95 or not (pending or undone):
+            usn += 1
+            table.conn.executemany("INSERT INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [row[:2] + (usn,) + row[3:] for row in elsewhere])
+            table.conn.execute("UPDATE revlog SET usn = ? WHERE usn = -1", (usn,))
+            elsewhere = []
+            answered = []
+        done = not (pending or undone or elsewhere)
+        if done or rng.random() < 0.3:
+            stats = rollup.get_stats(*args)
+            expected = reference.get_stats(*args)
+            if dict(stats) != dict(expected) or done:
+                return Compared(stats, expected)
+
+
+def _deck_life_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    if num_buckets:
+        return None
+    for stats in iter_deck_life_stats(db_table, bucket_size_days, day_cutoff_seconds, additional_filter, 2):
+        pass
+    return stats
+
+
+def _cid_index_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    "Counts the cards behind matured_cards, lost_matured_card and learned_cards from the CidIndex."
+    cid_index = CidIndex()
+    stats = get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter,
+                      cid_index=cid_index)
+    for name in ["matured_cards", "lost_matured_card", "learned_cards"]:
+        if name in stats:
+            stats[name] = [(bucket_index, len(cid_index.cids(name, bucket_index)))
+                           for bucket_index, value in stats[name]]
+    return stats
+
+
+def _deck_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+    if additional_filter != DECK_FILTER:
+        return None
+    return get_stats_by_deck(db_table, bucket_size_days, day_cutoff_seconds, num_buckets).get(1, {})
+
+
+# Maps the name of each engine to a function taking (db_table, bucket_size_days, day_cutoff_seconds, num_buckets,
+# additional_filter) that returns the same stats as get_stats, or None if the engine doesn't support the arguments.
+# An engine may instead return Compared with the stats it computed at some other point, as the replay does.
+ENGINES = OrderedDict([
+    ("python", lambda *args: get_stats(*args, engine="python")),
+    ("streaming", lambda *args: get_stats(*args, engine="streaming")),
+    ("sql", lambda *args: get_stats(*args, engine="sql")),
+    ("numpy", lambda *args: get_stats(*args, engine="numpy")),
+    ("multi", lambda db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter: get_multi_stats(
+        db_table, [(bucket_size_days, num_buckets)], day_cutoff_seconds,
+        additional_filter=additional_filter)[(bucket_size_days, num_buckets)]),
+    ("metrics", lambda db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter: get_metric_stats(
+        db_table, bucket_size_days, day_cutoff_seconds, STANDARD_METRICS, num_buckets, additional_filter)),
+    ("cid_index", _cid_index_stats),
+    ("by_deck", _deck_stats),
+    ("partial", _partial_stats),
+    ("deck_life", _deck_life_stats),
+    ("checkpoint", _checkpoint_stats),
+    ("rollup", lambda *args: StatsRollup().get_stats(*args)),
+    ("rollup_replay", _rollup_replay_stats),
+])
+
+
+def _boundary_ids(rng, day_cutoff_ms):
+    "Returns review ids on or next to the bucket boundaries and period starts of PARAMS."
+    ids = []
+    for bucket_size_days, num_buckets in PARAMS:
+        bucket_ms = int(bucket_size_days * _DAY_MS)
+        for k in range(-1, 4):
+            ids.append(day_cutoff_ms - k * bucket_ms)
+        if num_buckets:
+            ids.append(day_cutoff_ms - num_buckets * bucket_ms)
+    return [_id + rng.choice([-1, 0, 0, 0, 1]) for _id in ids]
+
+
+def generate_history(rng, num_cards=None, num_days=120, day_cutoff_seconds=DAY_CUTOFF_SECONDS):
+    """Returns a list of (cid, did, reviews) where reviews is a list of (id, ease, ivl, lastIvl, type) in ascending
+    id order, for randomly generated cards whose intervals jump around at random rather than following the
+    scheduler.  A third of the reviews are on or next to the bucket boundaries.  The ids are unique across all the
+    cards."""
+
+    day_cutoff_ms = day_cutoff_seconds * 1000
+    if num_cards is None:
+        num_cards = rng.randint(1, 25)
+
+    boundary_ids = _boundary_ids(rng, day_cutoff_ms)
+    used_ids = set()
+    history = []
+    for _ in range(num_cards):
+        cid = day_cutoff_ms - rng.randrange(num_days * _DAY_MS) - rng.randrange(1, 30 * _DAY_MS)
+        while cid in (card[0] for card in history):
+            cid -= 1
+
+        ids = set()
+        for _ in range(rng.randint(1, 12)):
+            if rng.random() < 0.3:
+                _id = rng.choice(boundary_ids)
+            else:
+                _id = day_cutoff_ms - rng.randrange(-_DAY_MS // 2, num_days * _DAY_MS)
+            if _id not in used_ids:
+                ids.add(_id)
+                used_ids.add(_id)
+
+        reviews = []
+        ivl = rng.choice([-60, -600, 0])
+        for _id in sorted(ids):
+            lastIvl = ivl if rng.random() < 0.7 else rng.choice(_IVLS)
+            ivl = rng.choice(_IVLS)
+            reviews.append((_id, rng.randint(1, 4), ivl, lastIvl, rng.randint(0, 3)))
+        if reviews:
+            history.append((cid, rng.randint(1, 2), reviews))
+
+    return history
+
+
+def create_table(history):
+    "Returns a Table for an in-memory collection with the reviews of the history."
+
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(_SCHEMA)
+    with conn:
+        for cid, did, reviews in history:
+            conn.execute("INSERT INTO cards VALUES (?, ?)", (cid, did))
+            conn.executemany("INSERT INTO revlog VALUES (?, ?, -1, ?, ?, ?, 2500, 5000, ?)",
+                             [(_id, cid, ease, ivl, lastIvl, _type) for _id, ease, ivl, lastIvl, _type in reviews])
+    return Table(conn)
+
+
+def check(db_table, engines=None, params=PARAMS, filters=FILTERS, day_cutoff_seconds=DAY_CUTOFF_SECONDS,
+          timings=None):
+    """Returns a list of (engine, bucket_size_days, num_buckets, additional_filter) for each combination of the
+    arguments where the engine's stats differ from the reference.
+
+    timings is an (optional) dict mapping each engine to [seconds, reference_seconds], which the time the engine
+    takes and the time the reference takes for the same arguments are added to.  Arguments that the engine doesn't
+    support aren't timed."""
+
+    engines = engines or list(ENGINES)
+    if timings is None:
+        timings = {}
+
+    failures = []
+    for bucket_size_days, num_buckets in params:
+        for additional_filter in filters:
+            args = (db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+
+            start = time.perf_counter()
+            expected = reference.get_stats(*args)
+            reference_seconds = time.perf_counter() - start
+
+            for engine in engines:
+                start = time.perf_counter()
+                stats = ENGINES[engine](*args)
+                seconds = time.perf_counter() - start
+                if stats is None:
+                    continue
+
+                engine_timings = timings.setdefault(engine, [0, 0])
+                engine_timings[0] += seconds
+                engine_timings[1] += reference_seconds
+                engine_expected = expected
+                if isinstance(stats, Compared):
+                    stats, engine_expected = stats
+                if dict(stats) != dict(engine_expected):
+                    failures.append((engine, bucket_size_days, num_buckets, additional_filter))
+
+    return failures
+
+
+def shrink(history, engine, bucket_size_days, num_buckets, additional_filter, day_cutoff_seconds=DAY_CUTOFF_SECONDS):
+    """Returns the smallest history found by removing cards and then reviews one at a time for which the engine
+    still fails with the given arguments."""
+
+    def fails(candidate):
+        return bool(check(create_table(candidate), [engine], [(bucket_size_days, num_buckets)], [additional_filter],
+                          day_cutoff_seconds))
+
+    i = 0
+    while i < len(history):
+        candidate = history[:i] + history[i + 1:]
+        if candidate and fails(candidate):
+            history = candidate
+        else:
+            i += 1
+
+    for card_index in range(len(history)):
+        i = 0
+        while i < len(history[card_index][2]):
+            cid, did, reviews = history[card_index]
+            if len(reviews) == 1:
+                break
+            candidate = list(history)
+            candidate[card_index] = (cid, did, reviews[:i] + reviews[i + 1:])
+            if fails(candidate):
+                history = candidate
+            else:
+                i += 1
+
+    return history
+
+
+def fuzz(seeds, engines=None, timings=None):
+    """Checks the engines on the history generated for each seed.  Returns a list of (seed, failure, history) with
+    the first failure for each seed that has any and the history shrunk for it."""
+
+    results = []
+    for seed in seeds:
+        history = generate_history(random.Random(seed))
+        failures = check(create_table(history), engines, timings=timings)
+        if failures:
+            results.append((seed, failures[0], shrink(history, *failures[0])))
+    return results
+
+
+def format_history(history):
+    "Returns the history as revlog rows (id, cid, ivl, lastIvl, type), one per line, with the deck of each card."
+    lines = []
+    for cid, did, reviews in history:
+        lines.append("card %d in deck %d" % (cid, did))
+        lines.extend("  (%d, %d, %d, %d, %d)" % (_id, cid, ivl, lastIvl, _type)
+                     for _id, ease, ivl, lastIvl, _type in reviews)
+    return "\n".join(lines)
+
+
+def print_speedups(timings):
+    "Prints the seconds each engine and the reference took for the same arguments and the speedup of the engine."
+    print("%-12s %10s %10s %8s" % ("engine", "seconds", "reference", "speedup"))
+    for engine, (seconds, reference_seconds) in timings.items():
+        print("%-12s %9.4fs %9.4fs %7.2fx" % (engine, seconds, reference_seconds,
+                                              reference_seconds / seconds if seconds else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=200, help="number of random histories to check")
+    parser.add_argument("--start-seed", type=int, default=0)
+    parser.add_argument("--engines", default=",".join(ENGINES),
+                        help="comma separated engines, any of %s" % ",".join(ENGINES))
+    parser.add_argument("--reviews", type=int,
+                        help="also check the engines on a synthetic collection this size and report their speedups "
+                             "on it rather than on the random histories")
+    args = parser.parse_args()
+
+    engines = [engine for engine in args.engines.split(",") if engine]
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown:
+        parser.error("unknown engines: %s" % ",".join(unknown))
+
+    timings = OrderedDict()
+    results = fuzz(range(args.start_seed, args.start_seed + args.seeds), engines, timings)
+    for seed, (engine, bucket_size_days, num_buckets, additional_filter), history in results:
+        print("seed %d: %s differs from the reference for bucket_size_days=%s num_buckets=%s additional_filter=%r"
+              % (seed, engine, bucket_size_days, num_buckets, additional_filter))
+        print(format_history(history))
+    print("%d of %d histories failed" % (len(results), args.seeds))
+
+    if args.reviews:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.anki2")
+        conn = create_collection(path, args.reviews)
+        try:
+            timings = OrderedDict()
+            failures = check(Table(conn), engines, [(1, 31), (7, 52), (31, None)], [None], timings=timings)
+            for engine, bucket_size_days, num_buckets, additional_filter in failures:
+                print("%s differs from the reference on the synthetic collection for bucket_size_days=%s "
+                      "num_buckets=%s" % (engine, bucket_size_days, num_buckets))
+            results.extend(failures)
+        finally:
+            conn.close()
+            os.remove(path)
+
+    print_speedups(timings)
+    if results:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
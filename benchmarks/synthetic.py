@@ -0,0 +1,129 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generates synthetic Anki collections with realistic review logs for benchmarking."""
+
+import random
+import sqlite3
+
+
+# 4 am on 2020-09-14 (UTC)
+DAY_CUTOFF_SECONDS = 1600056000
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS revlog (
+    id integer primary key,
+    cid integer not null,
+    usn integer not null,
+    ease integer not null,
+    ivl integer not null,
+    lastIvl integer not null,
+    factor integer not null,
+    time integer not null,
+    type integer not null
+);
+CREATE INDEX IF NOT EXISTS ix_revlog_usn ON revlog (usn);
+CREATE INDEX IF NOT EXISTS ix_revlog_cid ON revlog (cid);
+CREATE TABLE IF NOT EXISTS cards (
+    id integer primary key,
+    did integer not null
+);
+CREATE TABLE IF NOT EXISTS col (
+    id integer primary key,
+    crt integer not null
+);
+"""
+
+
+def _card_reviews(rng, cid, start_ms, end_ms):
+    """Yields the reviews (id, ease, ivl, lastIvl, type) of a card first studied at start_ms.  The card goes through
+    the learning steps, graduates, and is then reviewed at growing intervals with the occasional lapse followed by
+    relearning.  A few reviews happen in filtered decks, and a few have an incorrect lastIvl, as happens in real
+    collections."""
+
+    t = start_ms
+    ivl = -60
+    while t < end_ms:
+        lastIvl = ivl
+        if rng.random() < 0.02:
+            lastIvl = rng.choice([0, -600, 1, 30])
+
+        if rng.random() < 0.03:
+            # Reviewed early in a filtered deck, which may not change the interval
+            _type, ease = 3, 3
+            ivl = rng.choice([0, ivl])
+        elif ivl <= 0:
+            # Learning (or relearning after a lapse)
+            _type = 0 if lastIvl == -60 or t - cid < 86400000 else 2
+            ease = rng.choice([1, 3, 3, 3, 4])
+            ivl = -600 if ease == 1 else rng.choice([-600, 1, 1, 3])
+        elif rng.random() < 0.1:
+            # Lapse
+            _type, ease = 1, 1
+            ivl = -600
+        else:
+            _type, ease = 1, rng.choice([2, 3, 3, 4])
+            ivl = max(ivl + 1, int(ivl * rng.uniform(1.8, 2.8)))
+
+        yield t, ease, ivl, lastIvl, _type
+
+        if ivl > 0:
+            t += ivl * 86400000 + rng.randrange(-4 * 3600000, 8 * 3600000)
+        else:
+            t += rng.randrange(60000, 36 * 3600000)
+
+
+def generate_reviews(num_reviews, seed=0, num_days=3650, num_decks=10, end_seconds=DAY_CUTOFF_SECONDS):
+    """Yields (card, reviews) where card is (cid, did) and reviews is a list of revlog rows, until about num_reviews
+    reviews have been generated over the num_days days before end_seconds.  The same seed always generates the same
+    reviews."""
+
+    rng = random.Random(seed)
+    end_ms = end_seconds * 1000
+    start_ms = end_ms - num_days * 86400000
+    total = 0
+    while total < num_reviews:
+        # Bias the start times toward the present, as collections tend to grow.
+        start = end_ms - int((end_ms - start_ms) * rng.random() ** 1.5)
+        cid = start - rng.randrange(1, 30 * 86400000)
+        reviews = [(_id, cid, -1, ease, ivl, lastIvl, 2500, rng.randrange(2000, 20000), _type)
+                   for _id, ease, ivl, lastIvl, _type in _card_reviews(rng, cid, start, end_ms)]
+        total += len(reviews)
+        yield (cid, rng.randrange(num_decks) + 1), reviews
+
+
+def create_collection(path, num_reviews, seed=0, num_days=3650, end_seconds=DAY_CUTOFF_SECONDS, **kwargs):
+    """Creates a SQLite database at path with revlog and cards tables holding about num_reviews synthetic reviews
+    (see generate_reviews) and returns its connection.  The col table holds the creation time of the collection,
+    num_days before end_seconds."""
+
+    kwargs.update(num_days=num_days, end_seconds=end_seconds)
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    cards = []
+    reviews = []
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO col VALUES (1, ?)", (end_seconds - num_days * 86400,))
+        for card, card_reviews in generate_reviews(num_reviews, seed, **kwargs):
+            cards.append(card)
+            reviews.extend(card_reviews)
+            if len(reviews) >= 100000:
+                conn.executemany("INSERT OR IGNORE INTO cards VALUES (?, ?)", cards)
+                conn.executemany("INSERT OR IGNORE INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", reviews)
+                cards = []
+                reviews = []
+        conn.executemany("INSERT OR IGNORE INTO cards VALUES (?, ?)", cards)
+        conn.executemany("INSERT OR IGNORE INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", reviews)
+    conn.execute("ANALYZE")
+    return conn
@@ -0,0 +1,76 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import traceback
+
+from .db import Cancelled, ReadOnlyTable
+
+
+class StatsJob:
+    """Runs compute(db_table) in a worker thread, where db_table is a ReadOnlyTable for the collection at path, and
+    then calls on_done with the result, or on_error with the exception if compute fails.  Neither is called if the
+    job is cancelled first.  The callbacks are called in the worker thread.
+
+    open_table is an (optional) function called in the worker thread with path that returns the db_table instead,
+    e.g. a CollectionTable for a collection open in Anki.  It is closed once compute returns."""
+
+    def __init__(self, path, compute, on_done, on_error=None, open_table=ReadOnlyTable):
+        self.path = path
+        self.open_table = open_table
+        self.compute = compute
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+        self._db_table = None
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="progress_stats")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """Cancels the job.  A query that is running is interrupted, but the rest of the computation can't be, so
+        the thread may keep running for a little while."""
+        with self._lock:
+            self.cancelled.set()
+            if self._db_table:
+                self._db_table.cancel()
+
+    def _run(self):
+        try:
+            with self._lock:
+                if self.cancelled.is_set():
+                    return
+                self._db_table = self.open_table(self.path)
+            try:
+                result = self.compute(self._db_table)
+            finally:
+                with self._lock:
+                    self._db_table.close()
+                    self._db_table = None
+        except Cancelled:
+            return
+        except Exception as e:
+            if not self.cancelled.is_set():
+                if self.on_error:
+                    self.on_error(e)
+                else:
+                    traceback.print_exc()
+            return
+
+        if not self.cancelled.is_set():
+            self.on_done(result)
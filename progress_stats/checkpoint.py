@@ -0,0 +1,313 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+
+from .compute import ProgressStats, BucketStats, _StatsAccumulator, _bucket_index, _first_learned, _max_usn, \
+    _review_filters, _reviews_query
+from .profile import NO_PROFILE
+
+
+# Bumped whenever the schema changes, so that checkpoints saved by earlier versions are discarded.
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY,
+    bucket_size_days REAL NOT NULL,
+    day_cutoff_seconds REAL NOT NULL,
+    num_buckets INTEGER NOT NULL,
+    additional_filter TEXT NOT NULL,
+    high_water_id INTEGER NOT NULL,
+    max_usn INTEGER NOT NULL,
+    card_fingerprint TEXT NOT NULL,
+    UNIQUE (bucket_size_days, num_buckets, additional_filter)
+);
+CREATE TABLE IF NOT EXISTS card_state (
+    checkpoint_id INTEGER NOT NULL,
+    cid INTEGER NOT NULL,
+    first_learned_id INTEGER,
+    bucket_index INTEGER,
+    start_ivl INTEGER,
+    end_ivl INTEGER,
+    PRIMARY KEY (checkpoint_id, cid)
+);
+CREATE TABLE IF NOT EXISTS bucket_stats (
+    checkpoint_id INTEGER NOT NULL,
+    bucket_index INTEGER NOT NULL,
+    matured_cards INTEGER NOT NULL,
+    matured_reviews INTEGER NOT NULL,
+    lost_matured_card INTEGER NOT NULL,
+    learned_cards INTEGER NOT NULL,
+    PRIMARY KEY (checkpoint_id, bucket_index)
+);
+"""
+
+
+# The cids are summed modulo this prime for the fingerprint of the cards, the same as for the rollup.
+_FINGERPRINT_MOD = 1000003
+
+
+def _card_fingerprint(db_table, additional_filter):
+    """Returns the number of cards matching additional_filter and the sum of their ids, which changes when cards are
+    moved into or out of the decks it selects, or "" if there's no filter.  Returns None if additional_filter refers
+    to revlog columns other than cid, as then only reading the reviews would tell if they changed."""
+
+    if not additional_filter:
+        return ""
+    try:
+        row = db_table.all("SELECT count(), sum(cid %% %d) FROM (SELECT id AS cid FROM cards) rl WHERE %s" % (
+            _FINGERPRINT_MOD, additional_filter))[0]
+    except Exception:
+        return None
+    return ",".join(str(value or 0) for value in row)
+
+
+def _unchanged(db_table, high_water_id, max_usn):
+    """Returns whether revlog still has the review at high_water_id, which undo deletes before any older review, and
+    no review at or below it has a usn larger than max_usn, which a sync gives the reviews it brings in or sends.
+    Both are looked up through the id and usn indexes without reading the other reviews."""
+
+    # Using +id keeps SQLite from going through the reviews in id order rather than using the usn index.
+    kept, synced = db_table.all(
+        """SELECT EXISTS (SELECT 1 FROM revlog WHERE id = %d),
+                  EXISTS (SELECT 1 FROM revlog WHERE usn > %d AND +id <= %d)"""
+        % (high_water_id, max_usn, high_water_id))[0]
+    return bool(kept) and not synced
+
+
+class StatsCheckpoint:
+    """Computes the same stats as get_stats but saves the per-card state and per-bucket stats in a sidecar SQLite
+    database, along with the largest review id processed so far (the high water mark).  Later calls with the same
+    arguments only fetch the reviews above the high water mark and merge them into the saved state.
+
+    The saved state is discarded and rebuilt from scratch when the review at the high water mark has been deleted
+    (e.g. undone), when a sync has brought in or sent any review at or below it, when cards have been moved into or
+    out of the decks selected by additional_filter, or when the day cutoff changes.  These are checked through the
+    indexes without reading the reviews, so reviews rewritten or deleted by a tool are only noticed once the day
+    cutoff changes.  Only the latest checkpoint is kept for each
+    combination of bucket_size_days, num_buckets and additional_filter.  The rollup (see rollup.py) keeps its state
+    by day instead, so it is still used after the day cutoff moves.
+
+    path is the path of the sidecar database.  By default the checkpoints are only kept in memory.
+
+    A StatsCheckpoint may be used from any thread, but only from one thread at a time.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            self.conn.executescript("""\
+              DROP TABLE IF EXISTS checkpoint;
+              DROP TABLE IF EXISTS card_state;
+              DROP TABLE IF EXISTS bucket_stats;
+              PRAGMA user_version = %d;""" % _SCHEMA_VERSION)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get_stats(self, db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+        """Returns the same result as get_stats for these arguments."""
+
+        return self.get_multi_stats(
+            db_table, [(bucket_size_days, num_buckets)], day_cutoff_seconds, additional_filter=additional_filter)[
+                (bucket_size_days, num_buckets)]
+
+    def get_multi_stats(self, db_table, bucket_sizes, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                        profile=None):
+        """Returns the same result as get_multi_stats for these arguments.  The reviews needed to bring all the
+        checkpoints up to date are fetched with a single query.
+
+        The profile records the load checkpoint, query, aggregate and save checkpoint phases."""
+
+        if profile is None:
+            profile = NO_PROFILE
+
+        day_cutoff_ms = int(day_cutoff_seconds * 1000)
+
+        with profile.phase("load checkpoint"):
+            # Looked up once for all the views, and saved with them.
+            max_usn = _max_usn(db_table)
+            card_fingerprint = _card_fingerprint(db_table, additional_filter)
+            views = []
+            for item in bucket_sizes:
+                bucket_size_days, view_num_buckets = item if isinstance(item, tuple) else (item, num_buckets)
+                views.append(_View(self, db_table, item, bucket_size_days, view_num_buckets, day_cutoff_seconds,
+                                   additional_filter, max_usn, card_fingerprint))
+
+        with profile.phase("query") as phase:
+            # Fetch everything any of the views still needs to process.
+            start_ids = [view.start_id() for view in views]
+            filters = []
+            if start_ids and None not in start_ids:
+                filters.append("rl.id >= %d" % min(start_ids))
+            if additional_filter:
+                filters.append(additional_filter)
+            reviews = db_table.all(_reviews_query(1, day_cutoff_seconds, filters))
+            phase.rows = len(reviews)
+
+        with profile.phase("aggregate") as phase:
+            for view in views:
+                view.add_reviews(db_table, reviews, day_cutoff_ms)
+
+            multi_stats = dict((view.item, view.accumulator.stats_by_name(view.num_buckets)) for view in views)
+            phase.rows = len(reviews)
+            phase.buckets = sum(len(stats.get("learned_cards", ())) for stats in multi_stats.values())
+
+        with profile.phase("save checkpoint"):
+            with self.conn:
+                for view in views:
+                    view.save()
+
+        return multi_stats
+
+    def _load(self, checkpoint_id, id_cutoff, high_water_id):
+        accumulator = _StatsAccumulator(id_cutoff)
+        accumulator.high_water_id = high_water_id
+
+        for cid, first_learned_id, bucket_index, start_ivl, end_ivl in self.conn.execute(
+                """SELECT cid, first_learned_id, bucket_index, start_ivl, end_ivl FROM card_state
+                   WHERE checkpoint_id = ?""", (checkpoint_id,)):
+            if first_learned_id is not None:
+                accumulator.first_learned[cid] = first_learned_id
+            if bucket_index is not None:
+                accumulator.card_state[cid] = [bucket_index, start_ivl, end_ivl]
+
+        for bucket_index, matured_cards, matured_reviews, lost_matured_card, learned_cards in self.conn.execute(
+                """SELECT bucket_index, matured_cards, matured_reviews, lost_matured_card, learned_cards
+                   FROM bucket_stats WHERE checkpoint_id = ?""", (checkpoint_id,)):
+            stats = ProgressStats()
+            stats.matured_cards = matured_cards
+            stats.matured_reviews = matured_reviews
+            stats.lost_matured_card = lost_matured_card
+            stats.learned_cards = learned_cards
+            accumulator.stats_by_bucket[bucket_index] = BucketStats(bucket_index=bucket_index, stats=stats)
+
+        return accumulator
+
+    def _create(self, key, day_cutoff_seconds):
+        # Replace any earlier checkpoint for the same arguments, which is no longer valid.
+        for (old_checkpoint_id,) in self.conn.execute(
+                """SELECT id FROM checkpoint
+                   WHERE bucket_size_days = ? AND num_buckets = ? AND additional_filter = ?""", key).fetchall():
+            self.conn.execute("DELETE FROM card_state WHERE checkpoint_id = ?", (old_checkpoint_id,))
+            self.conn.execute("DELETE FROM bucket_stats WHERE checkpoint_id = ?", (old_checkpoint_id,))
+            self.conn.execute("DELETE FROM checkpoint WHERE id = ?", (old_checkpoint_id,))
+
+        return self.conn.execute(
+            """INSERT INTO checkpoint (bucket_size_days, num_buckets, additional_filter, day_cutoff_seconds,
+                                       high_water_id, max_usn, card_fingerprint)
+               VALUES (?, ?, ?, ?, 0, -1, '')""", key + (day_cutoff_seconds,)).lastrowid
+
+    def _save(self, checkpoint_id, accumulator, cids, bucket_indexes, max_usn, card_fingerprint):
+        """Saves the state for the cards and buckets that changed."""
+
+        card_rows = []
+        for cid in cids:
+            state = accumulator.card_state.get(cid) or [None, None, None]
+            card_rows.append((checkpoint_id, cid, accumulator.first_learned.get(cid)) + tuple(state))
+        self.conn.executemany("INSERT OR REPLACE INTO card_state VALUES (?, ?, ?, ?, ?, ?)", card_rows)
+
+        bucket_rows = []
+        for bucket_index in bucket_indexes:
+            bucket_stats = accumulator.stats_by_bucket.get(bucket_index)
+            if bucket_stats:
+                stats = bucket_stats.stats
+                bucket_rows.append((checkpoint_id, bucket_index, stats.matured_cards, stats.matured_reviews,
+                                    stats.lost_matured_card, stats.learned_cards))
+        self.conn.executemany("INSERT OR REPLACE INTO bucket_stats VALUES (?, ?, ?, ?, ?, ?)", bucket_rows)
+
+        self.conn.execute(
+            "UPDATE checkpoint SET high_water_id = ?, max_usn = ?, card_fingerprint = ? WHERE id = ?",
+            (accumulator.high_water_id, max_usn, card_fingerprint, checkpoint_id))
+
+
+class _View:
+    "The checkpoint for one bucket size and number of buckets within StatsCheckpoint.get_multi_stats."
+
+    def __init__(self, checkpoint, db_table, item, bucket_size_days, num_buckets, day_cutoff_seconds,
+                 additional_filter, max_usn, card_fingerprint):
+        self.checkpoint = checkpoint
+        self.item = item
+        self.num_buckets = num_buckets
+        self.bucket_ms = int(bucket_size_days * 86400000)
+        self.day_cutoff_seconds = day_cutoff_seconds
+        self.additional_filter = additional_filter
+        self.max_usn = max_usn
+        self.card_fingerprint = card_fingerprint
+        self.id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets,
+                                                  additional_filter)
+        self.key = (bucket_size_days, num_buckets or 0, additional_filter or "")
+        self.cids = set()
+        self.bucket_indexes = set()
+
+        self.checkpoint_id = None
+        self.accumulator = None
+        row = checkpoint.conn.execute(
+            """SELECT id, day_cutoff_seconds, high_water_id, max_usn, card_fingerprint FROM checkpoint
+               WHERE bucket_size_days = ? AND num_buckets = ? AND additional_filter = ?""", self.key).fetchone()
+        if row and card_fingerprint is not None:
+            checkpoint_id, checkpoint_day_cutoff_seconds, high_water_id, checkpoint_max_usn, \
+                checkpoint_card_fingerprint = row
+            if checkpoint_day_cutoff_seconds == day_cutoff_seconds and \
+                    checkpoint_card_fingerprint == card_fingerprint and \
+                    _unchanged(db_table, high_water_id, checkpoint_max_usn):
+                self.checkpoint_id = checkpoint_id
+                self.accumulator = checkpoint._load(checkpoint_id, self.id_cutoff, high_water_id)
+
+        if self.accumulator is None:
+            self.accumulator = _StatsAccumulator(
+                self.id_cutoff, _first_learned(db_table, self.id_cutoff, additional_filter))
+
+    def start_id(self):
+        "Returns the first id that needs to be fetched, or None if all the reviews are needed."
+        if self.checkpoint_id is not None:
+            return self.accumulator.high_water_id + 1
+        return self.id_cutoff
+
+    def add_reviews(self, db_table, reviews, day_cutoff_ms):
+        accumulator = self.accumulator
+        start_id = self.start_id() or 0
+
+        if self.checkpoint_id is not None:
+            # Look up when any cards graphed for the first time were learned.
+            new_cids = set(review[2] for review in reviews if review[0] >= start_id) - \
+                accumulator.card_state.keys() - accumulator.first_learned.keys()
+            accumulator.first_learned.update(
+                _first_learned(db_table, self.id_cutoff, self.additional_filter, new_cids))
+
+        for _id, _, cid, ease, ivl, lastIvl, _type in reviews:
+            if _id < start_id:
+                continue
+            bucket_index = _bucket_index(_id, day_cutoff_ms, self.bucket_ms)
+            accumulator.add(_id, bucket_index, cid, ivl, lastIvl)
+            self.cids.add(cid)
+            self.bucket_indexes.add(bucket_index)
+
+    def save(self):
+        accumulator = self.accumulator
+        if accumulator.high_water_id is None or self.card_fingerprint is None:
+            # Nothing to save, or a checkpoint that could never be reused.
+            return
+
+        cids = self.cids
+        bucket_indexes = self.bucket_indexes
+        if self.checkpoint_id is None:
+            self.checkpoint_id = self.checkpoint._create(self.key, self.day_cutoff_seconds)
+            cids = accumulator.first_learned.keys() | accumulator.card_state.keys()
+            bucket_indexes = accumulator.stats_by_bucket.keys()
+
+        self.checkpoint._save(self.checkpoint_id, accumulator, cids, bucket_indexes, self.max_usn,
+                              self.card_fingerprint)
@@ -0,0 +1,94 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+
+
+class CidIndex:
+    """The cids of the cards behind each metric in each bucket, filled in by get_stats or get_metric_stats while
+    they compute the stats, so that the cards behind a count (e.g. the matured cards lost in bucket -3) can be looked
+    up without reading the reviews again.  A card is in the index for a metric and bucket if its reviews in the bucket
+    added anything to the metric, so for net_matured_cards these are the cards that matured or lost maturity.
+
+    The cids are kept as sorted arrays of 64-bit ints, which take 8 bytes per cid and can be combined across buckets
+    and metrics with union, intersection and difference.  The index pickles to about the same size, so it can be
+    cached along with the stats.
+
+    metric_names: The names of the metrics to index, or None for all the metrics computed.
+    cids_by_name: Maps the name of each indexed metric to a dict mapping bucket_index to the sorted array of cids.
+    """
+
+    def __init__(self, metric_names=None):
+        self.metric_names = metric_names
+        self.cids_by_name = {}
+
+    def indexes(self, name):
+        return self.metric_names is None or name in self.metric_names
+
+    def add(self, name, bucket_index, cid):
+        "Adds a cid for the metric and bucket, in any order.  finish() must be called once all the cids are added."
+        cids_by_bucket = self.cids_by_name.get(name)
+        if cids_by_bucket is None:
+            cids_by_bucket = self.cids_by_name[name] = {}
+        cids = cids_by_bucket.get(bucket_index)
+        if cids is None:
+            cids = cids_by_bucket[bucket_index] = array('q')
+        cids.append(cid)
+
+    def finish(self):
+        "Sorts the cids added for each metric and bucket."
+        for cids_by_bucket in self.cids_by_name.values():
+            for bucket_index, cids in cids_by_bucket.items():
+                cids_by_bucket[bucket_index] = array('q', sorted(set(cids)))
+
+    def cids(self, name, bucket_index):
+        "Returns the sorted array of the cids for the metric in the bucket, which is empty if there are none."
+        return self.cids_by_name.get(name, {}).get(bucket_index, array('q'))
+
+    def bucket_indexes(self, name):
+        "Returns the indexes of the buckets with any cids for the metric, in ascending order."
+        return sorted(self.cids_by_name.get(name, ()))
+
+    def cids_in_buckets(self, name, bucket_indexes):
+        "Returns the sorted array of the cids for the metric in any of the buckets, e.g. a range of them."
+        return union(*[self.cids(name, bucket_index) for bucket_index in bucket_indexes])
+
+    def __eq__(self, other):
+        return isinstance(other, CidIndex) and self.cids_by_name == other.cids_by_name
+
+    def __repr__(self):
+        return "CidIndex(%r)" % self.cids_by_name
+
+
+def union(*cid_arrays):
+    "Returns the sorted array of the cids in any of the sorted arrays of cids."
+    if len(cid_arrays) == 1:
+        return array('q', cid_arrays[0])
+    return array('q', sorted(set().union(*cid_arrays)))
+
+
+def intersection(*cid_arrays):
+    """Returns the sorted array of the cids in all of the sorted arrays of cids, e.g. the cards that matured in one
+    bucket and were lost in another."""
+    if not cid_arrays:
+        return array('q')
+    smallest = min(cid_arrays, key=len)
+    others = [set(cids) for cids in cid_arrays if cids is not smallest]
+    return array('q', [cid for cid in smallest if all(cid in cids for cids in others)])
+
+
+def difference(cids, *other_cid_arrays):
+    "Returns the sorted array of the cids in the sorted array cids that aren't in any of the others."
+    others = set().union(*other_cid_arrays)
+    return array('q', [cid for cid in cids if cid not in others])
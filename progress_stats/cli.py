@@ -0,0 +1,206 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Computes the progress stats for many Anki collections without Anki, using a pool of processes.  The collections
+are opened read-only.  The stats for each collection are written as soon as they are ready, one JSON object per
+line or as CSV rows.  A collection that can't be read is reported in the output without stopping the run.
+
+Unless --live is given the collections must not be in use while the stats are computed.
+
+Usage: python -m progress_stats.cli [--bucket-size-days 7] [--num-buckets 52] [--format jsonl|csv]
+                                    [--output stats.jsonl] collection.anki2|directory ...
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+from .compute import get_stats
+from .db import ReadOnlyTable
+
+
+CSV_FIELDS = ["path", "name", "bucket_index", "value", "error"]
+
+
+def collection_paths(paths):
+    "Yields the paths of the collections, looking for .anki2 files within any directories."
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith(".anki2"):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+
+def _scheduler_conf(db_table):
+    """Returns a dict with the collection's schedVer and rollover settings, where present.  These are in the JSON in
+    col.conf before schema 15 and in the config table from then on."""
+
+    conf = {}
+    try:
+        conf.update(json.loads(db_table.all("SELECT conf FROM col")[0][0] or "{}"))
+    except (sqlite3.Error, ValueError):
+        pass
+    try:
+        for key, val in db_table.all("SELECT key, val FROM config WHERE key IN ('schedVer', 'rollover')"):
+            conf[key] = json.loads(val)
+    except (sqlite3.Error, ValueError):
+        pass
+    return conf
+
+
+def day_cutoff_seconds(db_table, now=None):
+    """Returns the cutoff for the start of the next day for the collection, the same way as Anki's scheduler.  With
+    the v2 scheduler that is the next time it is the collection's rollover hour (4 am unless changed) in the local
+    time zone.  With the v1 scheduler, or if the collection has no scheduler settings, it is a whole number of days
+    after the collection's creation time."""
+
+    now = time.time() if now is None else now
+    conf = _scheduler_conf(db_table)
+    if conf.get("schedVer", 1) >= 2:
+        rollover = conf.get("rollover", 4)
+        if rollover < 0:
+            rollover += 24
+        cutoff = datetime.datetime.fromtimestamp(now).replace(hour=rollover, minute=0, second=0, microsecond=0)
+        if time.mktime(cutoff.timetuple()) <= now:
+            cutoff += datetime.timedelta(days=1)
+        return int(time.mktime(cutoff.timetuple()))
+
+    crt = db_table.all("SELECT crt FROM col")[0][0]
+    return crt + ((int(now) - crt) // 86400 + 1) * 86400
+
+
+def compute(path, bucket_size_days, num_buckets=None, day_cutoff=None, engine="python", immutable=True):
+    """Returns a dict with the stats for the collection at path, or the error if they can't be computed, along with
+    the time it took."""
+
+    start = time.perf_counter()
+    result = dict(path=path)
+    try:
+        with ReadOnlyTable(path, immutable) as db_table:
+            cutoff = day_cutoff or day_cutoff_seconds(db_table)
+            stats = get_stats(db_table, bucket_size_days, cutoff, num_buckets, engine=engine)
+        result["day_cutoff_seconds"] = cutoff
+        result["stats"] = dict(stats)
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _compute(args):
+    return compute(*args)
+
+
+class JsonLinesWriter:
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, result):
+        self.f.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+class CsvWriter:
+    "Writes a row for each stat and bucket of each collection, or a single row with the error."
+
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+        self.writer.writerow(CSV_FIELDS)
+
+    def write(self, result):
+        if "error" in result:
+            self.writer.writerow([result["path"], "", "", "", result["error"]])
+            return
+        for name in sorted(result["stats"]):
+            for bucket_index, value in result["stats"][name]:
+                self.writer.writerow([result["path"], name, bucket_index, value, ""])
+
+
+WRITERS = {"jsonl": JsonLinesWriter, "csv": CsvWriter}
+
+
+def run(paths, writer, bucket_size_days, num_buckets=None, day_cutoff=None, engine="python", processes=None,
+        immutable=True):
+    """Computes the stats for each collection in paths with a pool of processes and writes each result as it arrives,
+    in no particular order.  Returns (number of collections, number that failed).
+
+    immutable opens the collections as files that can't change, which is faster but only safe if they aren't in use
+    (see ReadOnlyTable)."""
+
+    tasks = [(path, bucket_size_days, num_buckets, day_cutoff, engine, immutable) for path in collection_paths(paths)]
+    num_failed = 0
+
+    if processes == 1:
+        results = map(_compute, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_compute, tasks)
+
+    try:
+        for result in results:
+            if "error" in result:
+                num_failed += 1
+            writer.write(result)
+    finally:
+        if pool:
+            pool.terminate()
+
+    return len(tasks), num_failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="collections, or directories to search for .anki2 files")
+    parser.add_argument("--bucket-size-days", type=float, default=7)
+    parser.add_argument("--num-buckets", type=int, help="number of buckets, or all the reviews if not given")
+    parser.add_argument("--day-cutoff", type=float,
+                        help="start of the next day in seconds since epoch (default: from each collection's "
+                             "scheduler settings, the rollover hour in local time for the v2 scheduler)")
+    parser.add_argument("--engine", default="python")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--output", help="file to write the results to (default: stdout)")
+    parser.add_argument("--processes", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--live", action="store_true",
+                        help="the collections may be in use, so don't assume they can't change while being read")
+    args = parser.parse_args(argv)
+
+    f = open(args.output, "w", newline="") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        num_collections, num_failed = run(args.paths, WRITERS[args.format](f), args.bucket_size_days,
+                                          args.num_buckets, args.day_cutoff, args.engine, args.processes,
+                                          not args.live)
+    finally:
+        if args.output:
+            f.close()
+    elapsed = time.perf_counter() - start
+
+    print("%d collections (%d failed) in %.1fs: %.1f collections/s" % (
+        num_collections, num_failed, elapsed, num_collections / elapsed if elapsed else 0), file=sys.stderr)
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,15 +14,9 @@
 
 from collections import namedtuple, defaultdict
 
-
-# an individual review of a card with a bucket_index representing the time period the review
-# occurred in (e.g. which day, month, etc.)
-CardReview = namedtuple('CardReview', ['id', 'first_learned_id', 'bucket_index', 'cid', 'ease',
-                        'ivl', 'lastIvl', 'type'])
-
-
-# all the reviews for a particular card and length of time (e.g. day, week, etc.)
-CardReviewsForBucket = namedtuple('CardReviewsForBucket', ['bucket_index', 'cid', 'reviews'])
+from .latency import LatencyHistogram
+from .profile import NO_PROFILE
+from .review_store import ReviewStore
 
 
 class ProgressStats:
@@ -48,45 +42,119 @@ class ProgressStats:
 BucketStats = namedtuple('BucketStats', ['bucket_index', 'stats'])
 
 
-def _get_reviews(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
-    """Fetches all the reviews over a period of time and buckets them by (bucket_index, cid), where
-    cid is the card ID and bucket_index where 0 is today, -1 is yesterday, etc.
-
-    bucket_size_days represents the size of each bucket measusured in days.  So a value of 1 buckets per day,
-    a value of 7 buckets per week, etc.
-
-    day_cutoff_seconds is the cutoff measured in seconds since epoch for the start of the next day.  So, for example,
-    if the cutoff is 4 am then this should be tomorrow at 4 am.
-
-    num_buckets is the (optional) number of buckets, which indicates how many reviews to fetch.  Enough reviews are
-    fetched to fill all the buckets.  So, for example, if bucket_size_days is 1 and num_buckets is 30 this fetches
-    the last month of reviews.
-
-    db_table is the table used to fetch from the review logs.
-
-    additional_filter is an (optiona) filter added to the SQL WHERE clause that limits which reviews to fetch.
-    This can be used to limit the reviews to a particular deck, for example.
+def _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+    """Returns a tuple (id_cutoff, filters) where filters are the conditions for the SQL WHERE clause that selects
+    the reviews that will be graphed and id_cutoff is the earliest review id that will be graphed (or None if all
+    reviews are graphed).  Reviews before id_cutoff are only needed to determine when each card was first learned,
+    which _first_learned looks up separately.
     """
 
     # Set up the overall WHERE clause for the query, which filters out reviews older than the desired time window
     # and includes whatever other additional filters where provided (e.g. filter on cards belonging to a particular
-    # deck).
+    # deck).  The time window is a range on the primary key so SQLite only has to read the reviews in the window.
 
-    # The earlier time that will be used for graphing.  Any reviews earlier than this are only used to determine
-    # when each card was first learned.
+    # The earlier time that will be used for graphing.
     id_cutoff = None
 
     filters = []
     if num_buckets:
         id_cutoff = (day_cutoff_seconds - (bucket_size_days * num_buckets * 86400)) * 1000
-        # Get all recent reviews and any earlier reviews where the card was learned.  We need to query
-        # earlier reviews because Anki's type does not appear to be reliable.  That is, you can't assume
-        # that if the type is learning (type = 0) and the ivl becomes positive that this means the card
-        # was learned for the first time.
-        filters.append("(rl.id >= %d OR (rl.id < %d AND rl.ivl > 0 AND rl.lastIvl < 0))" % (id_cutoff, id_cutoff))
+        filters.append("rl.id >= %d" % id_cutoff)
+    if additional_filter:
+        filters.append(additional_filter)
+
+    return id_cutoff, filters
+
+
+def _where_clause(filters):
+    return "WHERE %s" % (" AND ".join(filters)) if filters else ""
+
+
+def _first_learned_query(id_cutoff, additional_filter=None, cids=None):
+    """Returns the query for the id where each card was first learned, for the cards that were first learned before
+    id_cutoff and that have reviews at or after id_cutoff (or just the cards in cids if provided)."""
+
+    # We need to query earlier reviews because Anki's type does not appear to be reliable.  That is, you can't
+    # assume that if the type is learning (type = 0) and the ivl becomes positive that this means the card
+    # was learned for the first time.
+    filters = ["rl.ivl > 0", "rl.lastIvl < 0", "rl.id < %d" % id_cutoff]
     if additional_filter:
         filters.append(additional_filter)
-    where_clause = "WHERE %s" % (" AND ".join(filters)) if filters else ""
+    if cids is None:
+        graphed_filters = ["rl.id >= %d" % id_cutoff]
+        if additional_filter:
+            graphed_filters.append(additional_filter)
+        filters.append("rl.cid IN (SELECT rl.cid FROM revlog rl %s)" % _where_clause(graphed_filters))
+    else:
+        filters.append("rl.cid IN (%s)" % ",".join(str(cid) for cid in cids))
+
+    return """\
+      SELECT rl.cid, min(rl.id)
+      FROM revlog rl
+      %s
+      GROUP BY rl.cid;
+      """ % _where_clause(filters)
+
+
+def _first_learned(db_table, id_cutoff, additional_filter=None, cids=None):
+    """Returns a dict mapping cid to the id where the card was first learned, for the cards that were first learned
+    before id_cutoff (see _first_learned_query).  This is empty if there is no id_cutoff."""
+
+    if not id_cutoff or (cids is not None and not cids):
+        return {}
+    return dict(db_table.all(_first_learned_query(id_cutoff, additional_filter, cids)))
+
+
+# Name of the optional index that speeds up _first_learned.
+_first_learned_index = "ix_revlog_progress_stats_first_learned"
+
+
+def create_first_learned_index(db_table):
+    """Creates an optional partial index on revlog covering only the reviews where a card left the learning phase.
+    With this index the first learned lookup reads only those reviews for the cards being graphed rather than
+    scanning all the earlier reviews."""
+
+    db_table.all("CREATE INDEX IF NOT EXISTS %s ON revlog (cid, id) WHERE ivl > 0 AND lastIvl < 0"
+                 % _first_learned_index)
+
+
+def drop_first_learned_index(db_table):
+    "Drops the index created by create_first_learned_index, if it exists."
+    db_table.all("DROP INDEX IF EXISTS %s" % _first_learned_index)
+
+
+def revlog_fingerprint(db_table, additional_filter=None):
+    """Returns a tuple (max id, count) for the reviews matching additional_filter.  This is cheap to compute and
+    changes whenever reviews are added or deleted, so it can be used to check if stats computed earlier are still
+    current."""
+
+    return tuple(db_table.all("SELECT max(rl.id), count() FROM revlog rl %s" % _where_clause(
+        [additional_filter] if additional_filter else []))[0])
+
+
+def _max_usn(db_table):
+    """Returns the largest usn in revlog, or -1 if no review has been synced.  A sync sets the usn of the reviews it
+    brings in or sends to one larger than any before, so this grows with each sync.  The ix_revlog_usn index finds it
+    without reading the reviews."""
+    max_usn = db_table.all("SELECT max(usn) FROM revlog")[0][0]
+    return -1 if max_usn is None else max_usn
+
+
+def _bucket_index_sql(bucket_size_days, day_cutoff_seconds):
+    "Returns the SQL expression for the bucket_index of the review rl."
+
+    # Convert the time to the bucket, where 0 is today (i.e. after the cutoff for today), -1 is yesterday, etc.
+    # Each bucket ends with the review exactly on its boundary, so this rounds up.  Integer division truncates
+    # toward zero, so reviews before and after the cutoff are handled separately.
+    day_cutoff_ms = int(day_cutoff_seconds * 1000)
+    bucket_ms = int(bucket_size_days * 86400000)
+    return "(CASE WHEN rl.id < %d THEN -((%d - rl.id) / %d) ELSE (rl.id - %d) / %d + 1 END)" % (
+        day_cutoff_ms, day_cutoff_ms, bucket_ms, day_cutoff_ms, bucket_ms)
+
+
+def _reviews_query(bucket_size_days, day_cutoff_seconds, filters, limit=None):
+    """Returns the query that fetches the reviews matching filters in ascending id order, or just the first
+    limit of them if limit is provided."""
 
     # id: The time at which the review was conducted, in epoch time (milliseconds)
     # cid: The ID of the card that was reviewed.  Also equals card creation time (milliseconds).
@@ -98,102 +166,156 @@ def _get_reviews(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=Non
     # type: This is 0 for learning cards, 1 for review cards, 2 for relearn cards, and 3 for "cram"
     #       cards (cards being studied in a filtered deck when they are not due).
 
-    # Convert the time to the day, where 0 is today (i.e. after the cutoff for today), -1 is yesterday, etc.
-    # We add 0.5 and round in order to round up.
-
-    query = """\
+    return """\
       SELECT rl.id,
-             CAST(round(( (rl.id/1000.0 - %d) / 86400.0 / %d ) + 0.5) as int)
-               as bucket_index,
+             %s as bucket_index,
              rl.cid, rl.ease, rl.ivl, rl.lastIvl, rl.type
       FROM revlog rl
       %s
-      ORDER BY rl.id ASC;
-      """ % (day_cutoff_seconds, bucket_size_days, where_clause)
+      ORDER BY rl.id ASC
+      %s;
+      """ % (_bucket_index_sql(bucket_size_days, day_cutoff_seconds), _where_clause(filters),
+             "LIMIT %d" % limit if limit else "")
 
-    result = db_table.all(query)
 
-    # Maps cid to the id where the card was first learned.
-    first_learned = {}
+def _bucket_index(_id, day_cutoff_ms, bucket_ms):
+    "Returns the bucket_index of the review with id _id, the same as _bucket_index_sql."
+    if _id < day_cutoff_ms:
+        return -((day_cutoff_ms - _id) // bucket_ms)
+    return (_id - day_cutoff_ms) // bucket_ms + 1
+
+
+def _iter_rows(db_table, query):
+    """Returns an iterable over the rows of the query, which streams the rows from the database if db_table supports
+    it (see ReadOnlyTable.iterate), or else is the list of all the rows."""
+
+    iterate = getattr(db_table, "iterate", None)
+    if iterate:
+        return iterate(query)
+    return db_table.all(query)
+
+
+def _iter_reviews(db_table, bucket_size_days, day_cutoff_seconds, filters, chunk_size):
+    """Yields the reviews matching filters in ascending id order.  Rather than loading all the reviews at once, at
+    most chunk_size reviews are fetched at a time, each chunk starting after the last id of the previous one.  If
+    db_table can stream the rows then a single query is used instead."""
+
+    if getattr(db_table, "iterate", None):
+        for review in db_table.iterate(_reviews_query(bucket_size_days, day_cutoff_seconds, filters)):
+            yield review
+        return
+
+    chunk_filters = filters
+    while True:
+        chunk = db_table.all(_reviews_query(bucket_size_days, day_cutoff_seconds, chunk_filters, limit=chunk_size))
+        for review in chunk:
+            yield review
+        if len(chunk) < chunk_size:
+            return
+        chunk_filters = filters + ["rl.id > %d" % chunk[-1][0]]
+
+
+def _get_reviews(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                 profile=NO_PROFILE):
+    """Fetches all the reviews over a period of time into a ReviewStore, where they are bucketed by
+    (bucket_index, cid), where cid is the card ID and bucket_index where 0 is today, -1 is yesterday, etc.
+
+    bucket_size_days represents the size of each bucket measusured in days.  So a value of 1 buckets per day,
+    a value of 7 buckets per week, etc.
+
+    day_cutoff_seconds is the cutoff measured in seconds since epoch for the start of the next day.  So, for example,
+    if the cutoff is 4 am then this should be tomorrow at 4 am.
+
+    num_buckets is the (optional) number of buckets, which indicates how many reviews to fetch.  Enough reviews are
+    fetched to fill all the buckets.  So, for example, if bucket_size_days is 1 and num_buckets is 30 this fetches
+    the last month of reviews.
 
-    all_reviews_for_bucket = {}
-    for _id, bucket_index, cid, ease, ivl, lastIvl, _type in result:
-        if ivl > 0 and lastIvl < 0 and cid not in first_learned:
-            first_learned[cid] = _id
+    db_table is the table used to fetch from the review logs.
+
+    additional_filter is an (optiona) filter added to the SQL WHERE clause that limits which reviews to fetch.
+    This can be used to limit the reviews to a particular deck, for example.
+    """
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
 
-        # Any ids earlier than the cutoff will not be graphed.  We only queried them to determine the
-        # first time each card was learned.
-        if id_cutoff and _id < id_cutoff:
-            continue
+    # If the rows are streamed then most of the time spent fetching them is counted as bucketing.
+    with profile.phase("query") as phase:
+        # Maps cid to the id where the card was first learned.
+        first_learned = _first_learned(db_table, id_cutoff, additional_filter)
 
-        key = (bucket_index, cid)
-        review = CardReview(id=_id, first_learned_id=first_learned.get(cid),
-                            bucket_index=bucket_index, cid=cid, ease=ease, ivl=ivl,
-                            lastIvl=lastIvl, type=_type)
-        card_reviews = all_reviews_for_bucket.get(key)
-        if not card_reviews:
-            card_reviews = CardReviewsForBucket(bucket_index=bucket_index, cid=cid, reviews=[])
-            all_reviews_for_bucket[key] = card_reviews
-        card_reviews.reviews.append(review)
+        result = _iter_rows(db_table, _reviews_query(bucket_size_days, day_cutoff_seconds, filters))
+        if isinstance(result, list):
+            phase.rows = len(result)
 
-    return all_reviews_for_bucket
+    with profile.phase("bucketing") as phase:
+        store = ReviewStore(first_learned)
+        store.add_rows(result)
+        phase.rows = store.num_reviews()
 
+    return store
 
-def _has_matured(card_reviews, last_ivl):
-    """Check if the card started the length of time as not mature and ended as mature."""
+
+def _has_matured(store, group, last_ivl, threshold=21):
+    """Check if the card started the length of time as not mature and ended as mature.  group is the index of the
+    card's reviews for the length of time in the ReviewStore.  Cards are mature once their interval is at least
+    threshold days."""
 
     # We compare the first and last reviews of the bucket.  If we counted each individual
     # review then this would overcount.  We don't care how many times the card reached
     # maturity during the interval.  We only care if the net change over the interval was
     # becoming mature.
 
-    first_review = card_reviews.reviews[0]
-    last_review = card_reviews.reviews[-1]
-
     # Prefer last_ivl if available because lastIvl isn't always correct (Anki bug?).
     if not last_ivl:
-        last_ivl = first_review.lastIvl
+        last_ivl = store.last_ivls[store.starts[group]]
 
-    return last_ivl < 21 and last_review.ivl >= 21
+    return last_ivl < threshold and store.ivls[store.starts[group + 1] - 1] >= threshold
 
 
-def _num_matured(card_reviews):
+def _num_matured(store, group, threshold=21):
     """Count the number of times the card matured over the length of time.
     This can be greater than one because the card may be forgotten and mature again."""
 
     tot = 0
-    for review in card_reviews.reviews:
-        if review.lastIvl < 21 and review.ivl >= 21:
+    ivls = store.ivls
+    last_ivls = store.last_ivls
+    for i in range(store.starts[group], store.starts[group + 1]):
+        if last_ivls[i] < threshold and ivls[i] >= threshold:
             tot += 1
 
     return tot
 
 
-def _has_lost_matured(card_reviews, last_ivl):
+def _has_lost_matured(store, group, last_ivl, threshold=21):
     "Check if the card has lost maturity for the current length of time."
-    first_review = card_reviews.reviews[0]
-    last_review = card_reviews.reviews[-1]
 
     # Prefer last_ivl if available because lastIvl isn't always correct (Anki bug?).
     if not last_ivl:
-        last_ivl = first_review.lastIvl
+        last_ivl = store.last_ivls[store.starts[group]]
 
-    return last_ivl >= 21 and last_review.ivl < 21
+    return last_ivl >= threshold and store.ivls[store.starts[group + 1] - 1] < threshold
 
 
-def _has_learned(card_reviews):
+def _has_learned(store, group):
     "Check if the card was learned at some point during the length of time."
 
+    first_learned_id = store.first_learned.get(store.cids[group])
+    if first_learned_id is None:
+        return False
+
     # We check each individual review rather than the first and last review of the bucket.
     # If we were to compare the first and last reviews this could give us the wrong result as
     # when the card is relearned the interval will drop below zero again.
-    for review in card_reviews.reviews:
+    ids = store.ids
+    ivls = store.ivls
+    last_ivls = store.last_ivls
+    for i in range(store.starts[group], store.starts[group + 1]):
         # We assume the card is no longer being learned once the new interval is above zero.
         # Learning intervals are in seconds (which is expressed as a negative number).
         # Since a card can be relearned, we compare the id (which is a timestamp) to the id for the first
         # time the card was learned.  If they don't match then this isn't the first time the card was learned.
         # We don't use the type (which indicates learn, relearn, etc.) because it isn't reliable for filtered decks.
-        if review.lastIvl < 0 and review.ivl > 0 and review.id == review.first_learned_id:
+        if last_ivls[i] < 0 and ivls[i] > 0 and ids[i] == first_learned_id:
             return True
 
     return False
@@ -203,7 +325,8 @@ def _new_bucket_stats(bucket_index):
     return BucketStats(bucket_index=bucket_index, stats=ProgressStats())
 
 
-def get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+def get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+              engine="python", profile=None, cid_index=None):
     """Returns progress statistics bucketed by bucket_size_days.  The statistics are:
 
     matured_cards: number of cards that went from young to mature
@@ -226,65 +349,451 @@ def get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None,
 
     additional_filter is an (optiona) filter added to the SQL WHERE clause that limits which reviews to fetch.
     This can be used to limit the reviews to a particular deck, for example.
-    """
 
-    stats_by_name = defaultdict(list)
+    engine selects how the stats are computed.  All engines produce the same stats:
 
-    min_bucket_index = 0
-    if num_buckets:
-        min_bucket_index = -1 * num_buckets + 1
-    max_bucket_index = 0
+    python: fetches all the reviews and then computes the stats.
+    streaming: fetches the reviews in chunks and computes the stats as it goes, so that memory use depends on
+               the number of cards and the reviews in a single bucket rather than on the total number of reviews.
+    sql: computes the stats in the database using window functions so that only the per-bucket counts are
+         fetched.  Falls back to the python engine if the SQLite library doesn't support window functions.
+    numpy: loads the reviews into NumPy arrays and computes the stats with array operations.  Falls back to the
+           python engine if NumPy isn't installed.
+
+    profile is an (optional) StatsProfile that records the time spent in each phase.  The python engine records
+    the query, bucketing and aggregate phases.  The other engines are recorded as a single phase named after the
+    engine.
+
+    cid_index is an (optional) CidIndex to fill in with the cids of the cards behind each stat in each bucket.  The
+    stats are then computed by get_metric_stats whatever the engine.
+    """
+
+    if profile is None:
+        profile = NO_PROFILE
+
+    if cid_index is not None:
+        return get_metric_stats(db_table, bucket_size_days, day_cutoff_seconds, STANDARD_METRICS, num_buckets,
+                                additional_filter, profile, cid_index)
+
+    if engine == "streaming":
+        with profile.phase(engine) as phase:
+            stats = _get_stats_streaming(db_table, bucket_size_days, day_cutoff_seconds, num_buckets,
+                                         additional_filter)
+            phase.buckets = len(stats.get("learned_cards", ()))
+        return stats
+    if engine == "sql":
+        from .sql_engine import get_stats_sql, supports_window_functions
+        if supports_window_functions(db_table):
+            with profile.phase(engine) as phase:
+                stats = get_stats_sql(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+                phase.buckets = len(stats.get("learned_cards", ()))
+            return stats
+        engine = "python"
+    if engine == "numpy":
+        from .vectorized import get_stats_numpy, np
+        if np is not None:
+            with profile.phase(engine) as phase:
+                stats = get_stats_numpy(db_table, bucket_size_days, day_cutoff_seconds, num_buckets,
+                                        additional_filter)
+                phase.buckets = len(stats.get("learned_cards", ()))
+            return stats
+        engine = "python"
+    if engine != "python":
+        raise ValueError("Unknown engine: %s" % engine)
 
     all_reviews_for_bucket = _get_reviews(
-        db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+        db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter, profile)
+
+    with profile.phase("aggregate") as phase:
+        stats = _aggregate(all_reviews_for_bucket, num_buckets)
+        phase.buckets = len(stats.get("learned_cards", ()))
+    return stats
 
-    # If there is no review data then return empty dictionary. No graphs should be plotted.
-    if not all_reviews_for_bucket:
-        return stats_by_name
+
+def _aggregate(store, num_buckets=None):
+    "Computes the stats by name from the ReviewStore returned by _get_reviews."
 
     stats_by_bucket = {}
     last_ivl_by_cid = {}
 
-    # sort by bucket
-    for key in sorted(all_reviews_for_bucket, key=lambda k: k[0]):
-        # Get reviews for a particular card in a particular bucket.
-        # The key is (bucket_index, cid).
-        card_reviews = all_reviews_for_bucket[key]
+    # The groups of reviews for each card in each bucket are already sorted by bucket.
+    for group in range(len(store)):
+        _add_card_reviews(stats_by_bucket, last_ivl_by_cid, store, group)
+
+    return _stats_by_name(stats_by_bucket, num_buckets)
 
-        bucket_index, cid = key
 
-        last_ivl = last_ivl_by_cid.get(cid, 0)
+# A stat computed from the reviews of each card in each bucket, which are a group of the ReviewStore.
+#
+# name: The name of the stat in the stats returned by get_metric_stats.
+# count: Called as count(store, group, last_ivl), where last_ivl is the interval the card had at the end of the
+#        last bucket it was reviewed in before this one (or 0 if none), and returns the amount the group adds to the
+#        stat for its bucket.
+# new: Called to get the value of the stat for a bucket before anything is added to it with +=.  This is int for
+#      counts, but can be anything that supports +=, e.g. LatencyHistogram.
+Metric = namedtuple('Metric', ['name', 'count', 'new'])
 
-        if bucket_index < min_bucket_index:
-            min_bucket_index = bucket_index
+# Maps the name of each metric that can be passed to get_metric_stats to its Metric.  See register_metric.
+metrics = {}
 
-        if bucket_index > max_bucket_index:
-            max_bucket_index = bucket_index
 
+def register_metric(name, count, new=int):
+    "Adds a metric with the given functions (see Metric) to the metrics, replacing any with the same name."
+    metrics[name] = Metric(name, count, new)
+    return metrics[name]
+
+
+def _register_maturity_metrics(threshold, suffix):
+    names = ["matured_cards" + suffix, "net_matured_cards" + suffix, "matured_reviews" + suffix,
+             "lost_matured_card" + suffix]
+    register_metric(names[0], lambda store, group, last_ivl: int(_has_matured(store, group, last_ivl, threshold)))
+    register_metric(names[1], lambda store, group, last_ivl: (
+        _has_matured(store, group, last_ivl, threshold) - _has_lost_matured(store, group, last_ivl, threshold)))
+    register_metric(names[2], lambda store, group, last_ivl: _num_matured(store, group, threshold))
+    register_metric(names[3], lambda store, group, last_ivl: int(
+        _has_lost_matured(store, group, last_ivl, threshold)))
+    return names
+
+
+def maturity_metrics(threshold):
+    """Returns the names of the metrics that are the same as the matured_cards, net_matured_cards, matured_reviews
+    and lost_matured_card stats but with cards considered mature once their interval is at least threshold days
+    rather than 21, e.g. matured_cards_30 for a threshold of 30.  The metrics are registered if they haven't been
+    already."""
+
+    names = ["%s_%d" % (name, threshold)
+             for name in ["matured_cards", "net_matured_cards", "matured_reviews", "lost_matured_card"]]
+    if any(name not in metrics for name in names):
+        _register_maturity_metrics(threshold, "_%d" % threshold)
+    return names
+
+
+# The metrics for the stats returned by get_stats.
+STANDARD_METRICS = _register_maturity_metrics(21, "") + [
+    register_metric("learned_cards", lambda store, group, last_ivl: int(_has_learned(store, group))).name]
+
+
+def _learned_to_mature_days(store, group, last_ivl):
+    """Returns the days from when the card was first learned to each of its reviews in the group where it matured,
+    skipping cards that were never learned (e.g. because their learning reviews were deleted)."""
+
+    first_learned_id = store.first_learned.get(store.cids[group])
+    if first_learned_id is None:
+        return ()
+
+    ids = store.ids
+    ivls = store.ivls
+    last_ivls = store.last_ivls
+    return [(ids[i] - first_learned_id) / 86400000.0 for i in range(store.starts[group], store.starts[group + 1])
+            if last_ivls[i] < 21 and ivls[i] >= 21 and ids[i] >= first_learned_id]
+
+
+# A LatencyHistogram per bucket of the days from when cards were first learned to when they matured, for each review
+# counted by matured_reviews.
+register_metric("learned_to_mature_days", _learned_to_mature_days, LatencyHistogram)
+
+
+def get_metric_stats(db_table, bucket_size_days, day_cutoff_seconds, metric_names, num_buckets=None,
+                     additional_filter=None, profile=None, cid_index=None):
+    """Computes the stats for any number of the registered metrics with a single pass over the reviews.  Returns a
+    dict mapping each name in metric_names to a list of (bucket_index, value), the same as get_stats does for its
+    stats.  For example metric_names of STANDARD_METRICS + maturity_metrics(30) + maturity_metrics(90) gives the
+    stats of get_stats along with the same stats for cards with intervals of at least 30 and 90 days.  Adding
+    learned_to_mature_days gives the LatencyHistogram for each bucket of how long the cards that matured in it took
+    to mature after they were learned (see latency.quantile_series).
+
+    The other arguments are the same as for get_stats.  The profile records the query, bucketing and aggregate
+    phases.  cid_index is filled in for the metrics it indexes.
+    """
+
+    if profile is None:
+        profile = NO_PROFILE
+
+    unknown = [name for name in metric_names if name not in metrics]
+    if unknown:
+        raise ValueError("Unknown metric: %s" % ", ".join(unknown))
+    counts = [metrics[name].count for name in metric_names]
+    if cid_index is not None:
+        counts = [_indexed_count(count, name, cid_index) if cid_index.indexes(name) else count
+                  for count, name in zip(counts, metric_names)]
+    news = [metrics[name].new for name in metric_names]
+
+    store = _get_reviews(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter, profile)
+
+    with profile.phase("aggregate") as phase:
+        # Maps bucket_index to the values of the metrics, in the order of metric_names.
+        values_by_bucket = {}
+        last_ivl_by_cid = {}
+
+        for group in range(len(store)):
+            bucket_index = store.bucket_indexes[group]
+            cid = store.cids[group]
+            last_ivl = last_ivl_by_cid.get(cid, 0)
+
+            values = values_by_bucket.get(bucket_index)
+            if values is None:
+                values = [new() for new in news]
+                values_by_bucket[bucket_index] = values
+
+            for i, count in enumerate(counts):
+                values[i] += count(store, group, last_ivl)
+
+            last_ivl_by_cid[cid] = store.ivls[store.starts[group + 1] - 1]
+
+        stats = defaultdict(list)
+        if values_by_bucket:
+            for bucket_index in _bucket_range(values_by_bucket, num_buckets):
+                values = values_by_bucket.get(bucket_index) or [new() for new in news]
+                for name, value in zip(metric_names, values):
+                    stats[name].append((bucket_index, value))
+        phase.buckets = len(next(iter(stats.values()), ()))
+
+    if cid_index is not None:
+        with profile.phase("sort cid index"):
+            cid_index.finish()
+
+    return stats
+
+
+def _indexed_count(count, name, cid_index):
+    "Returns a Metric count function that also adds the card to cid_index when count adds anything to the metric."
+
+    def indexed_count(store, group, last_ivl):
+        value = count(store, group, last_ivl)
+        if value:
+            cid_index.add(name, store.bucket_indexes[group], store.cids[group])
+        return value
+
+    return indexed_count
+
+
+def get_multi_stats(db_table, bucket_sizes, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                    profile=None):
+    """Computes the stats for several bucket sizes with a single pass over the reviews.  Returns a dict mapping
+    each item in bucket_sizes to the same stats get_stats would return for it.
+
+    bucket_sizes is a list where each item is either a bucket_size_days or a tuple (bucket_size_days, num_buckets).
+    The tuples allow the same bucket size to be used with different numbers of buckets, e.g. (1, 31) for the
+    last month and (1, None) for the life of a young deck.
+
+    num_buckets is the number of buckets for the items in bucket_sizes that aren't tuples.
+
+    The other arguments are the same as for get_stats.  The profile records the query and aggregate phases.
+    """
+
+    if profile is None:
+        profile = NO_PROFILE
+
+    day_cutoff_ms = int(day_cutoff_seconds * 1000)
+
+    with profile.phase("query") as phase:
+        # (item, num_buckets, bucket_ms, accumulator) for each item in bucket_sizes
+        views = []
+        id_cutoffs = []
+        for item in bucket_sizes:
+            bucket_size_days, view_num_buckets = item if isinstance(item, tuple) else (item, num_buckets)
+            id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, view_num_buckets,
+                                                 additional_filter)
+            accumulator = _StatsAccumulator(id_cutoff, _first_learned(db_table, id_cutoff, additional_filter))
+            views.append((item, view_num_buckets, int(bucket_size_days * 86400000), accumulator))
+            id_cutoffs.append(id_cutoff)
+
+        # Fetch the reviews needed by the view with the longest time window.
+        filters = []
+        if id_cutoffs and None not in id_cutoffs:
+            filters.append("rl.id >= %d" % min(id_cutoffs))
+        if additional_filter:
+            filters.append(additional_filter)
+
+        reviews = _iter_rows(db_table, _reviews_query(1, day_cutoff_seconds, filters))
+        if isinstance(reviews, list):
+            phase.rows = len(reviews)
+
+    with profile.phase("aggregate") as phase:
+        num_rows = 0
+        for _id, _, cid, ease, ivl, lastIvl, _type in reviews:
+            num_rows += 1
+            for item, view_num_buckets, bucket_ms, accumulator in views:
+                accumulator.add(_id, _bucket_index(_id, day_cutoff_ms, bucket_ms), cid, ivl, lastIvl)
+
+        multi_stats = dict((item, accumulator.stats_by_name(view_num_buckets))
+                           for item, view_num_buckets, bucket_ms, accumulator in views)
+        phase.rows = num_rows
+        phase.buckets = sum(len(stats.get("learned_cards", ())) for stats in multi_stats.values())
+
+    return multi_stats
+
+
+def get_stats_by_deck(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                      deck_parents=None):
+    """Computes the stats for every deck with a single query.  Returns a dict mapping each deck id (did) to the
+    same stats get_stats would return when limited to the cards in that deck.
+
+    deck_parents is an (optional) dict mapping each did to the did of its parent deck (or None for top level
+    decks).  If provided, the stats for each deck also include the stats for all its subdecks, the same as Anki
+    does when a deck is selected.  See deck_parents_from_names.
+
+    The other arguments are the same as for get_stats.
+    """
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+    first_learned = _first_learned(db_table, id_cutoff, additional_filter)
+
+    # Each card belongs to a single deck, so the reviews for each deck can be folded separately (and the first
+    # learned ids can be shared).
+    accumulators = {}
+    for _id, bucket_index, cid, ease, ivl, lastIvl, _type, did in _iter_rows(db_table, """\
+          SELECT rl.id,
+                 %s as bucket_index,
+                 rl.cid, rl.ease, rl.ivl, rl.lastIvl, rl.type, c.did
+          FROM revlog rl
+          JOIN cards c ON c.id = rl.cid
+          %s
+          ORDER BY rl.id ASC;
+          """ % (_bucket_index_sql(bucket_size_days, day_cutoff_seconds), _where_clause(filters))):
+        accumulator = accumulators.get(did)
+        if not accumulator:
+            accumulator = _StatsAccumulator(id_cutoff, first_learned)
+            accumulators[did] = accumulator
+        accumulator.add(_id, bucket_index, cid, ivl, lastIvl)
+
+    stats_by_bucket_by_did = dict((did, accumulator.stats_by_bucket) for did, accumulator in accumulators.items())
+
+    if deck_parents:
+        rolled_up = {}
+        for did, stats_by_bucket in stats_by_bucket_by_did.items():
+            ancestor = did
+            while ancestor is not None:
+                _merge_stats_by_bucket(rolled_up.setdefault(ancestor, {}), stats_by_bucket)
+                ancestor = deck_parents.get(ancestor)
+        stats_by_bucket_by_did = rolled_up
+
+    return dict((did, _stats_by_name(stats_by_bucket, num_buckets))
+                for did, stats_by_bucket in stats_by_bucket_by_did.items())
+
+
+def deck_parents_from_names(deck_names):
+    """Returns the deck_parents for get_stats_by_deck given a dict mapping each did to the full name of the deck,
+    where subdecks are separated by "::" (e.g. "Languages::Japanese")."""
+
+    dids_by_name = dict((name, did) for did, name in deck_names.items())
+    deck_parents = {}
+    for did, name in deck_names.items():
+        parent_name = name.rpartition("::")[0]
+        deck_parents[did] = dids_by_name.get(parent_name) if parent_name else None
+    return deck_parents
+
+
+def _merge_stats_by_bucket(stats_by_bucket, other):
+    "Adds the stats in other, which maps bucket_index to BucketStats, into stats_by_bucket."
+    for bucket_index, other_bucket_stats in other.items():
         bucket_stats = stats_by_bucket.get(bucket_index)
         if not bucket_stats:
             bucket_stats = _new_bucket_stats(bucket_index)
             stats_by_bucket[bucket_index] = bucket_stats
+        bucket_stats.stats.matured_cards += other_bucket_stats.stats.matured_cards
+        bucket_stats.stats.matured_reviews += other_bucket_stats.stats.matured_reviews
+        bucket_stats.stats.lost_matured_card += other_bucket_stats.stats.lost_matured_card
+        bucket_stats.stats.learned_cards += other_bucket_stats.stats.learned_cards
 
-        if _has_matured(card_reviews, last_ivl):
-            bucket_stats.stats.matured_cards += 1
 
-        bucket_stats.stats.matured_reviews += _num_matured(card_reviews)
+def _add_card_reviews(stats_by_bucket, last_ivl_by_cid, store, group):
+    """Adds the stats for the reviews of a card in a bucket, which are the given group of the ReviewStore.  The
+    reviews for each card must be added in bucket order, as last_ivl_by_cid tracks the interval each card had at the
+    end of its previous bucket."""
 
-        if _has_lost_matured(card_reviews, last_ivl):
-            bucket_stats.stats.lost_matured_card += 1
+    bucket_index = store.bucket_indexes[group]
+    cid = store.cids[group]
 
-        if _has_learned(card_reviews):
-            bucket_stats.stats.learned_cards += 1
+    last_ivl = last_ivl_by_cid.get(cid, 0)
 
-        last_ivl_by_cid[cid] = card_reviews.reviews[-1].ivl
+    bucket_stats = stats_by_bucket.get(bucket_index)
+    if not bucket_stats:
+        bucket_stats = _new_bucket_stats(bucket_index)
+        stats_by_bucket[bucket_index] = bucket_stats
 
-    for bucket_index in range(min_bucket_index, max_bucket_index + 1):
-        # Fill in days missing reviews with zero values
-        if bucket_index not in stats_by_bucket:
-            stats_by_bucket[bucket_index] = _new_bucket_stats(bucket_index)
+    if _has_matured(store, group, last_ivl):
+        bucket_stats.stats.matured_cards += 1
+
+    bucket_stats.stats.matured_reviews += _num_matured(store, group)
+
+    if _has_lost_matured(store, group, last_ivl):
+        bucket_stats.stats.lost_matured_card += 1
+
+    if _has_learned(store, group):
+        bucket_stats.stats.learned_cards += 1
+
+    last_ivl_by_cid[cid] = store.ivls[store.starts[group + 1] - 1]
 
-        stats = stats_by_bucket[bucket_index]
+
+def _get_stats_streaming(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                         chunk_size=10000):
+    """Computes the same stats as get_stats while holding at most one bucket of reviews in memory.
+
+    The reviews are fetched in chunks in ascending id order, so all the reviews for a bucket arrive before any
+    review for a later bucket.  The reviews for the current bucket are grouped by card and folded into the stats
+    as soon as the first review of the next bucket arrives.  Apart from the current bucket only the first learned
+    id and last interval of each card are kept.
+    """
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+
+    # Maps cid to the id where the card was first learned.
+    first_learned = _first_learned(db_table, id_cutoff, additional_filter)
+
+    stats_by_bucket = {}
+    last_ivl_by_cid = {}
+
+    # Holds the reviews for the bucket currently being read.
+    store = ReviewStore(first_learned)
+    bucket_rows = []
+    current_bucket_index = None
+
+    def add_bucket():
+        store.add_rows(bucket_rows)
+        for group in range(len(store)):
+            _add_card_reviews(stats_by_bucket, last_ivl_by_cid, store, group)
+        store.clear()
+
+    for row in _iter_reviews(db_table, bucket_size_days, day_cutoff_seconds, filters, chunk_size):
+        if row[1] != current_bucket_index:
+            add_bucket()
+            bucket_rows = []
+            current_bucket_index = row[1]
+        bucket_rows.append(row)
+
+    add_bucket()
+
+    return _stats_by_name(stats_by_bucket, num_buckets)
+
+
+def _bucket_range(bucket_indexes, num_buckets=None):
+    """Returns the range of bucket indexes to return stats for given the indexes of the buckets with reviews, which
+    covers all num_buckets buckets and the current bucket even if they have no reviews."""
+
+    # Start at the current bucket (0), or the first of num_buckets buckets, even if all the reviews are after the day
+    # cutoff.
+    min_bucket_index = 0
+    if num_buckets:
+        min_bucket_index = -1 * num_buckets + 1
+    min_bucket_index = min(min_bucket_index, min(bucket_indexes))
+    max_bucket_index = max(0, max(bucket_indexes))
+    return range(min_bucket_index, max_bucket_index + 1)
+
+
+def _stats_by_name(stats_by_bucket, num_buckets=None):
+    """Converts the BucketStats keyed by bucket_index into the lists of (bucket_index, value) returned by get_stats,
+    filling in buckets missing reviews with zero values."""
+
+    stats_by_name = defaultdict(list)
+
+    # If there is no review data then return empty dictionary. No graphs should be plotted.
+    if not stats_by_bucket:
+        return stats_by_name
+
+    for bucket_index in _bucket_range(stats_by_bucket, num_buckets):
+        # Fill in days missing reviews with zero values
+        stats = stats_by_bucket.get(bucket_index) or _new_bucket_stats(bucket_index)
 
         # The net increase in mature cards
         net_matured_cards = stats.stats.matured_cards - stats.stats.lost_matured_card
@@ -296,3 +805,84 @@ def get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None,
         stats_by_name["learned_cards"].append((bucket_index, stats.stats.learned_cards))
 
     return stats_by_name
+
+
+def _count_net_change(stats, start_ivl, end_ivl, delta=1):
+    "Counts a card that went from start_ivl to end_ivl over a bucket as matured or lost matured, if it did either."
+    if start_ivl < 21 and end_ivl >= 21:
+        stats.matured_cards += delta
+    elif start_ivl >= 21 and end_ivl < 21:
+        stats.lost_matured_card += delta
+
+
+class _StatsAccumulator:
+    """Folds reviews into per-bucket stats one review at a time, keeping only a small amount of state per card.
+
+    Reviews must be added in ascending id order.  This produces the same stats as get_stats, but because the
+    state is per card rather than per review it can be saved and later extended with newer reviews.  Reviews before
+    id_cutoff are ignored, so when each card was first learned before id_cutoff must be provided up front (see
+    _first_learned).
+
+    first_learned: Maps cid to the id where the card was first learned.
+    card_state: Maps cid to [bucket_index, start_ivl, end_ivl] for the last bucket the card was reviewed in, where
+                start_ivl is the interval the card had at the start of the bucket and end_ivl is the interval after
+                the last review in the bucket.
+    stats_by_bucket: Maps bucket_index to BucketStats.
+    high_water_id: The largest review id added so far.
+    """
+
+    def __init__(self, id_cutoff=None, first_learned=None):
+        self.id_cutoff = id_cutoff
+        self.first_learned = first_learned or {}
+        self.card_state = {}
+        self.stats_by_bucket = {}
+        self.high_water_id = None
+
+    def add(self, _id, bucket_index, cid, ivl, lastIvl):
+        # Any ids earlier than the cutoff will not be graphed.
+        if self.id_cutoff and _id < self.id_cutoff:
+            return
+
+        if self.high_water_id is None or _id > self.high_water_id:
+            self.high_water_id = _id
+
+        learned = False
+        if ivl > 0 and lastIvl < 0 and cid not in self.first_learned:
+            self.first_learned[cid] = _id
+            learned = True
+
+        self.add_group(bucket_index, cid, lastIvl, ivl, 1 if lastIvl < 21 and ivl >= 21 else 0, learned)
+
+    def add_group(self, bucket_index, cid, first_last_ivl, end_ivl, matured_reviews=0, learned=False):
+        """Adds consecutive reviews of a card within a bucket, summarized by the lastIvl of the first review, the
+        ivl of the last review, the number of reviews where the card matured and whether the card was first learned
+        by one of them.  Groups must be added in the same order as the reviews would be."""
+
+        bucket_stats = self.stats_by_bucket.get(bucket_index)
+        if not bucket_stats:
+            bucket_stats = _new_bucket_stats(bucket_index)
+            self.stats_by_bucket[bucket_index] = bucket_stats
+        stats = bucket_stats.stats
+
+        state = self.card_state.get(cid)
+        if state and state[0] == bucket_index:
+            # More reviews in the same bucket, so the card's net change over the bucket has to be re-evaluated
+            # against the new last review.
+            _count_net_change(stats, state[1], state[2], -1)
+            state[2] = end_ivl
+        else:
+            # Prefer the last ivl from the previous bucket if available because lastIvl isn't always correct.
+            last_ivl = state[2] if state else 0
+            if not last_ivl:
+                last_ivl = first_last_ivl
+            state = [bucket_index, last_ivl, end_ivl]
+            self.card_state[cid] = state
+        _count_net_change(stats, state[1], state[2], 1)
+
+        stats.matured_reviews += matured_reviews
+
+        if learned:
+            stats.learned_cards += 1
+
+    def stats_by_name(self, num_buckets=None):
+        return _stats_by_name(self.stats_by_bucket, num_buckets)
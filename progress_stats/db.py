@@ -0,0 +1,193 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+
+# Defaults for reading large collections: map up to 256 MB of the file into memory rather than reading it with
+# system calls, and cache up to 64 MB of pages.
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Number of rows fetched at a time when iterating over the rows of a query.
+DEFAULT_FETCH_SIZE = 10000
+
+
+class Cancelled(Exception):
+    "Raised by a ReadOnlyTable's queries once it has been cancelled."
+
+
+class ReadOnlyTable:
+    """A db_table that reads the collection at path through its own read-only connection.  Besides all(), which
+    returns all the rows of a query, it has iterate(), which streams the rows, and which get_stats uses instead when
+    it only needs to go through the rows once.
+
+    immutable tells SQLite that the file can't change while it is open, so that it skips locking and checking for
+    changes.  This is only safe for collections that aren't in use, e.g. copies processed offline.
+
+    mmap_size and cache_size are in bytes and fetch_size is the number of rows fetched at a time by iterate().
+
+    Keep a table open to compute the stats for several bucket sizes or decks of the same collection (see e.g.
+    get_multi_stats and get_stats_by_deck) through the one connection, or use open_table to reuse the connection
+    across separate calls.
+
+    The connection may be used from any thread, but only from one thread at a time.  cancel() may be called from
+    any thread.
+    """
+
+    def __init__(self, path, immutable=False, mmap_size=DEFAULT_MMAP_SIZE, cache_size=DEFAULT_CACHE_SIZE,
+                 fetch_size=DEFAULT_FETCH_SIZE):
+        uri = "file:%s?mode=ro" % pathname2url(path)
+        if immutable:
+            uri += "&immutable=1"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.conn.execute("PRAGMA mmap_size = %d" % mmap_size)
+        # A negative cache_size is in KiB rather than pages.
+        self.conn.execute("PRAGMA cache_size = %d" % -(cache_size // 1024))
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.fetch_size = fetch_size
+        self.cancelled = threading.Event()
+
+        # Abort the running query once cancelled.  Unlike interrupt(), this also works if the query has yet to start.
+        self.conn.set_progress_handler(self.cancelled.is_set, 10000)
+
+    def all(self, query):
+        return self._execute(query).fetchall()
+
+    def iterate(self, query):
+        "Yields the rows of the query, fetching fetch_size rows at a time."
+        cursor = self._execute(query)
+        while True:
+            try:
+                rows = cursor.fetchmany(self.fetch_size)
+            except sqlite3.OperationalError:
+                self._check_cancelled()
+                raise
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def _execute(self, query):
+        self._check_cancelled()
+        try:
+            return self.conn.execute(query)
+        except sqlite3.OperationalError:
+            self._check_cancelled()
+            raise
+
+    def _check_cancelled(self):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def cancel(self):
+        "Stops the query that is running, if any, and any later queries."
+        self.cancelled.set()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CollectionTable:
+    """A db_table that reads through the connection of a collection open in Anki (col.db), which is the only way to
+    read it from another thread while it is open, as Anki opens it with an exclusive lock.  Only Anki 2.1.28 and
+    later can run col.db queries from other threads.
+
+    A query that is running can't be stopped, so cancel() only makes any later queries raise Cancelled.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.cancelled = threading.Event()
+
+    def all(self, query):
+        if self.cancelled.is_set():
+            raise Cancelled()
+        return self.db.all(query)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def close(self):
+        pass
+
+
+# The tables that open_table keeps open while they aren't in use, by (absolute path, immutable), least recently used
+# first.
+_idle_tables = OrderedDict()
+_idle_tables_lock = threading.Lock()
+
+# Number of idle tables open_table keeps open.
+max_idle_tables = 8
+
+
+@contextmanager
+def open_table(path, immutable=False):
+    """Returns a context manager for a ReadOnlyTable for the collection at path, which is kept open afterwards so
+    that later calls for the same collection reuse the connection and the pages it has cached, e.g. to compute the
+    stats for several bucket sizes or decks in separate requests.
+
+    A table is only reused once the with block using it has exited, so each thread gets a table of its own.  At
+    most max_idle_tables are kept open, closing the least recently used, and they are all closed on exit (see
+    close_tables).  A table that was cancelled or whose block raised an exception is closed rather than reused."""
+
+    key = (os.path.abspath(path), immutable)
+    with _idle_tables_lock:
+        table = _idle_tables.pop(key, None)
+    if table is None:
+        table = ReadOnlyTable(path, immutable)
+
+    try:
+        yield table
+    except BaseException:
+        table.close()
+        raise
+    if table.cancelled.is_set():
+        table.close()
+        return
+
+    evicted = []
+    with _idle_tables_lock:
+        if key in _idle_tables:
+            # Another thread opened a table for the same collection meanwhile, so only one of them is kept.
+            evicted.append(_idle_tables.pop(key))
+        _idle_tables[key] = table
+        while len(_idle_tables) > max_idle_tables:
+            evicted.append(_idle_tables.popitem(last=False)[1])
+    for evicted_table in evicted:
+        evicted_table.close()
+
+
+def close_tables():
+    "Closes the idle tables kept open by open_table."
+    with _idle_tables_lock:
+        tables = list(_idle_tables.values())
+        _idle_tables.clear()
+    for table in tables:
+        table.close()
+
+
+atexit.register(close_tables)
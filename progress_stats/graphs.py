@@ -13,8 +13,24 @@
 # limitations under the License.
 
 import inspect
+import json
 import math
-from .compute import get_stats
+import os
+import sqlite3
+import threading
+import traceback
+from collections import OrderedDict
+from functools import partial
+from .background import StatsJob
+from .checkpoint import StatsCheckpoint
+from .compute import STANDARD_METRICS, get_metric_stats, get_multi_stats, maturity_metrics, revlog_fingerprint
+from .db import CollectionTable
+from .latency import quantile_series, total_histogram
+from .partial import iter_deck_life_stats
+from .profile import NO_PROFILE, StatsProfile
+from .rollup import StatsRollup
+from .sampling import get_sampled_stats
+from .series import downsample, summarize
 from anki.lang import _
 
 
@@ -25,6 +41,57 @@ defaultColor = "#0F0"
 
 _num_graphs = 0
 
+# Maps the class of the stats page to whether its _graph method takes the xunit argument.
+_graph_xunit = {}
+
+# Name of the sidecar database, stored next to the collection, that holds the stats checkpoints.
+_checkpoint_name = "progress_stats.db"
+
+# Maps the path of the sidecar database to its StatsCheckpoint and the lock held while using it.
+_checkpoints = {}
+
+# Name of the sidecar database, stored next to the collection, that holds the rollup of the reviews.
+_rollup_name = "progress_stats_rollup.db"
+
+# Maps the path of the rollup database to its StatsRollup and the lock held while using it.
+_rollups = {}
+
+# The (bucket_size_days, num_buckets) for the past month and past year periods.
+_periods = [(1, 31), (7, 52)]
+
+# Maps the collection path to (key, stats) where stats maps (bucket_size_days, num_buckets) to the stats computed
+# for the key (additional filter, day cutoff, revlog fingerprint and extra metrics).
+_stats_cache = {}
+
+# Maps (collection path, additional filter, bucket_size_days, num_buckets, day cutoff, revlog fingerprint, extra
+# metrics) to the HTML for the graphs, in least recently used order, so the graphs can be shown again without
+# computing the stats.  Only used on the main thread.
+_html_cache = OrderedDict()
+
+# The most characters of HTML kept in _html_cache.
+max_html_cache_size = 2 * 1024 * 1024
+
+# Functions called with the StatsProfile each time the graphs are generated, e.g. to log where the time went.
+# The graphs are only profiled when there is a hook or the show_profile option is set.
+profile_hooks = []
+
+# Guards _checkpoints, _rollups and _stats_cache, which are used by both the main thread and the worker threads.  It
+# is only held while reading or updating them, never while computing the stats.
+_lock = threading.Lock()
+
+# The StatsJob computing the stats for the graphs being shown, if any.
+_job = None
+_num_jobs = 0
+
+
+def _config():
+    "Returns the add-on's configuration, or an empty dict when not running within Anki."
+    try:
+        from aqt import mw
+        return mw.addonManager.getConfig(__name__.split(".")[0]) or {}
+    except Exception:
+        return {}
+
 
 def progressGraphs(*args, **kwargs):
     self = args[0]
@@ -54,46 +121,437 @@ def progressGraphs(*args, **kwargs):
             num_buckets = None
             bucket_size_days = 31
 
-    stats = get_stats(
-        db_table=self.col.db,
-        bucket_size_days=bucket_size_days, num_buckets=num_buckets,
-        day_cutoff_seconds=self.col.sched.dayCutoff, additional_filter=self._revlogLimit())
+    config = _config()
+    show_profile = config.get("show_profile")
+    profile = StatsProfile() if show_profile or profile_hooks else NO_PROFILE
 
     result = old(self)
 
-    result += _plot(self,
-                    stats["learned_cards"],
-                    "Learned Cards",
-                    "Number of cards that were learned",
-                    bucket_size_days,
-                    include_cumulative=True,
-                    color=colLearn)
-
-    result += _plot(self,
-                    stats["net_matured_cards"],
-                    "Net Matured Cards",
-                    "Net increase in number of mature cards (matured cards - lost matured cards)",
-                    bucket_size_days,
-                    include_cumulative=True,
-                    color=colMature)
-
-    result += _plot(self,
-                    stats["matured_cards"],
-                    "Matured Cards",
-                    "Number of cards that matured",
-                    bucket_size_days,
-                    color=colMature)
-
-    result += _plot(self,
-                    stats["lost_matured_card"],
-                    "Matured Cards Lost",
-                    "Number of cards that lost maturity",
-                    bucket_size_days,
-                    color=colYoung)
+    col_path = getattr(self.col, "path", None)
+    additional_filter = self._revlogLimit()
+    day_cutoff_seconds = self.col.sched.dayCutoff
+    with profile.phase("fingerprint"):
+        fingerprint = revlog_fingerprint(self.col.db, additional_filter)
+    extra_metrics = []
+    for threshold in config.get("maturity_thresholds") or ():
+        extra_metrics += maturity_metrics(threshold)
+    if config.get("show_latency"):
+        extra_metrics.append("learned_to_mature_days")
+    extra_metrics = tuple(extra_metrics)
+    max_points = config.get("max_points") or 0
+    html_key = (col_path, additional_filter, bucket_size_days, num_buckets, day_cutoff_seconds, fingerprint,
+                extra_metrics, max_points)
+
+    html = _html_cache.get(html_key)
+    if html is not None:
+        _html_cache.move_to_end(html_key)
+        return result + _graphs(html, show_profile, profile)
+
+    if config.get("background", True):
+        progressive = num_buckets is None and config.get("progressive") and not config.get("rollup") and \
+            not extra_metrics
+        preview = None
+        sample_rate = config.get("sample_rate")
+        if num_buckets is None and sample_rate and sample_rate > 1:
+            preview = partial(_sample_preview, day_cutoff_seconds=day_cutoff_seconds,
+                              additional_filter=additional_filter, bucket_size_days=bucket_size_days,
+                              sample_rate=sample_rate, profile=profile)
+        placeholder = _start_job(self, html_key, show_profile, profile, config.get("rollup"), progressive, preview)
+        if placeholder:
+            return result + placeholder
+
+    stats = _get_stats(self.col.db, col_path, day_cutoff_seconds, additional_filter, bucket_size_days, num_buckets,
+                       profile, config.get("rollup"), fingerprint, extra_metrics)
+    html = _render(self, stats, bucket_size_days, profile, extra_metrics=extra_metrics, max_points=max_points)
+    _cache_html(html_key, html)
+
+    return result + _graphs(html, show_profile, profile)
+
+
+def _render(self, stats, bucket_size_days, profile, sampled=None, extra_metrics=(), max_points=0):
+    """Returns the HTML for the graphs of the stats.  If the stats were estimated from a sample of the cards, sampled
+    is the SampledStats, whose confidence intervals are drawn on the graphs.  Graphs are added for the extra metrics
+    that are in the stats, which are the net_matured_cards metrics for other maturity thresholds (see
+    maturity_metrics) and learned_to_mature_days.  max_points is passed on to _plot."""
+
+    intervals = {}
+    sample_rate = None
+    if sampled:
+        intervals, sample_rate = sampled.intervals, sampled.sample_rate
+
+    with profile.phase("render") as phase:
+        result = _plot(self,
+                       stats["learned_cards"],
+                       "Learned Cards",
+                       "Number of cards that were learned",
+                       bucket_size_days,
+                       include_cumulative=True,
+                       color=colLearn,
+                       interval=intervals.get("learned_cards"),
+                       sample_rate=sample_rate,
+                       max_points=max_points)
+
+        result += _plot(self,
+                        stats["net_matured_cards"],
+                        "Net Matured Cards",
+                        "Net increase in number of mature cards (matured cards - lost matured cards)",
+                        bucket_size_days,
+                        include_cumulative=True,
+                        color=colMature,
+                        interval=intervals.get("net_matured_cards"),
+                        sample_rate=sample_rate,
+                        max_points=max_points)
+
+        result += _plot(self,
+                        stats["matured_cards"],
+                        "Matured Cards",
+                        "Number of cards that matured",
+                        bucket_size_days,
+                        color=colMature,
+                        interval=intervals.get("matured_cards"),
+                        sample_rate=sample_rate,
+                        max_points=max_points)
+
+        result += _plot(self,
+                        stats["lost_matured_card"],
+                        "Matured Cards Lost",
+                        "Number of cards that lost maturity",
+                        bucket_size_days,
+                        color=colYoung,
+                        interval=intervals.get("lost_matured_card"),
+                        sample_rate=sample_rate,
+                        max_points=max_points)
+
+        for name in extra_metrics:
+            if name.startswith("net_matured_cards_"):
+                threshold = int(name[len("net_matured_cards_"):])
+                result += _plot(self,
+                                stats.get(name),
+                                "Net Matured Cards (%d days)" % threshold,
+                                "Net increase in number of cards with intervals of at least %d days" % threshold,
+                                bucket_size_days,
+                                include_cumulative=True,
+                                color=colMature,
+                                max_points=max_points)
+
+        if "learned_to_mature_days" in extra_metrics and stats.get("learned_to_mature_days"):
+            histograms = stats["learned_to_mature_days"]
+            total = total_histogram(histograms)
+            result += _plot(self,
+                            quantile_series(histograms, 0.5),
+                            "Days to Mature",
+                            "Median days from when cards were learned to when they matured",
+                            bucket_size_days,
+                            color=colMature,
+                            lines=[(_("90th percentile"), quantile_series(histograms, 0.9))],
+                            summary=[(_("Median"), _("%0.1f days") % (total.quantile(0.5) or 0)),
+                                     (_("90th percentile"), _("%0.1f days") % (total.quantile(0.9) or 0))],
+                            max_points=max_points)
+        phase.buckets = len(stats.get("learned_cards", ()))
 
     return result
 
 
+def _sample_preview(db_table, day_cutoff_seconds, additional_filter, bucket_size_days, sample_rate, profile):
+    "Returns the SampledStats for the deck life graphs estimated from one in sample_rate cards."
+
+    # Only the time for the whole preview is profiled, since the phases for the exact graphs are what gets reported.
+    with profile.phase("preview"):
+        return get_sampled_stats(db_table, bucket_size_days, day_cutoff_seconds, None, additional_filter, sample_rate)
+
+
+def _graphs(html, show_profile, profile):
+    "Returns the HTML for the graphs with the profile added if show_profile is set, and passes it to the hooks."
+
+    if show_profile:
+        html += "<div style='font-size: small; color: gray'>Progress graphs: %s</div>" % profile.summary()
+
+    for hook in profile_hooks:
+        hook(profile)
+
+    return html
+
+
+def _cache_html(key, html):
+    "Adds the HTML for the graphs to _html_cache, evicting the least recently used graphs to stay within its size."
+
+    _html_cache[key] = html
+    _html_cache.move_to_end(key)
+    size = sum(len(cached_html) for cached_html in _html_cache.values())
+    while size > max_html_cache_size and len(_html_cache) > 1:
+        _, evicted_html = _html_cache.popitem(last=False)
+        size -= len(evicted_html)
+
+
+def _start_job(self, html_key, show_profile, profile, use_rollup, progressive=False, preview=None):
+    """Starts computing the stats for the graphs to be cached under html_key in a worker thread and returns the HTML
+    for a placeholder that the graphs replace once they are ready.  Any job still computing the stats for graphs
+    shown earlier (e.g. for a different period or deck) is cancelled.  Returns None if the stats can't be computed
+    in the background, in which case they need to be computed right away.
+
+    If progressive is set, which is only for the deck life, the graphs are shown for the most recent reviews first
+    and then redrawn as the earlier reviews are read (see iter_deck_life_stats).  If preview is given, it is called
+    with the db_table in the worker thread before the stats are computed, for SampledStats (see get_sampled_stats)
+    whose graphs replace the placeholder until then."""
+
+    global _job, _num_jobs
+
+    (col_path, additional_filter, bucket_size_days, num_buckets, day_cutoff_seconds, fingerprint, extra_metrics,
+     max_points) = html_key
+    try:
+        import aqt
+        from aqt import mw
+        run_on_main = mw.taskman.run_on_main
+        # Anki keeps [creator, instance] for each dialog, with the instance None while the dialog is closed.
+        dialog_entry = aqt.dialogs._dialogs.get("DeckStats")
+        if not dialog_entry or not dialog_entry[1]:
+            return None
+    except (ImportError, AttributeError):
+        return None
+    if not col_path or not _reads_in_background(self.col):
+        return None
+
+    if _job:
+        _job.cancel()
+
+    placeholder_id = "progress-stats-job-%s" % _num_jobs
+    _num_jobs += 1
+
+    placeholder = _("Computing progress graphs...")
+
+    def compute(db_table):
+        if preview:
+            sampled = preview(db_table)
+            run_on_main(lambda: show_preview(sampled))
+
+        if not progressive:
+            return _get_stats(db_table, col_path, day_cutoff_seconds, additional_filter, bucket_size_days,
+                              num_buckets, profile, use_rollup, fingerprint, extra_metrics)
+
+        # Show each stats but the last, which are for all the reviews, as soon as they are computed.
+        stats = None
+        with profile.phase("progressive"):
+            for next_stats in iter_deck_life_stats(db_table, bucket_size_days, day_cutoff_seconds, additional_filter):
+                if stats is not None:
+                    run_on_main(lambda stats=stats: show(stats, final=False))
+                stats = next_stats
+        return stats
+
+    def show_preview(sampled):
+        if job is not _job or job.cancelled.is_set():
+            return
+        dialog = aqt.dialogs._dialogs["DeckStats"][1]
+        if dialog:
+            html = _render(self, sampled.stats, bucket_size_days, NO_PROFILE, sampled, max_points=max_points)
+            html += "<div style='font-size: small; color: gray'>%s</div>" % _("Computing exact progress graphs...")
+            dialog.form.web.eval("$('#%s').html(%s);" % (placeholder_id, json.dumps(html)))
+
+    def show(stats, final=True):
+        global _job
+        if job is not _job or job.cancelled.is_set():
+            return
+        if final:
+            _job = None
+        dialog = aqt.dialogs._dialogs["DeckStats"][1]
+        if dialog:
+            html = _render(self, stats, bucket_size_days, profile, extra_metrics=extra_metrics, max_points=max_points)
+            if final:
+                _cache_html(html_key, html)
+                html = _graphs(html, show_profile, profile)
+            else:
+                html += "<div style='font-size: small; color: gray'>%s</div>" % _("Reading earlier reviews...")
+            dialog.form.web.eval("$('#%s').html(%s);" % (placeholder_id, json.dumps(html)))
+
+    def fall_back(error):
+        # Compute the stats on the main thread instead, which reports any error as usual.
+        traceback.print_exception(type(error), error, error.__traceback__)
+        if job is not _job or job.cancelled.is_set():
+            # The graphs are no longer shown.
+            return
+        show(_get_stats(self.col.db, col_path, day_cutoff_seconds, additional_filter, bucket_size_days,
+                        num_buckets, profile, use_rollup, fingerprint, extra_metrics))
+
+    # Anki keeps the collection locked, so the worker reads it through Anki's own connection.
+    db = self.col.db
+    job = StatsJob(col_path, compute,
+                   lambda stats: run_on_main(lambda: show(stats)),
+                   lambda error: run_on_main(lambda: fall_back(error)),
+                   lambda path: CollectionTable(db))
+    _job = job.start()
+
+    return "<div id='%s'>%s</div>" % (placeholder_id, placeholder)
+
+
+def _reads_in_background(col):
+    """Returns whether the collection's connection (col.db) can be read from a worker thread, which is only the case
+    for the DBProxy of Anki 2.1.28 and later.  Older versions tie it to the main thread."""
+    try:
+        from anki.dbproxy import DBProxy
+    except ImportError:
+        return False
+    return isinstance(col.db, DBProxy)
+
+
+def _get_stats(db_table, col_path, day_cutoff_seconds, additional_filter, bucket_size_days, num_buckets,
+               profile=NO_PROFILE, use_rollup=False, fingerprint=None, extra_metrics=()):
+    """Computes the stats for the period along with the stats for the shorter periods, which need no additional
+    reviews, and keeps them so that switching to a shorter period is instant.
+
+    If use_rollup is set the stats are computed from the rollup saved next to the collection, which is kept up to
+    date as cards are answered.  Otherwise, or if the rollup can't be used for the period, the stats are computed
+    using the checkpoint saved next to the collection so that only the reviews added since the stats were last shown
+    need to be processed.  Falls back to computing the stats from scratch if the checkpoint can't be used.
+
+    fingerprint is the revlog_fingerprint for the additional filter, if it has already been computed.
+
+    If there are extra metrics (see get_metric_stats) the stats also include them, which are computed along with the
+    other stats in a single pass over the reviews for the period."""
+
+    view = (bucket_size_days, num_buckets)
+
+    if fingerprint is None:
+        with profile.phase("fingerprint"):
+            fingerprint = revlog_fingerprint(db_table, additional_filter)
+    key = (additional_filter, day_cutoff_seconds, fingerprint, extra_metrics)
+
+    with _lock:
+        cached_key, cached_stats = _stats_cache.get(col_path, (None, {}))
+    if cached_key != key:
+        cached_stats = {}
+    if view in cached_stats:
+        return cached_stats[view]
+
+    views = [view]
+    for period_bucket_size_days, period_num_buckets in _periods:
+        if (period_bucket_size_days, period_num_buckets) in views + list(cached_stats):
+            continue
+        if not num_buckets or period_bucket_size_days * period_num_buckets <= bucket_size_days * num_buckets:
+            views.append((period_bucket_size_days, period_num_buckets))
+
+    multi_stats = None
+    if extra_metrics:
+        # The rollup and checkpoint only have the standard stats.
+        multi_stats = {view: get_metric_stats(db_table, bucket_size_days, day_cutoff_seconds,
+                                              STANDARD_METRICS + list(extra_metrics), num_buckets,
+                                              additional_filter, profile)}
+
+    if multi_stats is None and use_rollup and col_path:
+        with profile.phase("rollup") as phase:
+            multi_stats = _get_rollup_stats(db_table, col_path, views, day_cutoff_seconds, additional_filter)
+            phase.buckets = len(views)
+
+    if multi_stats is None and col_path:
+        path = os.path.join(os.path.dirname(col_path), _checkpoint_name)
+        try:
+            checkpoint, checkpoint_lock = _get_sidecar(_checkpoints, path, StatsCheckpoint)
+            with checkpoint_lock:
+                multi_stats = checkpoint.get_multi_stats(db_table, views, day_cutoff_seconds,
+                                                         additional_filter=additional_filter, profile=profile)
+        except sqlite3.Error:
+            with _lock:
+                _checkpoints.pop(path, None)
+
+    if multi_stats is None:
+        multi_stats = get_multi_stats(db_table, views, day_cutoff_seconds, additional_filter=additional_filter,
+                                      profile=profile)
+
+    with _lock:
+        # Another thread may have cached stats for the same key in the meantime, which are kept.  The cached dict is
+        # replaced rather than updated, as other threads may be reading it.
+        cached_key, cached_stats = _stats_cache.get(col_path, (None, {}))
+        cached_stats = dict(cached_stats) if cached_key == key else {}
+        cached_stats.update(multi_stats)
+        _stats_cache[col_path] = (key, cached_stats)
+
+    return multi_stats[view]
+
+
+def _get_sidecar(sidecars, path, open_sidecar=None):
+    """Returns (sidecar, lock) for the sidecar database at path in sidecars (_checkpoints or _rollups), first opening
+    it with open_sidecar if it isn't open yet, or None if it isn't open and open_sidecar isn't given.  A sidecar can
+    only be used from one thread at a time, so the lock must be held while using it.  _lock is only held while
+    looking it up, so that computing the stats without the sidecar isn't held up by a thread using it."""
+
+    with _lock:
+        entry = sidecars.get(path)
+        if not entry and open_sidecar:
+            entry = sidecars[path] = (open_sidecar(path), threading.Lock())
+        return entry
+
+
+def _get_rollup(col_path, create=True):
+    """Returns (rollup, lock) for the StatsRollup for the collection (see _get_sidecar), or None if it doesn't exist
+    and create isn't set."""
+    return _get_sidecar(_rollups, os.path.join(os.path.dirname(col_path), _rollup_name),
+                        StatsRollup if create else None)
+
+
+def _get_rollup_stats(db_table, col_path, views, day_cutoff_seconds, additional_filter):
+    """Returns a dict mapping each (bucket_size_days, num_buckets) in views to the stats computed from the rollup,
+    or None if the rollup can't be used for them."""
+
+    try:
+        rollup, rollup_lock = _get_rollup(col_path)
+        multi_stats = {}
+        with rollup_lock:
+            for bucket_size_days, num_buckets in views:
+                stats = rollup.get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets,
+                                         additional_filter)
+                if stats is None:
+                    return None
+                multi_stats[(bucket_size_days, num_buckets)] = stats
+        return multi_stats
+    except sqlite3.Error:
+        traceback.print_exc()
+        with _lock:
+            _rollups.pop(os.path.join(os.path.dirname(col_path), _rollup_name), None)
+        return None
+
+
+def on_answer_card(reviewer, card, ease):
+    """Adds the review that was just made to the rollup, if the rollup option is set and the rollup was already
+    built by showing the stats.  This is skipped if the rollup is in use computing the stats, in which case the
+    rollup is brought up to date the next time the stats are shown."""
+
+    col_path = getattr(card.col, "path", None)
+    if not col_path or not _config().get("rollup"):
+        return
+    entry = _get_rollup(col_path, create=False)
+    if not entry:
+        return
+    rollup, rollup_lock = entry
+    if not rollup_lock.acquire(blocking=False):
+        return
+    try:
+        rollup.add_latest(card.col.db, card.id)
+    except sqlite3.Error:
+        traceback.print_exc()
+    finally:
+        rollup_lock.release()
+
+
+def rebuild_rollup():
+    """Rebuilds the rollup for the open collection from all its reviews if they changed in a way that showing the
+    stats doesn't notice, e.g. reviews were changed by a tool.  This reads all the reviews."""
+
+    from aqt import mw
+    from aqt.utils import tooltip
+
+    col = mw.col
+    if not col or not getattr(col, "path", None):
+        return
+    rollup, rollup_lock = _get_rollup(col.path)
+    with rollup_lock:
+        rollup.update(col.db, col.sched.dayCutoff)
+        rebuilt = not rollup.check(col.db)
+        if rebuilt:
+            rollup.rebuild(col.db, col.sched.dayCutoff)
+    if rebuilt:
+        with _lock:
+            _stats_cache.pop(col.path, None)
+    tooltip(_("Progress stats rollup rebuilt") if rebuilt else _("Progress stats rollup is up to date"))
+
+
 def _round_up_max(max_val):
     "Rounds up a maximum value."
 
@@ -121,24 +579,65 @@ def _round_down_min(min_val):
 
 def _plot(self, data, title, subtitle, bucket_size_days,
           include_cumulative=False,
-          color=defaultColor):
+          color=defaultColor,
+          interval=None,
+          sample_rate=None,
+          lines=None,
+          summary=None,
+          max_points=0):
+    """Returns the HTML for a graph of the data.  If sample_rate is given the data was estimated from one in
+    sample_rate cards, which is noted on the graph, and interval has the (bucket_index, low, high) confidence
+    intervals to draw around it.
+
+    lines is an (optional) list of (label, data) for other series to draw as lines over the data.  summary is an
+    (optional) list of (label, text) to show under the graph instead of the average per day.
+
+    If max_points is set each series is downsampled to at most that many points before it is sent to the graph (see
+    series.downsample).  The axes and the text under the graph are still computed from all the points."""
 
     global _num_graphs
     if not data:
         return ""
-    cumulative_total = 0
-    cumulative_data = []
-    for (x, y) in data:
-        cumulative_total += y
-        cumulative_data.append((x, cumulative_total))
-
-    txt = self._title(_(title), _(subtitle))
+    series = summarize(data)
 
-    graph_data = [dict(data=data, color=color)]
+    if sample_rate:
+        txt = self._title("~ " + _(title), _(subtitle) + " " + _("(estimated from 1 in %d cards)") % sample_rate)
+    else:
+        txt = self._title(_(title), _(subtitle))
+
+    graph_data = [dict(data=downsample(data, max_points), color=color)]
+    min_value, max_value = series.min_value, series.max_value
+
+    if interval:
+        for i, label in [(1, _("95% interval")), (2, None)]:
+            bounds = [(row[0], row[i]) for row in interval]
+            min_value = min(min_value, min(y for x, y in bounds))
+            max_value = max(max_value, max(y for x, y in bounds))
+            graph_data.append(
+                dict(data=downsample(bounds, max_points),
+                     color=color,
+                     label=label,
+                     bars={'show': False},
+                     lines=dict(show=True, lineWidth=1),
+                     shadowSize=0,
+                     stack=False))
+
+    for label, line_data in lines or ():
+        if line_data:
+            min_value = min(min_value, min(y for x, y in line_data))
+            max_value = max(max_value, max(y for x, y in line_data))
+        graph_data.append(
+            dict(data=downsample(line_data, max_points),
+                 color=color,
+                 label=label,
+                 bars={'show': False},
+                 lines=dict(show=True),
+                 points=dict(show=True),
+                 stack=False))
 
     if include_cumulative:
         graph_data.append(
-            dict(data=cumulative_data,
+            dict(data=downsample(series.cumulative, max_points),
                  color=color,
                  label=_("Cumulative"),
                  yaxis=2,
@@ -146,12 +645,12 @@ def _plot(self, data, title, subtitle, bucket_size_days,
                  lines=dict(show=True),
                  stack=False))
 
-    yaxes = [dict(min=_round_down_min(min(y for x, y in data)),
-                  max=_round_up_max(max(y for x, y in data)))]
+    yaxes = [dict(min=_round_down_min(min_value),
+                  max=_round_up_max(max_value))]
 
     if include_cumulative:
-        yaxes.append(dict(min=_round_down_min(min(y for x, y in cumulative_data)),
-                          max=_round_up_max(max(y for x, y in cumulative_data)),
+        yaxes.append(dict(min=_round_down_min(series.min_cumulative),
+                          max=_round_up_max(series.max_cumulative),
                           position="right"))
 
     graph_kwargs = {
@@ -165,11 +664,8 @@ def _plot(self, data, title, subtitle, bucket_size_days,
     # In recent versions of Anki, an xunit arg was added to _graph to control the tick
     # labelling.  The old version picked the tick labels based on the graph type (last month, last year,
     # or deck life).  Now for deck life it picks the appropriate bucket size based on the age of the deck.
-    try:
-        if "xunit" in inspect.signature(self._graph).parameters:
-            graph_kwargs["xunit"] = bucket_size_days
-    except Exception:
-        pass
+    if _graph_takes_xunit(self):
+        graph_kwargs["xunit"] = bucket_size_days
 
     txt += self._graph(**graph_kwargs)
 
@@ -177,17 +673,35 @@ def _plot(self, data, title, subtitle, bucket_size_days,
 
     text_lines = []
 
-    self._line(
-        text_lines,
-        _("Average"),
-        _("%(avg_cards)0.1f cards/day") % dict(avg_cards=cumulative_total / float(len(data) * bucket_size_days)))
+    if summary:
+        for label, text in summary:
+            self._line(text_lines, label, text)
+    else:
+        self._line(
+            text_lines,
+            _("Average"),
+            _("%(avg_cards)0.1f cards/day") % dict(avg_cards=series.total / float(len(data) * bucket_size_days)))
 
     if include_cumulative:
         self._line(
             text_lines,
             _("Total"),
-            _("%(total)d cards") % dict(total=cumulative_total))
+            _("%(total)d cards") % dict(total=series.total))
 
     txt += self._lineTbl(text_lines)
 
     return txt
+
+
+def _graph_takes_xunit(self):
+    "Returns whether the _graph method of the stats page takes the xunit argument, which is checked once per class."
+
+    cls = type(self)
+    takes_xunit = _graph_xunit.get(cls)
+    if takes_xunit is None:
+        try:
+            takes_xunit = "xunit" in inspect.signature(self._graph).parameters
+        except Exception:
+            takes_xunit = False
+        _graph_xunit[cls] = takes_xunit
+    return takes_xunit
@@ -0,0 +1,89 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from bisect import bisect_right
+
+
+# The lower edge of each bin of a LatencyHistogram in days.  The bins are about 20% wide past the first week, so a
+# quantile is off by at most a fifth of its value, and the last bin holds everything from two years on.
+BIN_EDGES = [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 14, 17, 21, 25, 30, 36, 43, 52, 62, 75, 90, 108, 130, 156, 187, 225,
+             270, 324, 389, 467, 560, 672, 730]
+
+
+class LatencyHistogram:
+    """Counts latencies in days (e.g. from when a card was learned to when it matured) in the fixed BIN_EDGES bins,
+    so that it takes the same space however many latencies are added.  Histograms for different buckets, or for
+    different shards of the reviews, are merged by adding up the counts.
+
+    counts: The number of latencies in each bin.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * len(BIN_EDGES)
+
+    def add(self, days):
+        self.counts[bisect_right(BIN_EDGES, max(days, 0)) - 1] += 1
+
+    def __iadd__(self, latencies):
+        "Adds each of the latencies, which are days, so that a Metric can return the latencies for a group."
+        for days in latencies:
+            self.add(days)
+        return self
+
+    def merge(self, other):
+        "Returns the histogram of the latencies in both self and other."
+        return LatencyHistogram([count + other_count for count, other_count in zip(self.counts, other.counts)])
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Returns the estimated q quantile (e.g. 0.5 for the median) of the latencies in days, or None if there
+        are none.  The latencies are assumed to be spread evenly within each bin, except for the last bin, which is
+        open ended and so is represented by its lower edge."""
+
+        total = len(self)
+        if not total:
+            return None
+
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i + 1 == len(BIN_EDGES):
+                    return float(BIN_EDGES[i])
+                return BIN_EDGES[i] + (BIN_EDGES[i + 1] - BIN_EDGES[i]) * (rank - seen) / float(count)
+            seen += count
+
+        return float(BIN_EDGES[-1])
+
+    def __eq__(self, other):
+        return isinstance(other, LatencyHistogram) and self.counts == other.counts
+
+    def __repr__(self):
+        return "LatencyHistogram(%r)" % self.counts
+
+
+def quantile_series(histograms, q):
+    """Returns the (bucket_index, quantile) for the q quantile of each of the (bucket_index, LatencyHistogram) that
+    isn't empty, e.g. to graph the median latency of the learned_to_mature_days stat over time."""
+    return [(bucket_index, histogram.quantile(q)) for bucket_index, histogram in histograms if len(histogram)]
+
+
+def total_histogram(histograms):
+    "Returns the LatencyHistogram for all the latencies in the (bucket_index, LatencyHistogram) histograms."
+    total = LatencyHistogram()
+    for bucket_index, histogram in histograms:
+        total = total.merge(histogram)
+    return total
@@ -0,0 +1,254 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .compute import _count_net_change, _merge_stats_by_bucket, _new_bucket_stats, _review_filters, \
+    _reviews_query, _stats_by_name, _where_clause
+
+
+class PartialStats:
+    """The stats for some of the reviews, which can be merged with the stats for other reviews to get exactly the
+    same stats as get_stats for all of them.  The reviews can be split up by time (e.g. by id range) or by card
+    (e.g. by cid modulo the number of shards), so that the stats can be computed in parallel and then reduced with
+    merge.
+
+    Whether a card matured or lost maturity over a bucket depends on the interval it had before its first review in
+    the bucket, which may come from earlier reviews, and on its interval after its last review in the bucket, which
+    may come from later reviews.  So for each card the stats for its first and last buckets are left open until all
+    the reviews are merged, and only the stats for the buckets in between are counted right away.
+
+    stats_by_bucket: Maps bucket_index to BucketStats with the stats that have been counted, which has a bucket for
+                     every review.
+    cards: Maps cid to [first_bucket_index, first_last_ivl, first_end_ivl, last_bucket_index, last_start_ivl,
+           last_end_ivl] where first_last_ivl is the lastIvl of the card's first review, the end ivls are the ivl
+           after the card's last review in the bucket and last_start_ivl is the interval the card had at the start of
+           its last bucket.  The last bucket is None if the card was only reviewed in one bucket.
+    first_learned: Maps cid to (id, bucket_index) for the review where the card was first learned, where
+                   bucket_index is None if the review isn't graphed.
+    """
+
+    def __init__(self):
+        self.stats_by_bucket = {}
+        self.cards = {}
+        self.first_learned = {}
+
+    def add(self, _id, bucket_index, cid, ivl, lastIvl):
+        "Adds a review, which must come after any reviews of the same card already added."
+
+        bucket_stats = self.stats_by_bucket.get(bucket_index)
+        if not bucket_stats:
+            bucket_stats = _new_bucket_stats(bucket_index)
+            self.stats_by_bucket[bucket_index] = bucket_stats
+
+        if lastIvl < 21 and ivl >= 21:
+            bucket_stats.stats.matured_reviews += 1
+
+        if ivl > 0 and lastIvl < 0:
+            self.add_first_learned(cid, _id, bucket_index)
+
+        state = self.cards.get(cid)
+        if state is None:
+            self.cards[cid] = [bucket_index, lastIvl, ivl, None, 0, 0]
+        elif state[3] is None and state[0] == bucket_index:
+            state[2] = ivl
+        elif state[3] is None:
+            # Prefer the last ivl from the previous bucket if available because lastIvl isn't always correct.
+            state[3:] = [bucket_index, state[2] or lastIvl, ivl]
+        elif state[3] == bucket_index:
+            state[5] = ivl
+        else:
+            _count_net_change(self.stats_by_bucket[state[3]].stats, state[4], state[5])
+            state[3:] = [bucket_index, state[5] or lastIvl, ivl]
+
+    def add_first_learned(self, cid, _id, bucket_index=None):
+        """Records that the card was learned by the review with id _id, which is only counted if it was the first
+        time the card was learned and the review is graphed, i.e. bucket_index isn't None."""
+
+        first_learned = self.first_learned.get(cid)
+        if first_learned is None or _id < first_learned[0]:
+            self.first_learned[cid] = (_id, bucket_index)
+
+    def merge(self, other):
+        """Returns the PartialStats for the reviews of both self and other, which must not have any reviews in
+        common.  Any reviews of a card in other must come after the reviews of the card in self, which is the case
+        if other covers a later time range or different cards."""
+
+        merged = PartialStats()
+        _merge_stats_by_bucket(merged.stats_by_bucket, self.stats_by_bucket)
+        _merge_stats_by_bucket(merged.stats_by_bucket, other.stats_by_bucket)
+
+        merged.cards = dict((cid, list(state)) for cid, state in self.cards.items())
+        for cid, state in other.cards.items():
+            earlier_state = merged.cards.get(cid)
+            if earlier_state is None:
+                merged.cards[cid] = list(state)
+            else:
+                merged.cards[cid] = merged._join(earlier_state, state)
+
+        merged.first_learned = dict(self.first_learned)
+        for cid, (_id, bucket_index) in other.first_learned.items():
+            merged.add_first_learned(cid, _id, bucket_index)
+
+        return merged
+
+    def _join(self, earlier, later):
+        """Returns the state of a card with the earlier state followed by the later state, counting the stats for
+        the buckets that end up between its first and last buckets."""
+
+        # The tail is the bucket with the card's latest reviews so far.  Its start is only known if it isn't the
+        # card's first bucket.
+        if earlier[3] is None:
+            first, tail, tail_start_known = None, earlier[:3], False
+        else:
+            first, tail, tail_start_known = earlier[:3], earlier[3:], True
+
+        if tail[0] == later[0]:
+            # The later reviews start in the same bucket that the earlier reviews end in.
+            tail = [tail[0], tail[1], later[2]]
+        else:
+            if tail_start_known:
+                _count_net_change(self.stats_by_bucket[tail[0]].stats, tail[1], tail[2])
+            else:
+                first = tail
+            tail, tail_start_known = [later[0], tail[2] or later[1], later[2]], True
+
+        if later[3] is not None:
+            if tail_start_known:
+                _count_net_change(self.stats_by_bucket[tail[0]].stats, tail[1], tail[2])
+            else:
+                first = tail
+            tail, tail_start_known = later[3:], True
+
+        if not tail_start_known:
+            return tail + [None, 0, 0]
+        return first + tail
+
+    def stats_by_name(self, num_buckets=None):
+        """Returns the stats in the same form as get_stats, which are the stats for all the reviews once the
+        PartialStats for all of them have been merged."""
+
+        stats_by_bucket = {}
+        _merge_stats_by_bucket(stats_by_bucket, self.stats_by_bucket)
+
+        for first_bucket_index, first_last_ivl, first_end_ivl, last_bucket_index, last_start_ivl, last_end_ivl in \
+                self.cards.values():
+            # There are no earlier reviews, so the start of the first bucket comes from its first review.
+            _count_net_change(stats_by_bucket[first_bucket_index].stats, first_last_ivl, first_end_ivl)
+            if last_bucket_index is not None:
+                _count_net_change(stats_by_bucket[last_bucket_index].stats, last_start_ivl, last_end_ivl)
+
+        for _id, bucket_index in self.first_learned.values():
+            if bucket_index is not None:
+                stats_by_bucket[bucket_index].stats.learned_cards += 1
+
+        return _stats_by_name(stats_by_bucket, num_buckets)
+
+    def to_dict(self):
+        "Returns the PartialStats as a dict of lists that can be written as JSON, e.g. to send it to another machine."
+        return dict(
+            stats_by_bucket=sorted(
+                [bucket_index, stats.matured_cards, stats.matured_reviews, stats.lost_matured_card,
+                 stats.learned_cards]
+                for bucket_index, (_, stats) in self.stats_by_bucket.items()),
+            cards=sorted([cid] + state for cid, state in self.cards.items()),
+            first_learned=sorted([cid, _id, bucket_index]
+                                 for cid, (_id, bucket_index) in self.first_learned.items()))
+
+    @classmethod
+    def from_dict(cls, d):
+        partial = cls()
+        for bucket_index, matured_cards, matured_reviews, lost_matured_card, learned_cards in d["stats_by_bucket"]:
+            bucket_stats = _new_bucket_stats(bucket_index)
+            bucket_stats.stats.matured_cards = matured_cards
+            bucket_stats.stats.matured_reviews = matured_reviews
+            bucket_stats.stats.lost_matured_card = lost_matured_card
+            bucket_stats.stats.learned_cards = learned_cards
+            partial.stats_by_bucket[bucket_index] = bucket_stats
+        for row in d["cards"]:
+            partial.cards[row[0]] = list(row[1:])
+        for cid, _id, bucket_index in d["first_learned"]:
+            partial.first_learned[cid] = (_id, bucket_index)
+        return partial
+
+    def __eq__(self, other):
+        return isinstance(other, PartialStats) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "PartialStats(%r)" % self.to_dict()
+
+
+def get_partial_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                      start_id=None, end_id=None):
+    """Returns the PartialStats for the reviews with ids from start_id up to but not including end_id.  The
+    PartialStats for ranges covering all the reviews, or for additional filters that split up the cards, merge
+    to the same stats as get_stats with the same arguments.
+
+    The reviews before the graphed period are only used to tell when each card was first learned."""
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+
+    range_filters = []
+    if start_id is not None:
+        range_filters.append("rl.id >= %d" % start_id)
+    if end_id is not None:
+        range_filters.append("rl.id < %d" % end_id)
+
+    partial = PartialStats()
+
+    if id_cutoff and (start_id is None or start_id < id_cutoff):
+        learned_filters = ["rl.ivl > 0", "rl.lastIvl < 0", "rl.id < %d" % id_cutoff] + range_filters
+        if additional_filter:
+            learned_filters.append(additional_filter)
+        for cid, _id in db_table.all("SELECT rl.cid, min(rl.id) FROM revlog rl %s GROUP BY rl.cid" % (
+                _where_clause(learned_filters))):
+            partial.add_first_learned(cid, _id)
+
+    if id_cutoff is None or end_id is None or end_id > id_cutoff:
+        for _id, bucket_index, cid, ease, ivl, lastIvl, _type in db_table.all(
+                _reviews_query(bucket_size_days, day_cutoff_seconds, filters + range_filters)):
+            partial.add(_id, bucket_index, cid, ivl, lastIvl)
+
+    return partial
+
+
+def iter_deck_life_stats(db_table, bucket_size_days, day_cutoff_seconds, additional_filter=None,
+                         num_recent_buckets=12):
+    """Yields the stats for all the reviews (i.e. get_stats with no num_buckets) for more and more of the history,
+    so they can be shown before all the reviews have been read.  The first stats are for the most recent
+    num_recent_buckets buckets, then the number of buckets doubles each time until the last stats, which are for all
+    the reviews and the same as get_stats.
+
+    Until then the stats for the earliest bucket read so far may be off for cards that were reviewed before it, and
+    cards that were learned again are counted as learned if they were first learned before it."""
+
+    bucket_ms = int(bucket_size_days * 86400000)
+    day_cutoff_ms = int(day_cutoff_seconds * 1000)
+    min_id = db_table.all("SELECT min(id) FROM revlog")[0][0]
+
+    partial = PartialStats()
+    end_id = None
+    num_buckets = num_recent_buckets
+    while True:
+        # Start right after the end of a bucket so that the buckets read so far are complete.
+        start_id = day_cutoff_ms - num_buckets * bucket_ms + 1
+        if min_id is None or start_id <= min_id:
+            start_id = None
+
+        partial = get_partial_stats(
+            db_table, bucket_size_days, day_cutoff_seconds, None, additional_filter, start_id, end_id).merge(partial)
+        yield partial.stats_by_name()
+
+        if start_id is None:
+            return
+        end_id = start_id
+        num_buckets *= 2
@@ -0,0 +1,123 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+import time
+import tracemalloc
+
+
+# The measurements for one phase of computing or rendering the stats.  rows, buckets and peak_bytes are None when
+# they don't apply to the phase or weren't measured.
+Phase = namedtuple('Phase', ['name', 'seconds', 'rows', 'buckets', 'peak_bytes'])
+
+
+class StatsProfile:
+    """Records the time spent in each phase of computing and rendering the stats, e.g. the query, bucketing the
+    reviews, aggregating them and generating the HTML.  Pass one as the profile argument of get_stats (and the
+    related functions) to fill it in.
+
+    callback is an (optional) function called with each Phase as soon as it finishes.
+
+    trace_memory enables measuring the peak memory allocated by Python during each phase with tracemalloc, which
+    makes everything noticeably slower.
+    """
+
+    def __init__(self, callback=None, trace_memory=False):
+        self.phases = []
+        self.callback = callback
+        self.trace_memory = trace_memory
+
+    def phase(self, name):
+        """Returns a context manager that times the code it wraps as the named phase.  Set rows and buckets on the
+        object it returns to record them."""
+        return _PhaseTimer(self, name)
+
+    def total_seconds(self):
+        return sum(phase.seconds for phase in self.phases)
+
+    def summary(self):
+        "Returns a one line description of the phases, e.g. for showing under the graphs."
+
+        parts = []
+        for phase in self.phases:
+            details = []
+            if phase.rows is not None:
+                details.append("%d rows" % phase.rows)
+            if phase.buckets is not None:
+                details.append("%d buckets" % phase.buckets)
+            if phase.peak_bytes is not None:
+                details.append("%.1f MB" % (phase.peak_bytes / 1e6))
+            parts.append("%s %.0f ms%s" % (phase.name, phase.seconds * 1000,
+                                           " (%s)" % ", ".join(details) if details else ""))
+        parts.append("total %.0f ms" % (self.total_seconds() * 1000))
+        return " | ".join(parts)
+
+    def _add(self, phase):
+        self.phases.append(phase)
+        if self.callback:
+            self.callback(phase)
+
+
+class _PhaseTimer:
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.rows = None
+        self.buckets = None
+        self._tracing = False
+
+    def __enter__(self):
+        # Don't interfere with anyone else tracing memory.
+        if self.profile.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+        peak_bytes = None
+        if self._tracing:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if exc_type is None:
+            self.profile._add(Phase(name=self.name, seconds=seconds, rows=self.rows, buckets=self.buckets,
+                                    peak_bytes=peak_bytes))
+        return False
+
+
+class _NoPhase:
+    "Stands in for _PhaseTimer when nothing is being profiled."
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+class _NoProfile:
+    "Stands in for StatsProfile when nothing is being profiled, so that profiling costs next to nothing."
+
+    _phase = _NoPhase()
+
+    def phase(self, name):
+        return self._phase
+
+
+NO_PROFILE = _NoProfile()
@@ -0,0 +1,330 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+
+from .compute import _StatsAccumulator, _bucket_index, _iter_rows, _max_usn
+
+
+# Bumped whenever the schema changes, so that rollups saved by earlier versions are rebuilt.
+_SCHEMA_VERSION = 3
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS rollup_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    ref_cutoff_ms INTEGER NOT NULL,
+    high_water_id INTEGER NOT NULL,
+    max_usn INTEGER NOT NULL,
+    num_reviews INTEGER NOT NULL,
+    id_sum INTEGER NOT NULL,
+    cid_sum INTEGER NOT NULL,
+    ivl_sum INTEGER NOT NULL,
+    last_ivl_sum INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_card_day (
+    day INTEGER NOT NULL,
+    cid INTEGER NOT NULL,
+    day_end INTEGER NOT NULL,
+    first_last_ivl INTEGER NOT NULL,
+    end_ivl INTEGER NOT NULL,
+    matured_reviews INTEGER NOT NULL,
+    num_reviews INTEGER NOT NULL,
+    PRIMARY KEY (day, cid, day_end)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_card (
+    cid INTEGER PRIMARY KEY,
+    first_learned_id INTEGER NOT NULL
+);
+"""
+
+_DAY_MS = 86400000
+
+# The ids and cids are summed modulo this prime for the fingerprint of the reviews, the same as for checkpoints.
+_FINGERPRINT_MOD = 1000003
+
+# The days are numbered relative to a cutoff this far after the day cutoff when the rollup was built, so that every
+# review is before it.
+_REF_CUTOFF_DAYS = 36500
+
+
+class StatsRollup:
+    """Keeps a per-day rollup of the reviews in a sidecar SQLite database, from which the same stats as get_stats
+    can be computed for any whole number of days per bucket without reading revlog.
+
+    The stats for a bucket can't be added up from per-day counts, because a card that matures on one day and loses
+    maturity on the next neither matured nor lost maturity over a week.  So the rollup has a row per card per day it
+    was reviewed with the lastIvl of the first review, the ivl of the last review, the number of reviews where the
+    card matured and the number of reviews, along with the id where each card was first learned.  Each answer
+    updates a single row (see add_latest).  A review exactly at the end of a day is in a row of its own (with
+    day_end set), as depending on the day cutoff get_stats puts it in the bucket of either that day or the next.
+
+    Before adding newer reviews the rollup checks that revlog still has its newest review, which undo deletes
+    before any older review, and that revlog has as many reviews as it does from the start of the day before its
+    newest review on, or if a sync has happened since it was last brought up to date (i.e. revlog has a larger
+    usn), from the earliest review the sync brought in or sent on.  These only read the reviews in that range
+    through the id and usn indexes.  If they differ the rollup is rebuilt.  Other changes, such as reviews rewritten
+    or deleted by a tool, are only noticed by check, which compares a fingerprint of all the reviews.
+
+    A StatsRollup may be used from any thread, but only from one thread at a time.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # The rollup can always be rebuilt, so there's no need to wait for it to reach the disk.
+        self.conn.execute("PRAGMA synchronous = OFF")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            self.conn.executescript("""\
+              DROP TABLE IF EXISTS rollup_state;
+              DROP TABLE IF EXISTS rollup_card_day;
+              DROP TABLE IF EXISTS rollup_card;
+              PRAGMA user_version = %d;""" % _SCHEMA_VERSION)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _state(self):
+        """Returns (ref_cutoff_ms, high_water_id, max_usn, fingerprint), where max_usn is the largest usn in revlog
+        when the rollup was last brought up to date and fingerprint is that of the reviews up to and including
+        high_water_id (see _fingerprint), or None if the rollup hasn't been built."""
+        row = self.conn.execute(
+            """SELECT ref_cutoff_ms, high_water_id, max_usn, num_reviews, id_sum, cid_sum, ivl_sum, last_ivl_sum
+               FROM rollup_state""").fetchone()
+        return (row[0], row[1], row[2], row[3:]) if row else None
+
+    def rebuild(self, db_table, day_cutoff_seconds):
+        "Builds the rollup from all the reviews in revlog, replacing anything already there."
+
+        ref_cutoff_ms = int(day_cutoff_seconds * 1000) + _REF_CUTOFF_DAYS * _DAY_MS
+        max_usn = _max_usn(db_table)
+        with self.conn:
+            self.conn.execute("DELETE FROM rollup_card_day")
+            self.conn.execute("DELETE FROM rollup_card")
+            self.conn.execute("INSERT OR REPLACE INTO rollup_state VALUES (1, ?, 0, ?, 0, 0, 0, 0, 0)",
+                              (ref_cutoff_ms, max_usn))
+            self._add_reviews(_iter_rows(db_table, "SELECT id, cid, ivl, lastIvl FROM revlog ORDER BY id"),
+                              ref_cutoff_ms, 0, (0, 0, 0, 0, 0))
+
+    def update(self, db_table, day_cutoff_seconds):
+        """Adds any reviews newer than those already in the rollup, or rebuilds it if it was never built or the
+        reviews it has changed, e.g. answers were undone or a sync added older reviews."""
+
+        state = self._state()
+        if not state:
+            self.rebuild(db_table, day_cutoff_seconds)
+            return
+
+        ref_cutoff_ms, high_water_id, max_usn, fingerprint = state
+        check_from_day = _day(high_water_id, ref_cutoff_ms) - 1
+        revlog_max_usn = _max_usn(db_table)
+        if revlog_max_usn > max_usn:
+            # Using +id keeps SQLite from going through the reviews in id order to find the first with a larger usn.
+            synced_from_id = db_table.all("SELECT min(+id) FROM revlog WHERE usn > %d" % max_usn)[0][0]
+            check_from_day = min(check_from_day, _day(synced_from_id, ref_cutoff_ms))
+
+        num_reviews, max_id, high_water_kept = db_table.all("""\
+          SELECT count(), (SELECT max(id) FROM revlog), EXISTS (SELECT 1 FROM revlog WHERE id = %d)
+          FROM revlog
+          WHERE id > %d AND id <= %d""" % (high_water_id, _day_end_id(check_from_day - 1, ref_cutoff_ms),
+                                           high_water_id))[0]
+        rollup_num_reviews = self.conn.execute(
+            "SELECT coalesce(sum(num_reviews), 0) FROM rollup_card_day WHERE day >= ?", (check_from_day,)).fetchone()[0]
+        if num_reviews != rollup_num_reviews or (high_water_id and not high_water_kept):
+            self.rebuild(db_table, day_cutoff_seconds)
+            return
+
+        with self.conn:
+            if max_id and max_id > high_water_id:
+                reviews = db_table.all("SELECT id, cid, ivl, lastIvl FROM revlog WHERE id > %d ORDER BY id"
+                                       % high_water_id)
+                self._add_reviews(reviews, ref_cutoff_ms, high_water_id, fingerprint)
+            if revlog_max_usn != max_usn:
+                self.conn.execute("UPDATE rollup_state SET max_usn = ?", (revlog_max_usn,))
+
+    def add_latest(self, db_table, cid):
+        """Adds the latest review of the card, e.g. right after it was answered.  This only reads the one review, so
+        if other reviews are missing from the rollup this is noticed by the next update."""
+
+        state = self._state()
+        if not state:
+            return
+
+        ref_cutoff_ms, high_water_id, max_usn, fingerprint = state
+        reviews = db_table.all("SELECT id, cid, ivl, lastIvl FROM revlog WHERE cid = %d ORDER BY id DESC LIMIT 1"
+                               % cid)
+        if reviews and reviews[0][0] > high_water_id:
+            with self.conn:
+                self._add_reviews(reviews, ref_cutoff_ms, high_water_id, fingerprint)
+
+    def check(self, db_table):
+        """Returns whether the reviews in the rollup are the same as those in revlog up to the newest review in the
+        rollup, according to their fingerprint.  Unlike update this notices reviews that were rewritten or deleted
+        at any time, but it reads all of revlog."""
+
+        state = self._state()
+        return bool(state) and _fingerprint(db_table, state[1]) == state[3]
+
+    def _add_reviews(self, reviews, ref_cutoff_ms, high_water_id, fingerprint):
+        """Adds (id, cid, ivl, lastIvl) rows in ascending id order, all newer than high_water_id, and adds them to
+        the fingerprint of the reviews in the rollup.  Only the rows for the day of high_water_id can already be in
+        the rollup, so the rows for the later days are built in memory one day at a time."""
+
+        num_reviews, id_sum, cid_sum, ivl_sum, last_ivl_sum = fingerprint
+
+        high_water_day = _day(high_water_id, ref_cutoff_ms) if high_water_id else None
+        current_day = None
+
+        # Maps cid to [first_last_ivl, end_ivl, matured_reviews, num_reviews] for the current day.
+        card_days = {}
+        day_ends = []
+        learned = []
+
+        for _id, cid, ivl, lastIvl in reviews:
+            day = _day(_id, ref_cutoff_ms)
+            matured = 1 if lastIvl < 21 and ivl >= 21 else 0
+            if _id == _day_end_id(day, ref_cutoff_ms):
+                day_ends.append((day, cid, 1, lastIvl, ivl, matured, 1))
+            else:
+                if day != current_day:
+                    self._save_day(current_day, card_days)
+                    card_days = {}
+                    current_day = day
+
+                card_day = card_days.get(cid)
+                if card_day is None and day == high_water_day:
+                    row = self.conn.execute(
+                        """SELECT first_last_ivl, end_ivl, matured_reviews, num_reviews FROM rollup_card_day
+                           WHERE day = ? AND cid = ? AND day_end = 0""", (day, cid)).fetchone()
+                    if row:
+                        card_day = list(row)
+                        card_days[cid] = card_day
+                if card_day is None:
+                    card_days[cid] = [lastIvl, ivl, 0, 0]
+                    card_day = card_days[cid]
+
+                card_day[1] = ivl
+                card_day[2] += matured
+                card_day[3] += 1
+
+            if ivl > 0 and lastIvl < 0:
+                learned.append((cid, _id))
+
+            high_water_id = _id
+            num_reviews += 1
+            id_sum += _id % _FINGERPRINT_MOD
+            cid_sum += cid % _FINGERPRINT_MOD
+            ivl_sum += ivl
+            last_ivl_sum += lastIvl
+
+        self._save_day(current_day, card_days)
+        self.conn.executemany("INSERT OR REPLACE INTO rollup_card_day VALUES (?, ?, ?, ?, ?, ?, ?)", day_ends)
+
+        # The reviews are added in ascending id order, so the first learned id is never replaced.
+        self.conn.executemany("INSERT OR IGNORE INTO rollup_card VALUES (?, ?)", learned)
+        self.conn.execute("""UPDATE rollup_state SET high_water_id = ?, num_reviews = ?, id_sum = ?, cid_sum = ?,
+                                                     ivl_sum = ?, last_ivl_sum = ?""",
+                          (high_water_id, num_reviews, id_sum, cid_sum, ivl_sum, last_ivl_sum))
+
+    def _save_day(self, day, card_days):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO rollup_card_day VALUES (?, ?, 0, ?, ?, ?, ?)",
+            ((day, cid, first_last_ivl, end_ivl, matured_reviews, num_reviews)
+             for cid, (first_last_ivl, end_ivl, matured_reviews, num_reviews) in card_days.items()))
+
+    def get_stats(self, db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+        """Returns the same stats as get_stats, after bringing the rollup up to date, or None if they can't be
+        computed from the rollup.  This is the case if bucket_size_days isn't a whole number of days or if
+        additional_filter doesn't just limit which cards are included, i.e. it refers to revlog columns other than
+        cid."""
+
+        if bucket_size_days != int(bucket_size_days) or bucket_size_days < 1:
+            return None
+        bucket_size_days = int(bucket_size_days)
+
+        cids = None
+        if additional_filter:
+            try:
+                cids = set(cid for (cid,) in db_table.all(
+                    "SELECT cid FROM (SELECT id AS cid FROM cards) rl WHERE %s" % additional_filter))
+            except Exception:
+                return None
+
+        self.update(db_table, day_cutoff_seconds)
+        day_cutoff_ms = int(day_cutoff_seconds * 1000)
+        if (self._state()[0] - day_cutoff_ms) % _DAY_MS:
+            # The time of day when days start has changed.
+            self.rebuild(db_table, day_cutoff_seconds)
+        ref_cutoff_ms = self._state()[0]
+        bucket_ms = bucket_size_days * _DAY_MS
+
+        # The number of days from the day cutoff to the reference cutoff, which is added to the days in the rollup
+        # to get the days relative to the day cutoff, where 0 is today.
+        shift = (ref_cutoff_ms - day_cutoff_ms) // _DAY_MS
+
+        first_day = -1000000000
+        if num_buckets:
+            first_day = -(bucket_size_days * num_buckets) + 1 - shift
+
+        first_learned = dict(self.conn.execute("SELECT cid, first_learned_id FROM rollup_card"))
+
+        # The review at the end of the day before the first day is at the start of the graphed period, so is
+        # graphed too.  Within a day, the review at its end comes after the others.
+        accumulator = _StatsAccumulator()
+        for day, cid, day_end, first_last_ivl, end_ivl, matured_reviews in self.conn.execute(
+                """SELECT day, cid, day_end, first_last_ivl, end_ivl, matured_reviews FROM rollup_card_day
+                   WHERE day >= ? ORDER BY day, day_end""", (first_day - 1,)):
+            if cids is not None and cid not in cids:
+                continue
+            if day_end:
+                _id = _day_end_id(day, ref_cutoff_ms)
+                bucket_index = _bucket_index(_id, day_cutoff_ms, bucket_ms)
+                learned = first_learned.get(cid) == _id
+            else:
+                if day < first_day:
+                    continue
+                relative_day = day + shift
+                if relative_day <= 0:
+                    bucket_index = -(-relative_day // bucket_size_days)
+                else:
+                    bucket_index = (relative_day - 1) // bucket_size_days + 1
+                learned_id = first_learned.get(cid)
+                learned = learned_id is not None and _day(learned_id, ref_cutoff_ms) == day and \
+                    learned_id != _day_end_id(day, ref_cutoff_ms)
+            accumulator.add_group(bucket_index, cid, first_last_ivl, end_ivl, matured_reviews, learned)
+
+        return accumulator.stats_by_name(num_buckets)
+
+
+def _fingerprint(db_table, high_water_id):
+    """Returns (count, sum of ids, sum of cids, sum of ivls, sum of lastIvls) for the reviews up to and including
+    high_water_id, with the ids and cids summed modulo _FINGERPRINT_MOD.  This changes if any of these reviews are
+    deleted or rewritten or an older review is added, even if the number of reviews doesn't."""
+
+    row = db_table.all("""\
+      SELECT count(), sum(id %% %d), sum(cid %% %d), sum(ivl), sum(lastIvl)
+      FROM revlog
+      WHERE id <= %d""" % (_FINGERPRINT_MOD, _FINGERPRINT_MOD, high_water_id))[0]
+    return tuple(value or 0 for value in row)
+
+
+def _day(_id, ref_cutoff_ms):
+    """Returns the day of the review relative to the reference cutoff, numbered the same way as the buckets of
+    get_stats, e.g. 0 for the day ending at the cutoff, -1 for the day before, etc.  A day ends with the id exactly
+    at its end."""
+    return -((ref_cutoff_ms - _id) // _DAY_MS)
+
+
+def _day_end_id(day, ref_cutoff_ms):
+    "Returns the id exactly at the end of the day, which is the last id in the day (see _day)."
+    return ref_cutoff_ms + day * _DAY_MS
@@ -0,0 +1,110 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from collections import namedtuple, defaultdict
+
+from .compute import _bucket_index_sql, _review_filters, _where_clause, get_stats
+
+
+# Stats estimated from a sample of the cards.
+#
+# stats: The estimated stats, in the same form as get_stats.
+# intervals: Maps the name of each stat to a list of (bucket_index, low, high) with the 95% confidence interval for
+#            each bucket.
+# sample_rate: One in this many cards were sampled.
+SampledStats = namedtuple('SampledStats', ['stats', 'intervals', 'sample_rate'])
+
+# The normal quantile for a 95% confidence interval.
+_Z = 1.96
+
+
+def sample_filter(sample_rate, additional_filter=None):
+    """Returns the filter selecting one in sample_rate of the cards matching additional_filter.  Card ids are
+    creation times in milliseconds, so taking the ids with a given remainder spreads the sample evenly over cards of
+    all ages."""
+
+    sample = "rl.cid %% %d = 0" % sample_rate
+    if additional_filter:
+        return "%s AND (%s)" % (sample, additional_filter)
+    return sample
+
+
+def _matured_reviews_squares(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, sampled_filter):
+    """Returns a dict mapping each bucket_index to the sum over the sampled cards of the square of the number of
+    reviews where the card matured in the bucket, which the variance of the estimated matured_reviews is computed
+    from."""
+
+    _, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, sampled_filter)
+    return dict(db_table.all("""\
+      SELECT bucket_index, sum(num_matured * num_matured)
+      FROM (
+        SELECT %s AS bucket_index, count() AS num_matured
+        FROM revlog rl
+        %s
+        GROUP BY bucket_index, rl.cid
+      )
+      GROUP BY bucket_index
+      """ % (_bucket_index_sql(bucket_size_days, day_cutoff_seconds),
+             _where_clause(filters + ["rl.lastIvl < 21", "rl.ivl >= 21"]))))
+
+
+def get_sampled_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None,
+                      sample_rate=10, engine="python", profile=None):
+    """Returns SampledStats estimating the result of get_stats from the reviews of one in sample_rate cards, which
+    only has to process a fraction of the reviews.  The same cards are sampled each time, so the estimates don't
+    change unless the reviews do.
+
+    Each stat is a total over the cards of a per-card value, so each estimate is the sampled total scaled up by
+    sample_rate, and the intervals use the normal approximation with the variance of that scaled total estimated from
+    the sum of the squares of the sampled values.  The stats other than matured_reviews count each card at most once
+    per bucket, so the sum of the squares is just the count, which makes this the usual binomial interval.
+    matured_reviews can count a card several times per bucket, so its sums of squares are looked up separately.
+    Buckets where no sampled card was counted get the interval for a single card rather than an empty interval."""
+
+    sampled_filter = sample_filter(sample_rate, additional_filter)
+    stats = get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, sampled_filter, engine=engine,
+                      profile=profile)
+
+    estimates = defaultdict(list)
+    intervals = defaultdict(list)
+    for name, values in stats.items():
+        for bucket_index, value in values:
+            estimates[name].append((bucket_index, value * sample_rate))
+
+    def add_interval(name, bucket_index, estimate, sum_squares, can_be_negative=False):
+        # Each card is sampled with probability 1 / sample_rate, so the variance of the scaled total is estimated by
+        # sample_rate ** 2 * (1 - 1 / sample_rate) * the sum of the squares of the sampled values.
+        half_width = _Z * sample_rate * math.sqrt(max(sum_squares, 1) * (1 - 1.0 / sample_rate))
+        low = estimate - half_width
+        if not can_be_negative:
+            low = max(low, 0)
+        intervals[name].append((bucket_index, low, estimate + half_width))
+
+    for name in ["matured_cards", "lost_matured_card", "learned_cards"]:
+        for bucket_index, value in stats.get(name, ()):
+            add_interval(name, bucket_index, value * sample_rate, value)
+
+    if "matured_reviews" in stats:
+        squares = _matured_reviews_squares(db_table, bucket_size_days, day_cutoff_seconds, num_buckets,
+                                           sampled_filter)
+        for bucket_index, value in stats["matured_reviews"]:
+            add_interval("matured_reviews", bucket_index, value * sample_rate, squares.get(bucket_index, 0))
+
+    # A card can't both mature and lose maturity in the same bucket, so each card counts +1, -1 or 0 and the sum of
+    # the squares is the number of cards that matured or lost maturity.
+    for (bucket_index, matured), (_, lost) in zip(stats.get("matured_cards", ()), stats.get("lost_matured_card", ())):
+        add_interval("net_matured_cards", bucket_index, (matured - lost) * sample_rate, matured + lost, True)
+
+    return SampledStats(stats=estimates, intervals=intervals, sample_rate=sample_rate)
@@ -0,0 +1,87 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+
+
+# What the graphs need to know about a series of (bucket_index, value), computed in a single pass over it.
+#
+# cumulative: The running total of the values as a list of (bucket_index, total).
+# total: The sum of the values.
+# min_value, max_value: The smallest and largest values.
+# min_cumulative, max_cumulative: The smallest and largest running totals.
+SeriesSummary = namedtuple('SeriesSummary', ['cumulative', 'total', 'min_value', 'max_value', 'min_cumulative',
+                                             'max_cumulative'])
+
+
+def summarize(data):
+    "Returns the SeriesSummary for data, a non-empty list of (bucket_index, value)."
+
+    cumulative = []
+    total = 0
+    min_value = max_value = data[0][1]
+    min_cumulative = max_cumulative = data[0][1]
+    for x, y in data:
+        total += y
+        cumulative.append((x, total))
+        if y < min_value:
+            min_value = y
+        elif y > max_value:
+            max_value = y
+        if total < min_cumulative:
+            min_cumulative = total
+        elif total > max_cumulative:
+            max_cumulative = total
+
+    return SeriesSummary(cumulative, total, min_value, max_value, min_cumulative, max_cumulative)
+
+
+def downsample(data, max_points):
+    """Returns at most max_points of the points in data, a list of (x, y) in ascending x order, chosen with the
+    Largest-Triangle-Three-Buckets algorithm so that the peaks and troughs that give the series its shape are kept.
+    The first and last points are always kept.  Returns data itself if it has no more than max_points points or
+    max_points is 0 (or too small to downsample to)."""
+
+    if not max_points or max_points < 3 or len(data) <= max_points:
+        return data
+
+    # The points between the first and last are split into max_points - 2 buckets, and the point kept from each
+    # bucket is the one forming the largest triangle with the point kept from the previous bucket and the average of
+    # the next bucket.
+    bucket_size = (len(data) - 2) / float(max_points - 2)
+    sampled = [data[0]]
+    previous_x, previous_y = data[0]
+    for i in range(max_points - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        next_end = min(int((i + 2) * bucket_size) + 1, len(data))
+        next_points = data[end:next_end] or data[-1:]
+        average_x = sum(x for x, y in next_points) / float(len(next_points))
+        average_y = sum(y for x, y in next_points) / float(len(next_points))
+
+        best_area = -1
+        best = None
+        for point in data[start:end]:
+            x, y = point
+            area = abs((previous_x - average_x) * (y - previous_y) - (previous_x - x) * (average_y - previous_y))
+            if area > best_area:
+                best_area = area
+                best = point
+
+        sampled.append(best)
+        previous_x, previous_y = best
+
+    sampled.append(data[-1])
+    return sampled
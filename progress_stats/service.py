@@ -0,0 +1,125 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serves the progress stats for many Anki collections from an asyncio application, e.g. a web dashboard, without
+Anki.  The stats are computed on a bounded pool of workers so the event loop stays responsive, identical requests
+that arrive while the stats are being computed share a single computation, and only so many computations run at
+once for each collection.  The collections are opened read-only.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+
+from .cli import day_cutoff_seconds as collection_day_cutoff_seconds
+from .compute import get_stats
+from .db import open_table
+
+
+def _compute(path, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter, engine, immutable):
+    """Returns the stats for the collection at path as JSON, shaped like the dict returned by get_stats.  This is a
+    module level function so that it can also run in a process pool.  The connection to the collection is kept open
+    for later requests for it (see open_table)."""
+
+    with open_table(path, immutable) as db_table:
+        if day_cutoff_seconds is None:
+            day_cutoff_seconds = collection_day_cutoff_seconds(db_table)
+        stats = get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter,
+                          engine=engine)
+    return json.dumps(stats, sort_keys=True)
+
+
+class StatsService:
+    """Computes the stats for collections requested by coroutines running in an asyncio event loop.
+
+    executor runs the computations.  By default it is a pool of max_workers threads, which is enough when the time
+    is mostly spent in SQLite, but a concurrent.futures.ProcessPoolExecutor may be given instead.
+
+    max_per_collection is the most computations that run at once for the same collection, however many workers are
+    free, so that a few busy collections can't take up the whole pool.
+
+    immutable opens the collections as files that can't change, which is faster but only safe if they aren't in use
+    (see ReadOnlyTable).
+
+    num_computed and num_coalesced count the requests that were computed and that shared the computation of an
+    identical request already in flight.
+    """
+
+    def __init__(self, max_workers=4, max_per_collection=1, engine="python", immutable=False, executor=None):
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+        self._owns_executor = executor is None
+        self.max_per_collection = max_per_collection
+        self.engine = engine
+        self.immutable = immutable
+        self.num_computed = 0
+        self.num_coalesced = 0
+
+        # The computation for each request in flight, by request key, and the semaphore limiting the computations
+        # for each collection along with the number of computations using it, by path.
+        self._in_flight = {}
+        self._semaphores = {}
+
+    @staticmethod
+    def request_key(path, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+        "Returns the key under which identical requests are coalesced."
+        return (os.path.abspath(path), additional_filter, bucket_size_days, num_buckets, day_cutoff_seconds)
+
+    async def stats_json(self, path, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+        """Returns the stats for the collection at path as JSON, shaped like the dict returned by get_stats, which
+        takes the same arguments.  If day_cutoff_seconds is None it is computed from the collection's scheduler
+        settings (see cli.day_cutoff_seconds).
+
+        If the same stats are already being computed for another request, this waits for that computation rather
+        than starting another.  Cancelling the coroutine doesn't cancel a computation other requests are waiting
+        for.  An error computing the stats is raised to every request waiting for them.
+        """
+
+        key = self.request_key(path, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._compute(key))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._in_flight.pop(key, None))
+            self.num_computed += 1
+        else:
+            self.num_coalesced += 1
+        return await asyncio.shield(future)
+
+    async def stats(self, path, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+        "Same as stats_json, but returns the stats as a dict mapping each stat to a list of [bucket_index, value]."
+        return json.loads(await self.stats_json(path, bucket_size_days, day_cutoff_seconds, num_buckets,
+                                                additional_filter))
+
+    async def _compute(self, key):
+        path, additional_filter, bucket_size_days, num_buckets, day_cutoff_seconds = key
+        if path not in self._semaphores:
+            self._semaphores[path] = [asyncio.Semaphore(self.max_per_collection), 0]
+        semaphore = self._semaphores[path]
+        semaphore[1] += 1
+        try:
+            async with semaphore[0]:
+                return await asyncio.get_event_loop().run_in_executor(
+                    self.executor, _compute, path, bucket_size_days, day_cutoff_seconds, num_buckets,
+                    additional_filter, self.engine, self.immutable)
+        finally:
+            # Only keep the semaphores for the collections with computations in flight.
+            semaphore[1] -= 1
+            if not semaphore[1]:
+                del self._semaphores[path]
+
+    def close(self):
+        "Shuts down the pool of workers, if it was created by the service, once the running computations are done."
+        if self._owns_executor:
+            self.executor.shutdown()
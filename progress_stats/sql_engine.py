@@ -0,0 +1,107 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .compute import ProgressStats, BucketStats, _bucket_index_sql, _review_filters, _stats_by_name, _where_clause
+
+
+def supports_window_functions(db_table):
+    "Check if the SQLite library behind db_table supports window functions (added in SQLite 3.25)."
+    try:
+        db_table.all("SELECT row_number() OVER () FROM (SELECT 1)")
+        return True
+    except Exception:
+        return False
+
+
+def _stats_query(bucket_size_days, day_cutoff_seconds, filters, additional_filter):
+    """Returns the query that computes the stats per bucket.  Each step mirrors the Python implementation in
+    compute.py:
+
+    reviews: the same reviews _get_reviews fetches, bucketed the same way.
+    first_learned: the id where each card was first learned, which may be before the reviews being graphed.
+    grouped: the reviews for each card in each bucket, reduced to the lastIvl of the first review, the ivl of the
+             last review, the number of reviews where the card matured and whether the card was first learned.
+    chained: the interval each card had at the start of the bucket, which is the ivl at the end of the card's
+             previous bucket if available because lastIvl isn't always correct.
+    """
+
+    learned_filters = ["rl.ivl > 0", "rl.lastIvl < 0", "rl.cid IN (SELECT cid FROM reviews)"]
+    if additional_filter:
+        learned_filters.append(additional_filter)
+
+    return """\
+      WITH reviews AS (
+        SELECT rl.id, %s as bucket_index, rl.cid, rl.ivl, rl.lastIvl
+        FROM revlog rl
+        %s
+      ),
+      first_learned AS (
+        SELECT rl.cid, min(rl.id) AS first_learned_id
+        FROM revlog rl
+        %s
+        GROUP BY rl.cid
+      ),
+      ordered AS (
+        SELECT r.bucket_index, r.cid, r.id, r.ivl, r.lastIvl, fl.first_learned_id,
+               FIRST_VALUE(r.lastIvl) OVER card_bucket AS first_last_ivl,
+               LAST_VALUE(r.ivl) OVER card_bucket AS end_ivl
+        FROM reviews r
+        LEFT JOIN first_learned fl ON fl.cid = r.cid
+        WINDOW card_bucket AS (PARTITION BY r.cid, r.bucket_index ORDER BY r.id
+                               ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+      ),
+      grouped AS (
+        SELECT bucket_index, cid,
+               max(first_last_ivl) AS first_last_ivl,
+               max(end_ivl) AS end_ivl,
+               sum(lastIvl < 21 AND ivl >= 21) AS matured_reviews,
+               coalesce(max(id = first_learned_id), 0) AS learned
+        FROM ordered
+        GROUP BY bucket_index, cid
+      ),
+      chained AS (
+        SELECT bucket_index, first_last_ivl, end_ivl, matured_reviews, learned,
+               coalesce(nullif(LAG(end_ivl) OVER (PARTITION BY cid ORDER BY bucket_index), 0), first_last_ivl)
+                 AS start_ivl
+        FROM grouped
+      )
+      SELECT bucket_index,
+             sum(start_ivl < 21 AND end_ivl >= 21),
+             sum(matured_reviews),
+             sum(start_ivl >= 21 AND end_ivl < 21),
+             sum(learned)
+      FROM chained
+      GROUP BY bucket_index;
+      """ % (_bucket_index_sql(bucket_size_days, day_cutoff_seconds), _where_clause(filters),
+             _where_clause(learned_filters))
+
+
+def get_stats_sql(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+    """Computes the same stats as get_stats in a single query using window functions, so that only the finished
+    per-bucket counts are returned from the database.  Requires window function support (see
+    supports_window_functions)."""
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+
+    stats_by_bucket = {}
+    for bucket_index, matured_cards, matured_reviews, lost_matured_card, learned_cards in db_table.all(
+            _stats_query(bucket_size_days, day_cutoff_seconds, filters, additional_filter)):
+        stats = ProgressStats()
+        stats.matured_cards = matured_cards
+        stats.matured_reviews = matured_reviews
+        stats.lost_matured_card = lost_matured_card
+        stats.learned_cards = learned_cards
+        stats_by_bucket[bucket_index] = BucketStats(bucket_index=bucket_index, stats=stats)
+
+    return _stats_by_name(stats_by_bucket, num_buckets)
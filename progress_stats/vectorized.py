@@ -0,0 +1,94 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .compute import ProgressStats, BucketStats, _first_learned, _review_filters, _reviews_query, _stats_by_name
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_stats_numpy(db_table, bucket_size_days, day_cutoff_seconds, num_buckets=None, additional_filter=None):
+    """Computes the same stats as get_stats using NumPy array operations instead of a Python loop over the
+    reviews.  Requires NumPy."""
+
+    id_cutoff, filters = _review_filters(bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+
+    # Maps cid to the id where the card was first learned, for cards first learned before the graphed reviews.
+    first_learned_before = _first_learned(db_table, id_cutoff, additional_filter)
+
+    rows = db_table.all(_reviews_query(bucket_size_days, day_cutoff_seconds, filters))
+    if not rows:
+        return _stats_by_name({}, num_buckets)
+
+    columns = np.array(rows, dtype=np.int64)
+    del rows
+
+    # Sort the reviews by card and then by time so that the reviews for each card in each bucket are contiguous.
+    order = np.lexsort((columns[:, 0], columns[:, 2]))
+    bucket_indexes = columns[order, 1]
+    cids = columns[order, 2]
+    ivls = columns[order, 4]
+    last_ivls = columns[order, 5]
+    del columns, order
+
+    # The review where each card was first learned is the earliest review where the ivl becomes positive.
+    learned = (ivls > 0) & (last_ivls < 0)
+    if first_learned_before:
+        learned &= ~np.isin(cids, np.fromiter(first_learned_before, dtype=np.int64))
+    learned_positions = np.flatnonzero(learned)
+    first_learned = np.zeros(len(cids), dtype=bool)
+    if len(learned_positions):
+        learned_cids = cids[learned_positions]
+        first_learned[learned_positions[np.concatenate(([True], learned_cids[1:] != learned_cids[:-1]))]] = True
+
+    # Find the first and last review of each card in each bucket.
+    group_starts = np.flatnonzero(np.concatenate((
+        [True], (cids[1:] != cids[:-1]) | (bucket_indexes[1:] != bucket_indexes[:-1]))))
+    group_ends = np.concatenate((group_starts[1:], [len(cids)])) - 1
+    group_cids = cids[group_starts]
+    group_bucket_indexes = bucket_indexes[group_starts]
+    end_ivls = ivls[group_ends]
+
+    # Prefer the ivl at the end of the card's previous bucket if available because lastIvl isn't always correct.
+    previous_ivls = np.zeros(len(group_starts), dtype=np.int64)
+    same_card = group_cids[1:] == group_cids[:-1]
+    previous_ivls[1:][same_card] = end_ivls[:-1][same_card]
+    start_ivls = np.where(previous_ivls != 0, previous_ivls, last_ivls[group_starts])
+
+    min_bucket_index = int(bucket_indexes.min())
+    length = int(bucket_indexes.max()) - min_bucket_index + 1
+    group_offsets = group_bucket_indexes - min_bucket_index
+    review_offsets = bucket_indexes - min_bucket_index
+
+    def count(offsets, weights):
+        return np.bincount(offsets, weights=weights.astype(np.int64), minlength=length).astype(np.int64)
+
+    matured_cards = count(group_offsets, (start_ivls < 21) & (end_ivls >= 21))
+    lost_matured_card = count(group_offsets, (start_ivls >= 21) & (end_ivls < 21))
+    matured_reviews = count(review_offsets, (last_ivls < 21) & (ivls >= 21))
+    learned_cards = count(review_offsets, first_learned)
+
+    stats_by_bucket = {}
+    for offset in np.unique(group_offsets):
+        stats = ProgressStats()
+        stats.matured_cards = int(matured_cards[offset])
+        stats.matured_reviews = int(matured_reviews[offset])
+        stats.lost_matured_card = int(lost_matured_card[offset])
+        stats.learned_cards = int(learned_cards[offset])
+        bucket_index = int(offset) + min_bucket_index
+        stats_by_bucket[bucket_index] = BucketStats(bucket_index=bucket_index, stats=stats)
+
+    return _stats_by_name(stats_by_bucket, num_buckets)
@@ -8,10 +8,24 @@ TEMP_DIR=`mktemp -d`
 echo Using temp dir $TEMP_DIR
 cp __init__.py $TEMP_DIR
 cp manifest.json $TEMP_DIR
+cp config.json $TEMP_DIR
+cp config.md $TEMP_DIR
 mkdir $TEMP_DIR/progress_stats
 cp progress_stats/__init__.py $TEMP_DIR/progress_stats
+cp progress_stats/background.py $TEMP_DIR/progress_stats
+cp progress_stats/checkpoint.py $TEMP_DIR/progress_stats
 cp progress_stats/compute.py $TEMP_DIR/progress_stats
+cp progress_stats/db.py $TEMP_DIR/progress_stats
 cp progress_stats/graphs.py $TEMP_DIR/progress_stats
+cp progress_stats/latency.py $TEMP_DIR/progress_stats
+cp progress_stats/partial.py $TEMP_DIR/progress_stats
+cp progress_stats/profile.py $TEMP_DIR/progress_stats
+cp progress_stats/review_store.py $TEMP_DIR/progress_stats
+cp progress_stats/rollup.py $TEMP_DIR/progress_stats
+cp progress_stats/sampling.py $TEMP_DIR/progress_stats
+cp progress_stats/series.py $TEMP_DIR/progress_stats
+cp progress_stats/sql_engine.py $TEMP_DIR/progress_stats
+cp progress_stats/vectorized.py $TEMP_DIR/progress_stats
 pushd $TEMP_DIR
 zip -r anki_progress_stats.zip .
 echo Moving package to $TARGET_DIR
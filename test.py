@@ -15,14 +15,13 @@
 from datetime import datetime
 import pytz
 import tzlocal
-from sqlite3 import dbapi2 as sqlite
-from sqlalchemy import create_engine
+import sqlite3
 
+from tests.helpers import Table
 from progress_stats.compute import get_stats
 
 
-engine = create_engine('sqlite+pysqlite:///test_collection.anki2', module=sqlite)
-conn = engine.connect()
+conn = sqlite3.connect('test_collection.anki2')
 
 
 def get_next_day_cutoff_seconds(hour):
@@ -39,9 +38,8 @@ def get_next_day_cutoff_seconds(hour):
 
 cutoff = get_next_day_cutoff_seconds(4)  # 4 am cutoff
 
-# TODO this won't work because db_conn has been removed.  Need to pass the table instead.
 stats = get_stats(
-    db_conn=conn,
+    db_table=Table(conn),
     bucket_size_days=30, day_cutoff_seconds=cutoff)
 print(stats)
 
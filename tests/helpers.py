@@ -0,0 +1,100 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+
+
+# 4 am on 2020-09-14 (UTC)
+DAY_CUTOFF_SECONDS = 1600056000
+
+
+class Table:
+    "Wraps a sqlite3 connection so it can be used as the db_table for get_stats."
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def all(self, query):
+        return self.conn.execute(query).fetchall()
+
+
+class RevlogTable:
+    """An in-memory collection with just the revlog and cards tables, usable as the db_table for get_stats."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("""\
+          CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null,
+                               ease integer not null, ivl integer not null, lastIvl integer not null,
+                               factor integer not null, time integer not null, type integer not null)""")
+        self.conn.execute("CREATE INDEX ix_revlog_usn ON revlog (usn)")
+        self.conn.execute("CREATE TABLE cards (id integer primary key, did integer not null)")
+        self.queries = []
+
+    def all(self, query):
+        self.queries.append(query)
+        return self.conn.execute(query).fetchall()
+
+    def add_card(self, cid, did=1):
+        self.conn.execute("INSERT OR IGNORE INTO cards (id, did) VALUES (?, ?)", (cid, did))
+
+    def add_review(self, _id, cid, ivl, lastIvl, ease=3, _type=1, usn=-1):
+        "Adds a review, which by default was made locally, as it has yet to be synced."
+        self.conn.execute("INSERT INTO revlog VALUES (?, ?, ?, ?, ?, ?, 2500, 5000, ?)",
+                          (_id, cid, usn, ease, ivl, lastIvl, _type))
+
+
+def full_scans(table):
+    "Returns the queries made of revlog that read all of it, rather than a range of one of its indexes."
+    plans = [(query, table.conn.execute("EXPLAIN QUERY PLAN " + query).fetchall())
+             for query in table.queries if "FROM revlog" in query]
+    return [query for query, plan in plans
+            if any(detail.startswith("SCAN") and detail != "SCAN CONSTANT ROW" for _, _, _, detail in plan)]
+
+
+def add_random_reviews(table, rng, num_cards=50, num_days=400, end_seconds=DAY_CUTOFF_SECONDS, num_decks=1):
+    """Simulates reviews of num_cards cards over the num_days days before end_seconds, including learning,
+    lapses, relearning, filtered deck reviews and the occasional incorrect lastIvl."""
+
+    start_ms = (end_seconds - num_days * 86400) * 1000
+    end_ms = end_seconds * 1000
+    for _ in range(num_cards):
+        t = rng.randrange(start_ms, end_ms)
+        cid = t - rng.randrange(1, 10 ** 8)
+        table.add_card(cid, did=rng.randrange(num_decks) + 1)
+        ivl = -60
+        while t < end_ms:
+            lastIvl = ivl
+            if rng.random() < 0.05:
+                # lastIvl isn't always correct
+                lastIvl = rng.choice([0, -600, 1, 30])
+
+            if rng.random() < 0.05:
+                # filtered deck review
+                ivl, ease, _type = rng.choice([0, ivl]), 3, 3
+            elif ivl < 0:
+                ivl, ease, _type = rng.choice([-600, 1, 1, 4]), 3, rng.choice([0, 2])
+            elif rng.random() < 0.15:
+                # lapse
+                ivl, ease, _type = -600, 1, 1
+            else:
+                ivl, ease, _type = max(ivl + 1, int(ivl * rng.uniform(1.5, 3))), 3, 1
+
+            if not table.conn.execute("SELECT 1 FROM revlog WHERE id = ?", (t,)).fetchone():
+                table.add_review(t, cid, ivl, lastIvl, ease=ease, _type=_type)
+
+            if ivl > 0:
+                t += ivl * 86400000 + rng.randrange(-3600000, 3600000 * 6)
+            else:
+                t += rng.randrange(60000, 3600000 * 30)
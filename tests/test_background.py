@@ -0,0 +1,114 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+
+import pytest
+
+from progress_stats.background import StatsJob
+from progress_stats.db import Cancelled, CollectionTable
+from progress_stats.compute import get_stats
+
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+from .helpers import Table
+
+
+# Takes long enough to be cancelled while it runs.
+SLOW_QUERY = """\
+  WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000)
+  SELECT count() FROM n"""
+
+
+@pytest.fixture(scope="module")
+def path(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp("background").join("collection.anki2"))
+    create_collection(path, 3000).close()
+    return path
+
+
+def _run(job):
+    job.start().thread.join(30)
+    assert not job.thread.is_alive()
+
+
+class TestStatsJob:
+
+    def test_done(self, path):
+        results = []
+        _run(StatsJob(path, lambda db_table: get_stats(db_table, 7, DAY_CUTOFF_SECONDS, 52), results.append))
+
+        assert results == [get_stats(Table(sqlite3.connect(path)), 7, DAY_CUTOFF_SECONDS, 52)]
+
+    def test_error(self, path):
+        results = []
+        errors = []
+        _run(StatsJob(path, lambda db_table: db_table.all("SELECT * FROM missing"), results.append, errors.append))
+
+        assert results == []
+        assert isinstance(errors[0], sqlite3.OperationalError)
+
+    def test_cancel_running(self, path):
+        started = threading.Event()
+        results = []
+        errors = []
+
+        def compute(db_table):
+            started.set()
+            return db_table.all(SLOW_QUERY)
+
+        job = StatsJob(path, compute, results.append, errors.append).start()
+        started.wait(10)
+        job.cancel()
+        job.thread.join(30)
+
+        assert not job.thread.is_alive()
+        assert results == [] and errors == []
+
+    def test_cancel_before_start(self, path):
+        results = []
+        job = StatsJob(path, lambda db_table: 1, results.append)
+        job.cancel()
+        _run(job)
+        assert results == []
+
+    def test_collection_table(self, path):
+        "The job can read through the connection of a collection open in Anki rather than its own."
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA locking_mode = exclusive")
+        conn.execute("UPDATE col SET crt = crt")
+        conn.commit()
+        try:
+            results = []
+            errors = []
+            _run(StatsJob(path, lambda db_table: get_stats(db_table, 7, DAY_CUTOFF_SECONDS, 52), results.append,
+                          errors.append))
+            assert isinstance(errors[0], sqlite3.OperationalError)
+
+            _run(StatsJob(path, lambda db_table: get_stats(db_table, 7, DAY_CUTOFF_SECONDS, 52), results.append,
+                          open_table=lambda path: CollectionTable(Table(conn))))
+            assert results == [get_stats(Table(conn), 7, DAY_CUTOFF_SECONDS, 52)]
+        finally:
+            conn.close()
+
+
+class TestCollectionTable:
+
+    def test_cancel(self, path):
+        db_table = CollectionTable(Table(sqlite3.connect(path)))
+        assert db_table.all("SELECT count() FROM cards")[0][0] > 0
+        db_table.cancel()
+        with pytest.raises(Cancelled):
+            db_table.all("SELECT count() FROM cards")
@@ -0,0 +1,61 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from benchmarks.bench_get_stats import PERIODS, compare, run
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS, create_collection, generate_reviews
+from progress_stats.compute import get_stats
+
+from .helpers import Table
+
+
+class TestSynthetic:
+
+    def test_deterministic(self):
+        assert list(generate_reviews(2000, seed=3)) == list(generate_reviews(2000, seed=3))
+        assert list(generate_reviews(2000, seed=3)) != list(generate_reviews(2000, seed=4))
+
+    def test_review_types(self):
+        types = set(review[-1] for _, reviews in generate_reviews(5000) for review in reviews)
+
+        # Learning, review, relearning and filtered deck reviews
+        assert types == {0, 1, 2, 3}
+
+    def test_collection(self, tmpdir):
+        conn = create_collection(str(tmpdir.join("synthetic.anki2")), 5000)
+        assert conn.execute("SELECT count() FROM revlog").fetchone()[0] >= 5000
+        stats = get_stats(Table(conn), 31, DAY_CUTOFF_SECONDS)
+        assert sum(y for x, y in stats["learned_cards"]) > 0
+
+
+class TestBenchmark:
+
+    def test_run(self, tmpdir):
+        conn = create_collection(str(tmpdir.join("synthetic.anki2")), 2000)
+        results = run(Table(conn), 2000, repeat=1, engines=["python", "sql"], render=False)
+
+        phases = ["fetch", "aggregate", "get_stats[python]", "get_stats[sql]"]
+        assert [(r["period"], r["phase"]) for r in results] == \
+            [(period[0], phase) for period in PERIODS for phase in phases]
+        assert all(r["seconds"] >= 0 and r["peak_bytes"] >= 0 for r in results)
+
+    def test_compare(self):
+        baseline = dict(results=[
+            dict(reviews=10, period="1 month", phase="fetch", seconds=1.0),
+            dict(reviews=10, period="1 month", phase="aggregate", seconds=1.0)])
+        results = [
+            dict(reviews=10, period="1 month", phase="fetch", seconds=1.1),
+            dict(reviews=10, period="1 month", phase="aggregate", seconds=2.0),
+            dict(reviews=10, period="1 month", phase="render", seconds=5.0)]
+
+        assert compare(results, baseline, 0.25) == [(10, "1 month", "aggregate")]
@@ -0,0 +1,167 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import sqlite3
+
+import pytest
+
+from progress_stats.checkpoint import StatsCheckpoint
+from progress_stats.compute import get_multi_stats, get_stats
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews, full_scans
+
+
+PARAMS = [(1, 31), (7, 52), (31, None)]
+
+
+@pytest.fixture
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(1), num_cards=80)
+    return table
+
+
+class TestStatsCheckpoint:
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_matches_full_recompute(self, table, bucket_size_days, num_buckets):
+        checkpoint = StatsCheckpoint()
+        for _ in range(2):
+            assert checkpoint.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets) == \
+                get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_only_new_reviews_fetched(self, bucket_size_days, num_buckets):
+        table = RevlogTable()
+        rng = random.Random(2)
+        add_random_reviews(table, rng, num_cards=60, end_seconds=DAY_CUTOFF_SECONDS - 86400 * 3)
+        checkpoint = StatsCheckpoint()
+        checkpoint.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+        # Review some of the existing cards again and add a few new cards.
+        high_water_id = table.conn.execute("SELECT max(id) FROM revlog").fetchone()[0]
+        _id = (DAY_CUTOFF_SECONDS - 86400 * 2) * 1000
+        for (cid,) in table.conn.execute("SELECT DISTINCT cid FROM revlog ORDER BY cid").fetchall()[::3]:
+            _id += 1000
+            table.add_review(_id, cid, ivl=rng.choice([-600, 5, 30]), lastIvl=rng.choice([-600, 5, 30]))
+        add_random_reviews(table, rng, num_cards=5, num_days=2)
+        num_new = table.conn.execute("SELECT count() FROM revlog WHERE id > ?", (high_water_id,)).fetchone()[0]
+
+        del table.queries[:]
+        stats = checkpoint.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+        fetched = sum(len(table.conn.execute(query).fetchall()) for query in table.queries if "bucket_index" in query)
+        assert fetched <= num_new
+
+        assert stats == get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+    def test_multi_stats(self, table):
+        checkpoint = StatsCheckpoint()
+        assert checkpoint.get_multi_stats(table, PARAMS[:2], DAY_CUTOFF_SECONDS) == \
+            get_multi_stats(table, PARAMS[:2], DAY_CUTOFF_SECONDS)
+
+        # One view is up to date, one needs the new reviews and one has no checkpoint yet.  The new reviews are
+        # answered after the ones already checkpointed, as they are in Anki.
+        checkpoint.get_stats(table, 1, DAY_CUTOFF_SECONDS, 31)
+        add_random_reviews(table, random.Random(4), num_cards=5, num_days=2,
+                           end_seconds=DAY_CUTOFF_SECONDS + 86400 * 2)
+        expected = get_multi_stats(table, PARAMS, DAY_CUTOFF_SECONDS)
+        del table.queries[:]
+        assert checkpoint.get_multi_stats(table, PARAMS, DAY_CUTOFF_SECONDS) == expected
+        assert len([query for query in table.queries if "bucket_index" in query]) == 1
+
+    def test_reused_without_reading_reviews(self, table):
+        checkpoint = StatsCheckpoint()
+        checkpoint.get_multi_stats(table, PARAMS, DAY_CUTOFF_SECONDS)
+        add_random_reviews(table, random.Random(5), num_cards=5, num_days=2,
+                           end_seconds=DAY_CUTOFF_SECONDS + 86400 * 2)
+        expected = get_multi_stats(table, PARAMS, DAY_CUTOFF_SECONDS)
+
+        del table.queries[:]
+        assert checkpoint.get_multi_stats(table, PARAMS, DAY_CUTOFF_SECONDS) == expected
+        assert full_scans(table) == []
+
+    def test_undone_reviews_invalidate(self, table):
+        checkpoint = StatsCheckpoint()
+        checkpoint.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        table.conn.execute("DELETE FROM revlog WHERE id IN (SELECT id FROM revlog ORDER BY id DESC LIMIT 3)")
+        assert checkpoint.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52) == get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+
+    def test_synced_reviews_invalidate(self, table):
+        checkpoint = StatsCheckpoint()
+        checkpoint.get_stats(table, 31, DAY_CUTOFF_SECONDS)
+
+        # The sync brings in a card maturing 9 weeks ago, and sets the usn of the reviews made here.
+        table.add_card(12345)
+        table.add_review((DAY_CUTOFF_SECONDS - 86400 * 60) * 1000 + 1, 12345, ivl=30, lastIvl=5, usn=1)
+        table.conn.execute("UPDATE revlog SET usn = 1 WHERE usn = -1")
+        assert checkpoint.get_stats(table, 31, DAY_CUTOFF_SECONDS) == get_stats(table, 31, DAY_CUTOFF_SECONDS)
+
+    def test_moved_cards_invalidate(self):
+        table = RevlogTable()
+        add_random_reviews(table, random.Random(6), num_cards=80, num_decks=2)
+        additional_filter = "cid in (select id from cards where did = 1)"
+        checkpoint = StatsCheckpoint()
+        checkpoint.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, additional_filter)
+
+        table.conn.execute("UPDATE cards SET did = 1 WHERE id = (SELECT min(id) FROM cards WHERE did = 2)")
+        assert checkpoint.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, additional_filter) == \
+            get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, additional_filter)
+
+    def test_review_filter_not_saved(self, table):
+        "A filter on revlog columns other than cid can't be checked without reading the reviews, so isn't saved."
+        checkpoint = StatsCheckpoint()
+        for _ in range(2):
+            assert checkpoint.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, "ease = 1") == \
+                get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, "ease = 1")
+        assert checkpoint.conn.execute("SELECT count() FROM checkpoint").fetchone()[0] == 0
+
+    def test_day_cutoff_change(self, table):
+        checkpoint = StatsCheckpoint()
+        checkpoint.get_stats(table, 1, DAY_CUTOFF_SECONDS, 31)
+        day_cutoff_seconds = DAY_CUTOFF_SECONDS + 86400
+        assert checkpoint.get_stats(table, 1, day_cutoff_seconds, 31) == get_stats(table, 1, day_cutoff_seconds, 31)
+
+    def test_persisted(self, table, tmp_path):
+        path = str(tmp_path / "checkpoint.db")
+        StatsCheckpoint(path).get_stats(table, 7, DAY_CUTOFF_SECONDS)
+        checkpoint = StatsCheckpoint(path)
+        assert checkpoint.get_stats(table, 7, DAY_CUTOFF_SECONDS) == get_stats(table, 7, DAY_CUTOFF_SECONDS)
+
+    def test_old_schema(self, table, tmp_path):
+        "Checkpoints saved by an earlier version, e.g. with the buckets shifted as the day cutoff moved, are discarded."
+        path = str(tmp_path / "checkpoint.db")
+        StatsCheckpoint(path).get_stats(table, 1, DAY_CUTOFF_SECONDS, 31)
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute("UPDATE bucket_stats SET bucket_index = bucket_index + 1000")
+        conn.execute("PRAGMA user_version = 0")
+        conn.close()
+
+        checkpoint = StatsCheckpoint(path)
+        assert checkpoint.get_stats(table, 1, DAY_CUTOFF_SECONDS, 31) == get_stats(table, 1, DAY_CUTOFF_SECONDS, 31)
+
+    def test_only_reviews_after_cutoff(self):
+        table = RevlogTable()
+        table.add_card(1)
+        table.add_review((DAY_CUTOFF_SECONDS + 86400) * 1000 + 1, 1, ivl=2, lastIvl=100)
+
+        checkpoint = StatsCheckpoint()
+        for _ in range(2):
+            stats = checkpoint.get_stats(table, 31, DAY_CUTOFF_SECONDS)
+            assert stats["lost_matured_card"] == [(0, 0), (1, 1)]
+            assert stats == get_stats(table, 31, DAY_CUTOFF_SECONDS)
+
+    def test_empty(self):
+        assert StatsCheckpoint().get_stats(RevlogTable(), 1, DAY_CUTOFF_SECONDS, 31) == {}
@@ -0,0 +1,105 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+import pickle
+import random
+
+import pytest
+
+from progress_stats.cid_index import CidIndex, difference, intersection, union
+from progress_stats.compute import STANDARD_METRICS, get_metric_stats, get_stats, maturity_metrics
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(5), num_cards=40)
+    return table
+
+
+class TestCidIndex:
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", [(1, 31), (7, 52), (31, None)])
+    def test_matches_per_card_stats(self, table, bucket_size_days, num_buckets):
+        cid_index = CidIndex()
+        stats = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, cid_index=cid_index)
+        assert stats == get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+        # The cards behind each stat are the cards whose own stats are non-zero.
+        expected = {}
+        for (cid,) in table.all("SELECT id FROM cards"):
+            card_stats = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, "cid = %d" % cid)
+            for name, values in card_stats.items():
+                for bucket_index, value in values:
+                    if value:
+                        expected.setdefault(name, {}).setdefault(bucket_index, []).append(cid)
+
+        assert set(cid_index.cids_by_name) == set(expected)
+        for name in expected:
+            assert cid_index.bucket_indexes(name) == sorted(expected[name])
+            for bucket_index, cids in expected[name].items():
+                assert cid_index.cids(name, bucket_index) == array('q', sorted(cids))
+
+        for name in ["matured_cards", "lost_matured_card", "learned_cards"]:
+            for bucket_index, value in stats[name]:
+                assert len(cid_index.cids(name, bucket_index)) == value
+
+    def test_metric_names(self, table):
+        cid_index = CidIndex(["lost_matured_card_30"])
+        stats = get_metric_stats(table, 7, DAY_CUTOFF_SECONDS, STANDARD_METRICS + maturity_metrics(30), 52,
+                                 cid_index=cid_index)
+
+        assert list(cid_index.cids_by_name) == ["lost_matured_card_30"]
+        assert sum(len(cid_index.cids("lost_matured_card_30", bucket_index))
+                   for bucket_index, value in stats["lost_matured_card_30"]) == \
+            sum(value for bucket_index, value in stats["lost_matured_card_30"]) > 0
+
+    def test_missing(self):
+        cid_index = CidIndex()
+        assert cid_index.cids("matured_cards", -3) == array('q')
+        assert cid_index.bucket_indexes("matured_cards") == []
+
+    def test_pickle(self, table):
+        cid_index = CidIndex()
+        get_stats(table, 7, DAY_CUTOFF_SECONDS, cid_index=cid_index)
+        assert pickle.loads(pickle.dumps((get_stats(table, 7, DAY_CUTOFF_SECONDS), cid_index)))[1] == cid_index
+
+    def test_cids_in_buckets(self, table):
+        cid_index = CidIndex()
+        get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, cid_index=cid_index)
+
+        cids = cid_index.cids_in_buckets("matured_cards", range(-51, 1))
+        assert list(cids) == sorted(set(cid for bucket_index in cid_index.bucket_indexes("matured_cards")
+                                        for cid in cid_index.cids("matured_cards", bucket_index)))
+
+
+class TestSetOperations:
+
+    def test_union(self):
+        assert union(array('q', [1, 5, 9]), array('q', [2, 5]), array('q')) == array('q', [1, 2, 5, 9])
+        assert union(array('q', [3])) == array('q', [3])
+        assert union() == array('q')
+
+    def test_intersection(self):
+        assert intersection(array('q', [1, 5, 9]), array('q', [2, 5, 9]), array('q', [5, 9, 10])) == \
+            array('q', [5, 9])
+        assert intersection(array('q', [1]), array('q')) == array('q')
+        assert intersection() == array('q')
+
+    def test_difference(self):
+        assert difference(array('q', [1, 5, 9]), array('q', [5]), array('q', [1, 2])) == array('q', [9])
+        assert difference(array('q', [1, 5])) == array('q', [1, 5])
@@ -0,0 +1,111 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import datetime
+import json
+import sqlite3
+
+import pytest
+
+from progress_stats.cli import day_cutoff_seconds, main
+from progress_stats.compute import get_stats
+
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+from .helpers import Table
+
+
+@pytest.fixture(scope="module")
+def collections(tmpdir_factory):
+    "Two collections in a directory and a file that isn't a collection."
+    tmpdir = tmpdir_factory.mktemp("collections")
+    paths = []
+    for seed in range(2):
+        path = str(tmpdir.mkdir("user%d" % seed).join("collection.anki2"))
+        create_collection(path, 2000, seed).close()
+        paths.append(path)
+    broken = tmpdir.mkdir("broken").join("collection.anki2")
+    broken.write("not a database")
+    return str(tmpdir), paths, str(broken)
+
+
+def _expected(path, bucket_size_days, num_buckets):
+    stats = get_stats(Table(sqlite3.connect(path)), bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+    return json.loads(json.dumps(stats))
+
+
+class TestCli:
+
+    @pytest.mark.parametrize("processes", ["1", "2"])
+    def test_jsonl(self, collections, tmpdir, processes):
+        directory, paths, broken = collections
+        output = str(tmpdir.join("stats.jsonl"))
+
+        assert main([directory, "--bucket-size-days", "7", "--num-buckets", "52", "--day-cutoff",
+                     str(DAY_CUTOFF_SECONDS), "--processes", processes, "--output", output]) == 1
+
+        with open(output) as f:
+            results = dict((result["path"], result) for result in map(json.loads, f))
+        assert sorted(results) == sorted(paths + [broken])
+        for path in paths:
+            assert results[path]["stats"] == _expected(path, 7, 52)
+        assert "DatabaseError" in results[broken]["error"]
+
+    def test_csv(self, collections, tmpdir):
+        directory, paths, broken = collections
+        output = str(tmpdir.join("stats.csv"))
+
+        assert main([paths[0], "--bucket-size-days", "1", "--num-buckets", "31", "--day-cutoff",
+                     str(DAY_CUTOFF_SECONDS), "--processes", "1", "--format", "csv", "--output", output]) == 0
+
+        with open(output) as f:
+            rows = list(csv.DictReader(f))
+        expected = _expected(paths[0], 1, 31)
+        assert len(rows) == 31 * len(expected)
+        assert [int(row["value"]) for row in rows if row["name"] == "learned_cards"] == \
+            [value for bucket_index, value in expected["learned_cards"]]
+
+    def test_day_cutoff(self, collections):
+        directory, paths, broken = collections
+        table = Table(sqlite3.connect(paths[0]))
+
+        assert day_cutoff_seconds(table, DAY_CUTOFF_SECONDS - 1) == DAY_CUTOFF_SECONDS
+        assert day_cutoff_seconds(table, DAY_CUTOFF_SECONDS) == DAY_CUTOFF_SECONDS + 86400
+
+    @pytest.mark.parametrize("schema", ["col", "config"])
+    def test_day_cutoff_v2(self, schema):
+        "The v2 scheduler starts the next day at the rollover hour in local time, which may be after the crt's hour."
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE col (id integer primary key, crt integer not null, conf text not null)")
+        conf = {"schedVer": 2, "rollover": 7}
+        if schema == "col":
+            conn.execute("INSERT INTO col VALUES (1, ?, ?)", (DAY_CUTOFF_SECONDS, json.dumps(conf)))
+        else:
+            conn.execute("INSERT INTO col VALUES (1, ?, '')", (DAY_CUTOFF_SECONDS,))
+            conn.execute("CREATE TABLE config (key text primary key, val blob not null)")
+            conn.executemany("INSERT INTO config VALUES (?, ?)",
+                             [(key, json.dumps(value).encode()) for key, value in conf.items()])
+        table = Table(conn)
+
+        for now in [DAY_CUTOFF_SECONDS + 3600, DAY_CUTOFF_SECONDS + 86400 * 3 + 12 * 3600]:
+            cutoff = day_cutoff_seconds(table, now)
+            assert now < cutoff <= now + 86400
+            assert datetime.datetime.fromtimestamp(cutoff).time() == datetime.time(7)
+
+        # The v1 scheduler ignores the rollover hour.
+        conf["schedVer"] = 1
+        conn.execute("UPDATE col SET conf = ?", (json.dumps(conf),))
+        conn.execute("DROP TABLE IF EXISTS config")
+        assert day_cutoff_seconds(table, DAY_CUTOFF_SECONDS) == DAY_CUTOFF_SECONDS + 86400
@@ -0,0 +1,234 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from benchmarks import reference
+from progress_stats import vectorized
+from progress_stats.compute import STANDARD_METRICS, get_metric_stats, maturity_metrics, metrics, register_metric
+from progress_stats.compute import get_multi_stats, get_stats, get_stats_by_deck, create_first_learned_index, \
+    deck_parents_from_names, drop_first_learned_index, _get_stats_streaming, _reviews_query
+from progress_stats.sql_engine import supports_window_functions
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews
+
+
+ENGINES = ["streaming", "sql", "numpy"]
+
+PARAMS = [(1, 31), (7, 52), (31, None), (1, None)]
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(3), num_cards=100)
+    return table
+
+
+@pytest.fixture(scope="module")
+def decks_table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(5), num_cards=100, num_decks=4)
+    return table
+
+
+class TestEngines:
+
+    @pytest.mark.parametrize("engine", ENGINES)
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_same_stats(self, table, engine, bucket_size_days, num_buckets):
+        expected = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+        assert expected
+        assert get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, engine=engine) == expected
+
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_no_reviews(self, engine):
+        assert get_stats(RevlogTable(), 1, DAY_CUTOFF_SECONDS, 31, engine=engine) == {}
+
+    @pytest.mark.parametrize("engine", ["python"] + ENGINES)
+    @pytest.mark.parametrize("num_buckets,expected", [(None, [(0, 0), (1, 1)]), (2, [(-1, 0), (0, 0), (1, 1)])])
+    def test_only_reviews_after_cutoff(self, engine, num_buckets, expected):
+        "The current bucket is included even if all the reviews are after the day cutoff, the same as the baseline."
+        table = RevlogTable()
+        table.add_card(1)
+        table.add_review((DAY_CUTOFF_SECONDS + 86400) * 1000 + 1, 1, ivl=2, lastIvl=100)
+
+        stats = get_stats(table, 31, DAY_CUTOFF_SECONDS, num_buckets, engine=engine)
+        assert stats["lost_matured_card"] == expected
+        assert stats == reference.get_stats(table, 31, DAY_CUTOFF_SECONDS, num_buckets)
+
+    def test_unknown_engine(self, table):
+        with pytest.raises(ValueError):
+            get_stats(table, 1, DAY_CUTOFF_SECONDS, 31, engine="bogus")
+
+
+class TestMultiStats:
+
+    def test_same_stats(self, table):
+        del table.queries[:]
+        multi_stats = get_multi_stats(table, [1, 7, 31, (1, None)], DAY_CUTOFF_SECONDS, num_buckets=30)
+        assert len([query for query in table.queries if "bucket_index" in query]) == 1
+
+        assert multi_stats[1] == get_stats(table, 1, DAY_CUTOFF_SECONDS, 30)
+        assert multi_stats[7] == get_stats(table, 7, DAY_CUTOFF_SECONDS, 30)
+        assert multi_stats[31] == get_stats(table, 31, DAY_CUTOFF_SECONDS, 30)
+        assert multi_stats[(1, None)] == get_stats(table, 1, DAY_CUTOFF_SECONDS)
+
+    def test_views(self, table):
+        multi_stats = get_multi_stats(table, PARAMS, DAY_CUTOFF_SECONDS)
+        for bucket_size_days, num_buckets in PARAMS:
+            assert multi_stats[(bucket_size_days, num_buckets)] == \
+                get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+
+def _scaled_ivls_table(table, threshold):
+    """Returns a copy of the table with the positive intervals scaled so that they are at least 21 exactly when they
+    were at least threshold, so the stats for it are the stats for the table with that maturity threshold."""
+
+    def scale(ivl):
+        return max(1, ivl * 21 // threshold) if ivl > 0 else ivl
+
+    scaled = RevlogTable()
+    for row in table.conn.execute("SELECT * FROM revlog"):
+        scaled.conn.execute("INSERT INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            row[:4] + (scale(row[4]), scale(row[5])) + row[6:])
+    scaled.conn.executemany("INSERT INTO cards VALUES (?, ?)", table.conn.execute("SELECT * FROM cards"))
+    return scaled
+
+
+class TestMetricStats:
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_standard_metrics(self, table, bucket_size_days, num_buckets):
+        assert get_metric_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, STANDARD_METRICS, num_buckets) == \
+            get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+    @pytest.mark.parametrize("threshold", [10, 21, 30, 90])
+    def test_maturity_thresholds(self, table, threshold):
+        names = maturity_metrics(threshold)
+        assert names[0] == "matured_cards_%d" % threshold
+
+        del table.queries[:]
+        stats = get_metric_stats(table, 7, DAY_CUTOFF_SECONDS, STANDARD_METRICS + names, 52)
+        assert len([query for query in table.queries if "bucket_index" in query]) == 1
+
+        expected = get_stats(_scaled_ivls_table(table, threshold), 7, DAY_CUTOFF_SECONDS, 52)
+        for name in STANDARD_METRICS[:4]:
+            assert stats["%s_%d" % (name, threshold)] == expected[name]
+        assert stats["learned_cards"] == expected["learned_cards"]
+
+    def test_register_metric(self, table):
+        register_metric("reviews", lambda store, group, last_ivl: store.starts[group + 1] - store.starts[group])
+        try:
+            stats = get_metric_stats(table, 7, DAY_CUTOFF_SECONDS, ["reviews"])
+        finally:
+            del metrics["reviews"]
+
+        assert set(stats) == {"reviews"}
+        assert sum(value for bucket_index, value in stats["reviews"]) == \
+            table.all("SELECT count() FROM revlog WHERE id < %d" % (DAY_CUTOFF_SECONDS * 1000))[0][0]
+
+    def test_no_reviews(self):
+        assert get_metric_stats(RevlogTable(), 1, DAY_CUTOFF_SECONDS, STANDARD_METRICS, 31) == {}
+
+    def test_unknown_metric(self, table):
+        with pytest.raises(ValueError):
+            get_metric_stats(table, 1, DAY_CUTOFF_SECONDS, ["matured_cards", "bogus"], 31)
+
+
+class TestStatsByDeck:
+
+    @staticmethod
+    def _deck_filter(dids):
+        return "cid in (select id from cards where did in (%s))" % ",".join(str(did) for did in dids)
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_same_stats(self, decks_table, bucket_size_days, num_buckets):
+        del decks_table.queries[:]
+        stats_by_deck = get_stats_by_deck(decks_table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+        assert len([query for query in decks_table.queries if "bucket_index" in query]) == 1
+
+        assert sorted(stats_by_deck) == [1, 2, 3, 4]
+        for did, stats in stats_by_deck.items():
+            assert stats == get_stats(decks_table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets,
+                                      self._deck_filter([did]))
+
+    def test_roll_up(self, decks_table):
+        deck_parents = deck_parents_from_names({1: "A", 2: "A::B", 3: "A::B::C", 4: "D"})
+        assert deck_parents == {1: None, 2: 1, 3: 2, 4: None}
+
+        stats_by_deck = get_stats_by_deck(decks_table, 7, DAY_CUTOFF_SECONDS, 52, deck_parents=deck_parents)
+        for did, dids in [(1, [1, 2, 3]), (2, [2, 3]), (3, [3]), (4, [4])]:
+            assert stats_by_deck[did] == get_stats(decks_table, 7, DAY_CUTOFF_SECONDS, 52, self._deck_filter(dids))
+
+
+class TestQuery:
+
+    def test_bucket_index(self):
+        table = RevlogTable()
+        day_ms = 86400000
+        cutoff_ms = DAY_CUTOFF_SECONDS * 1000
+        for _id in [cutoff_ms - 7 * day_ms - 1, cutoff_ms - day_ms, cutoff_ms - day_ms + 1, cutoff_ms - 1,
+                    cutoff_ms, cutoff_ms + 1]:
+            table.add_review(_id, 1, ivl=1, lastIvl=1)
+
+        assert [bucket_index for _id, bucket_index in table.conn.execute(
+            "SELECT id, bucket_index FROM (%s)" % _reviews_query(1, DAY_CUTOFF_SECONDS, []).rstrip("; \n"))] == \
+            [-7, -1, 0, 0, 1, 1]
+        assert [bucket_index for _id, bucket_index in table.conn.execute(
+            "SELECT id, bucket_index FROM (%s)" % _reviews_query(7, DAY_CUTOFF_SECONDS, []).rstrip("; \n"))] == \
+            [-1, 0, 0, 0, 1, 1]
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_first_learned_index(self, table, bucket_size_days, num_buckets):
+        expected = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+        create_first_learned_index(table)
+        try:
+            assert get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets) == expected
+        finally:
+            drop_first_learned_index(table)
+
+
+class TestSqlEngine:
+
+    def test_fallback_without_window_functions(self, table):
+        class OldSqliteTable:
+            def all(self, query):
+                if " OVER " in query:
+                    raise Exception("near \"(\": syntax error")
+                return table.all(query)
+
+        assert not supports_window_functions(OldSqliteTable())
+        assert get_stats(OldSqliteTable(), 7, DAY_CUTOFF_SECONDS, 52, engine="sql") == \
+            get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+
+
+class TestNumpyEngine:
+
+    def test_fallback_without_numpy(self, table, monkeypatch):
+        monkeypatch.setattr(vectorized, "np", None)
+        assert get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, engine="numpy") == \
+            get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+
+
+class TestStreaming:
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+    def test_chunk_size(self, table, chunk_size):
+        expected = get_stats(table, 7, DAY_CUTOFF_SECONDS)
+        del table.queries[:]
+        assert _get_stats_streaming(table, 7, DAY_CUTOFF_SECONDS, chunk_size=chunk_size) == expected
+        assert all("LIMIT %d" % chunk_size in query for query in table.queries)
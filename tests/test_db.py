@@ -0,0 +1,129 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+
+import pytest
+
+from progress_stats import db
+from progress_stats.compute import get_multi_stats, get_stats, get_stats_by_deck
+from progress_stats.db import Cancelled, ReadOnlyTable, close_tables, open_table
+
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+from .helpers import Table
+from .test_background import SLOW_QUERY
+
+
+@pytest.fixture(scope="module")
+def path(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp("db").join("collection.anki2"))
+    create_collection(path, 3000).close()
+    return path
+
+
+class TestReadOnlyTable:
+
+    @pytest.mark.parametrize("immutable", [False, True])
+    def test_read_only(self, path, immutable):
+        with ReadOnlyTable(path, immutable) as table:
+            assert table.all("SELECT count() FROM revlog")[0][0] >= 3000
+            with pytest.raises(sqlite3.OperationalError):
+                table.all("DELETE FROM revlog")
+
+    def test_iterate(self, path):
+        with ReadOnlyTable(path, fetch_size=7) as table:
+            query = "SELECT id, cid FROM revlog ORDER BY id"
+            assert list(table.iterate(query)) == table.all(query)
+            assert list(table.iterate("SELECT id FROM revlog WHERE id < 0")) == []
+
+    @pytest.mark.parametrize("engine", ["python", "streaming", "sql", "numpy"])
+    def test_same_stats(self, path, engine):
+        expected_table = Table(sqlite3.connect(path))
+        with ReadOnlyTable(path, True, fetch_size=100) as table:
+            for bucket_size_days, num_buckets in [(1, 31), (31, None)]:
+                assert get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, engine=engine) == \
+                    get_stats(expected_table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+            assert get_multi_stats(table, [1, 7], DAY_CUTOFF_SECONDS, 10) == \
+                get_multi_stats(expected_table, [1, 7], DAY_CUTOFF_SECONDS, 10)
+            assert get_stats_by_deck(table, 7, DAY_CUTOFF_SECONDS, 52) == \
+                get_stats_by_deck(expected_table, 7, DAY_CUTOFF_SECONDS, 52)
+
+    def test_cancel(self, path):
+        table = ReadOnlyTable(path)
+        threading.Timer(0.1, table.cancel).start()
+        with pytest.raises(Cancelled):
+            table.all(SLOW_QUERY)
+        with pytest.raises(Cancelled):
+            table.all("SELECT 1")
+
+
+@pytest.fixture
+def tables():
+    "Closes the tables kept open by open_table after the test."
+    yield
+    close_tables()
+
+
+def _is_closed(table):
+    try:
+        table.conn.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+class TestOpenTable:
+
+    def test_reuse(self, path, tables):
+        with open_table(path) as table:
+            pass
+        with open_table(path) as reused:
+            assert reused is table
+            # A table is only reused once it is no longer in use.
+            with open_table(path) as other:
+                assert other is not table
+        with open_table(path, immutable=True) as immutable:
+            assert immutable is not table
+
+        # Only one idle table is kept for the collection.
+        assert _is_closed(other) and not _is_closed(table)
+        close_tables()
+        assert _is_closed(table) and _is_closed(immutable)
+
+    def test_evict(self, path, tmpdir, tables, monkeypatch):
+        monkeypatch.setattr(db, "max_idle_tables", 1)
+        with open_table(path) as table:
+            pass
+        other_path = str(tmpdir.join("other.anki2"))
+        create_collection(other_path, 10).close()
+        with open_table(other_path):
+            pass
+        assert _is_closed(table)
+        with open_table(path) as reopened:
+            assert reopened is not table
+
+    def test_not_reused_after_error(self, path, tables):
+        with pytest.raises(sqlite3.OperationalError):
+            with open_table(path) as table:
+                table.all("SELECT * FROM missing")
+        assert _is_closed(table)
+
+        with open_table(path) as cancelled:
+            cancelled.cancel()
+        assert _is_closed(cancelled)
+        with open_table(path) as table:
+            assert table is not cancelled
+            assert table.all("SELECT 1") == [(1,)]
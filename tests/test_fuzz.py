@@ -0,0 +1,94 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from benchmarks import fuzz
+from benchmarks.fuzz import ENGINES, check, create_table, generate_history, shrink
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS
+from progress_stats.compute import get_stats
+from progress_stats.rollup import StatsRollup
+
+
+class TestGenerateHistory:
+
+    def test_deterministic(self):
+        assert generate_history(random.Random(1)) == generate_history(random.Random(1))
+        assert generate_history(random.Random(1)) != generate_history(random.Random(2))
+
+    def test_unique_ids(self):
+        for seed in range(20):
+            ids = [review[0] for cid, did, reviews in generate_history(random.Random(seed)) for review in reviews]
+            assert len(ids) == len(set(ids))
+
+    def test_adversarial(self):
+        reviews = [review for seed in range(20) for cid, did, reviews in generate_history(random.Random(seed))
+                   for review in reviews]
+        ids = [review[0] for review in reviews]
+
+        day_cutoff_ms = DAY_CUTOFF_SECONDS * 1000
+        assert day_cutoff_ms in ids
+        assert day_cutoff_ms - 31 * 86400000 in ids
+        assert any(_id > day_cutoff_ms for _id in ids)
+        assert {review[-1] for review in reviews} == {0, 1, 2, 3}
+        # Reviews whose lastIvl isn't the previous ivl, including 0.
+        assert any(review[3] == 0 for review in reviews)
+
+
+class TestCheck:
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_engines_match_reference(self, seed):
+        timings = {}
+        assert check(create_table(generate_history(random.Random(seed))), timings=timings) == []
+        assert set(timings) == set(ENGINES)
+        assert all(seconds > 0 and reference_seconds > 0 for seconds, reference_seconds in timings.values())
+
+    def test_shrink(self, monkeypatch):
+        def broken(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter):
+            # Counts one more matured review whenever a card was reviewed with an interval of exactly 21 days.
+            stats = get_stats(db_table, bucket_size_days, day_cutoff_seconds, num_buckets, additional_filter)
+            if db_table.all("SELECT count() FROM revlog WHERE ivl = 21")[0][0] and stats:
+                bucket_index, value = stats["matured_reviews"][-1]
+                stats["matured_reviews"][-1] = (bucket_index, value + 1)
+            return stats
+
+        monkeypatch.setitem(ENGINES, "broken", broken)
+
+        seed = next(seed for seed in range(100) if check(create_table(generate_history(random.Random(seed))),
+                                                         ["broken"], [(7, 52)], [None]))
+        history = generate_history(random.Random(seed))
+        shrunk = shrink(history, "broken", 7, 52, None)
+
+        assert len(shrunk) == 1
+        assert [review[2] for review in shrunk[0][2]] == [21]
+        assert check(create_table(shrunk), ["broken"], [(7, 52)], [None]) == [("broken", 7, 52, None)]
+
+    def test_rollup_replay(self, monkeypatch):
+        "The undos and syncs replayed through the rollup catch a rollup that misses reviews diverging."
+        rebuild = StatsRollup.rebuild
+
+        def rebuild_once(rollup, db_table, day_cutoff_seconds):
+            if rollup._state() is None:
+                rebuild(rollup, db_table, day_cutoff_seconds)
+
+        monkeypatch.setattr(StatsRollup, "rebuild", rebuild_once)
+        tables = [create_table(generate_history(random.Random(seed))) for seed in range(10)]
+        assert not any(check(table, ["rollup"]) for table in tables)
+        assert any(check(table, ["rollup_replay"]) for table in tables)
+
+    def test_fuzz(self):
+        assert fuzz.fuzz(range(3)) == []
@@ -0,0 +1,399 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import re
+import sqlite3
+import sys
+import threading
+import types
+from unittest import mock
+
+import pytest
+
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+from .helpers import Table
+
+
+class DBProxy:
+    """Stands in for the col.db of Anki 2.1.28 and later, which can be used from any thread.  With fail_in_worker
+    set, queries from other threads fail as they would for a connection tied to the main thread."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fail_in_worker = False
+
+    def all(self, query):
+        if self.fail_in_worker and threading.current_thread() is not threading.main_thread():
+            raise sqlite3.ProgrammingError("SQLite objects created in a thread can only be used in that same thread")
+        return self.conn.execute(query).fetchall()
+
+
+@pytest.fixture(scope="module")
+def graphs():
+    "The graphs module, imported with stand-ins for the parts of Anki it uses."
+    lang = types.ModuleType("anki.lang")
+    lang._ = lambda s: s
+    dbproxy = types.ModuleType("anki.dbproxy")
+    dbproxy.DBProxy = DBProxy
+    anki = types.ModuleType("anki")
+    anki.lang = lang
+    anki.dbproxy = dbproxy
+    with mock.patch.dict(sys.modules, {"anki": anki, "anki.lang": lang, "anki.dbproxy": dbproxy}):
+        from progress_stats import graphs
+        yield graphs
+
+
+@pytest.fixture(scope="module")
+def path(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp("graphs").join("collection.anki2"))
+    create_collection(path, 3000).close()
+    return path
+
+
+class Web:
+
+    def __init__(self):
+        self.scripts = []
+
+    def eval(self, script):
+        self.scripts.append(script)
+
+
+class MainWindow:
+    """Stands in for aqt.mw with the add-on's config.  Callbacks for the main thread are queued in main_callbacks
+    until run_main() runs them."""
+
+    def __init__(self, config):
+        self.config = config
+        self.main_callbacks = []
+        self.taskman = types.SimpleNamespace(run_on_main=self.main_callbacks.append)
+        self.addonManager = types.SimpleNamespace(getConfig=lambda name: self.config)
+
+    def run_main(self):
+        while self.main_callbacks:
+            self.main_callbacks.pop(0)()
+
+
+@pytest.fixture
+def mw(graphs, monkeypatch):
+    "A main window with the stats dialog open, and the graphs module's caches emptied."
+    mw = MainWindow({"background": True})
+    web = Web()
+    dialog = types.SimpleNamespace(form=types.SimpleNamespace(web=web))
+    aqt = types.ModuleType("aqt")
+    aqt.mw = mw
+    aqt.dialogs = types.SimpleNamespace(_dialogs={"DeckStats": [None, dialog]})
+    monkeypatch.setitem(sys.modules, "aqt", aqt)
+    mw.web = web
+    mw.dialogs = aqt.dialogs._dialogs
+
+    monkeypatch.setattr(graphs, "_html_cache", OrderedDict())
+    monkeypatch.setattr(graphs, "_stats_cache", {})
+    monkeypatch.setattr(graphs, "_checkpoints", {})
+    monkeypatch.setattr(graphs, "_job", None)
+    yield mw
+    if graphs._job:
+        graphs._job.cancel()
+        graphs._job.thread.join(30)
+
+
+class Collection:
+
+    def __init__(self, path, day_cutoff_seconds=DAY_CUTOFF_SECONDS):
+        self.path = path
+        self.db = DBProxy(sqlite3.connect(path, check_same_thread=False))
+        self.sched = types.SimpleNamespace(dayCutoff=day_cutoff_seconds)
+
+    def save(self):
+        pass
+
+
+class StatsPage:
+    """Stands in for anki.stats.CollectionStats, recording the data of each graph in graphs."""
+
+    def __init__(self, col, period=1, revlog_limit=""):
+        self.col = col
+        self.period = period
+        self.revlog_limit = revlog_limit
+        self.graphs = []
+
+    def get_start_end_chunk(self):
+        return {0: (0, 31, 1), 1: (0, 52, 7), 2: (0, None, 31)}[self.period]
+
+    def _revlogLimit(self):
+        return self.revlog_limit
+
+    def _title(self, title, subtitle=""):
+        return "<h1>%s</h1>" % title
+
+    def _graph(self, id, data, conf, xunit=None):
+        self.graphs.append(data)
+        return "<div id='%s'></div>" % id
+
+    def _line(self, lines, label, text):
+        lines.append((label, text))
+
+    def _lineTbl(self, lines):
+        return "<table>%s</table>" % "".join("<tr><td>%s</td><td>%s</td></tr>" % line for line in lines)
+
+
+def _without_ids(html):
+    "Removes the ids of the graphs, which are numbered in the order they are drawn."
+    return re.sub(r"progress-\d+", "", html)
+
+
+def show(graphs, page):
+    return graphs.progressGraphs(page, _old=lambda page: "<old>")
+
+
+def finish_job(graphs, mw):
+    "Waits for the job computing the stats in the background and runs what it queued for the main thread."
+    job = graphs._job
+    job.thread.join(30)
+    assert not job.thread.is_alive()
+    mw.run_main()
+
+
+class TestProgressGraphs:
+
+    def test_main_thread(self, graphs, mw, path):
+        mw.config = {"background": False}
+        page = StatsPage(Collection(path))
+
+        html = show(graphs, page)
+
+        assert html.startswith("<old>")
+        assert "Net Matured Cards" in html
+        assert page.graphs and graphs._job is None
+        assert len(graphs._html_cache) == 1
+
+    def test_background(self, graphs, mw, path):
+        page = StatsPage(Collection(path))
+
+        html = show(graphs, page)
+
+        assert html.startswith("<old>")
+        assert "Computing progress graphs..." in html
+        assert "Net Matured Cards" not in html
+        placeholder_id = html.split("<div id='")[1].split("'")[0]
+
+        finish_job(graphs, mw)
+
+        assert len(mw.web.scripts) == 1
+        assert mw.web.scripts[0].startswith("$('#%s').html(" % placeholder_id)
+        assert "Net Matured Cards" in mw.web.scripts[0]
+        assert graphs._job is None
+
+        # The same graphs are then shown from the cache, and match those computed on the main thread.
+        cached_html = show(graphs, page)
+        assert "Net Matured Cards" in cached_html
+        mw.config = {"background": False}
+        graphs._html_cache.clear()
+        assert _without_ids(show(graphs, StatsPage(Collection(path)))) == _without_ids(cached_html)
+
+    @pytest.mark.parametrize("background", [True, False])
+    def test_max_points(self, graphs, mw, path, background):
+        mw.config = {"background": background, "max_points": 5}
+        page = StatsPage(Collection(path), period=2)
+
+        show(graphs, page)
+        if background:
+            finish_job(graphs, mw)
+
+        assert page.graphs
+        for graph_data in page.graphs:
+            assert all(len(series["data"]) <= 5 for series in graph_data)
+
+
+@pytest.fixture
+def computed(graphs, monkeypatch):
+    "Records the arguments of each call to _get_stats, which computes the stats for graphs that aren't cached."
+    calls = []
+    get_stats = graphs._get_stats
+
+    def recorded_get_stats(*args, **kwargs):
+        calls.append(args)
+        return get_stats(*args, **kwargs)
+
+    monkeypatch.setattr(graphs, "_get_stats", recorded_get_stats)
+    return calls
+
+
+class TestHtmlCache:
+
+    @pytest.fixture
+    def col(self, path, tmpdir):
+        "A copy of the collection that reviews can be added to."
+        copy = str(tmpdir.join("collection.anki2"))
+        with open(path, "rb") as f, open(copy, "wb") as out:
+            out.write(f.read())
+        return Collection(copy)
+
+    def test_hit(self, graphs, mw, col, computed):
+        mw.config = {"background": False}
+        html = show(graphs, StatsPage(col))
+        assert len(computed) == 1
+
+        page = StatsPage(col)
+        assert show(graphs, page) == html
+        assert len(computed) == 1
+        assert page.graphs == []
+
+    @pytest.mark.parametrize("change", ["fingerprint", "day_cutoff", "filter", "max_points"])
+    def test_miss(self, graphs, mw, col, computed, change):
+        mw.config = {"background": False}
+        first_html = show(graphs, StatsPage(col))[len("<old>"):]
+
+        page = StatsPage(col)
+        if change == "fingerprint":
+            col.db.conn.execute("INSERT INTO revlog SELECT id + 1, cid, usn, ease, ivl, lastIvl, factor, time, type "
+                                "FROM revlog WHERE id = (SELECT max(id) FROM revlog)")
+        elif change == "day_cutoff":
+            col.sched.dayCutoff += 86400
+        elif change == "filter":
+            page.revlog_limit = "cid % 2 = 0"
+        else:
+            mw.config["max_points"] = 5
+
+        show(graphs, page)
+        assert page.graphs
+        assert len(graphs._html_cache) == 2
+        # The HTML for the graphs before the change is still cached.
+        assert first_html in graphs._html_cache.values()
+        assert len(computed) == 2
+
+    def test_eviction(self, graphs, mw, col, monkeypatch):
+        mw.config = {"background": False}
+        pages = [StatsPage(col, period) for period in range(3)]
+        html = [show(graphs, page)[len("<old>"):] for page in pages]
+
+        # Keep at most the HTML for two periods, and show the first period again so it is the most recently used.
+        monkeypatch.setattr(graphs, "max_html_cache_size", len(html[0]) + len(html[1]) + len(html[2]) - 1)
+        graphs._html_cache.clear()
+        show(graphs, pages[0])
+        show(graphs, pages[1])
+        show(graphs, pages[0])
+        show(graphs, pages[2])
+
+        cached = list(graphs._html_cache.values())
+        assert len(cached) == 2
+        assert sum(len(cached_html) for cached_html in cached) <= graphs.max_html_cache_size
+        assert _without_ids(cached[0]) == _without_ids(html[0])
+        assert _without_ids(cached[1]) == _without_ids(html[2])
+
+    def test_larger_than_cache(self, graphs, mw, col, monkeypatch):
+        "The most recent graphs are kept even if they don't fit, so that showing them again is still instant."
+        mw.config = {"background": False}
+        monkeypatch.setattr(graphs, "max_html_cache_size", 10)
+        show(graphs, StatsPage(col, 0))
+        show(graphs, StatsPage(col, 1))
+        assert len(graphs._html_cache) == 1
+
+
+def _placeholder_id(html):
+    return html.split("<div id='")[1].split("'")[0]
+
+
+class TestBackground:
+
+    def test_cancel(self, graphs, mw, path):
+        col = Collection(path)
+        show(graphs, StatsPage(col, 2))
+        first_job = graphs._job
+
+        # Showing another period cancels the job for the first, whose graphs are then never shown.
+        placeholder_id = _placeholder_id(show(graphs, StatsPage(col, 1)))
+        assert first_job.cancelled.is_set()
+        first_job.thread.join(30)
+        finish_job(graphs, mw)
+
+        assert len(mw.web.scripts) == 1
+        assert mw.web.scripts[0].startswith("$('#%s').html(" % placeholder_id)
+        assert len(graphs._html_cache) == 1
+
+    def test_preview(self, graphs, mw, path):
+        "The graphs estimated from a sample of the cards are computed in the worker, and shown until the exact ones."
+        mw.config = {"background": True, "sample_rate": 4}
+        html = show(graphs, StatsPage(Collection(path), 2))
+        assert "Computing progress graphs..." in html
+        assert "Net Matured Cards" not in html
+        placeholder_id = _placeholder_id(html)
+
+        finish_job(graphs, mw)
+
+        assert len(mw.web.scripts) == 2
+        assert all(script.startswith("$('#%s').html(" % placeholder_id) for script in mw.web.scripts)
+        assert "~ Learned Cards" in mw.web.scripts[0]
+        assert "Computing exact progress graphs..." in mw.web.scripts[0]
+        assert "~ " not in mw.web.scripts[1] and "Net Matured Cards" in mw.web.scripts[1]
+
+    def test_fall_back(self, graphs, mw, path, capsys):
+        col = Collection(path)
+        col.db.fail_in_worker = True
+
+        placeholder_id = _placeholder_id(show(graphs, StatsPage(col)))
+        finish_job(graphs, mw)
+
+        # The stats are computed on the main thread instead, and the error is reported.
+        assert len(mw.web.scripts) == 1
+        assert mw.web.scripts[0].startswith("$('#%s').html(" % placeholder_id)
+        assert "Net Matured Cards" in mw.web.scripts[0]
+        assert "ProgrammingError" in capsys.readouterr().err
+
+    def test_fall_back_after_cancel(self, graphs, mw, path, computed, capsys):
+        "The stats aren't computed on the main thread if other graphs were shown after the worker failed."
+        col = Collection(path)
+        col.db.fail_in_worker = True
+
+        show(graphs, StatsPage(col))
+        graphs._job.thread.join(30)
+        graphs._job.cancel()
+        mw.run_main()
+
+        assert mw.web.scripts == []
+        assert len(computed) == 1
+        assert "ProgrammingError" in capsys.readouterr().err
+
+    def test_lock_not_held_while_computing(self, graphs, mw, path, monkeypatch):
+        "Computing the stats only holds the lock of the sidecar it uses, so the caches can be used meanwhile."
+        locked = []
+
+        class RecordingCheckpoint(graphs.StatsCheckpoint):
+            def get_multi_stats(self, *args, **kwargs):
+                locked.append(graphs._lock.locked())
+                return super().get_multi_stats(*args, **kwargs)
+
+        monkeypatch.setattr(graphs, "StatsCheckpoint", RecordingCheckpoint)
+        mw.config = {"background": False}
+        assert "Net Matured Cards" in show(graphs, StatsPage(Collection(path)))
+        assert locked == [False]
+
+    def test_main_thread_db(self, graphs, mw, path):
+        "Before Anki 2.1.28 col.db can only be used on the main thread, so the graphs are computed right away."
+        col = Collection(path)
+        col.db = Table(col.db.conn)
+
+        html = show(graphs, StatsPage(col))
+        assert "Net Matured Cards" in html
+        assert graphs._job is None
+
+    def test_dialog_closed(self, graphs, mw, path):
+        "Anki keeps the entry for the stats dialog when it is closed, with no instance."
+        mw.dialogs["DeckStats"][1] = None
+
+        html = show(graphs, StatsPage(Collection(path)))
+        assert "Net Matured Cards" in html
+        assert graphs._job is None
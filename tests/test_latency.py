@@ -0,0 +1,103 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from progress_stats.compute import STANDARD_METRICS, get_metric_stats
+from progress_stats.latency import BIN_EDGES, LatencyHistogram, quantile_series, total_histogram
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(4), num_cards=100)
+    return table
+
+
+class TestLatencyHistogram:
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+        assert len(histogram) == 0
+        assert histogram.quantile(0.5) is None
+
+    def test_quantile_within_bin(self):
+        rng = random.Random(1)
+        latencies = [rng.uniform(0, 400) for i in range(2000)]
+        histogram = LatencyHistogram()
+        histogram += latencies
+
+        assert len(histogram) == 2000
+        latencies.sort()
+        for q in [0.1, 0.5, 0.9]:
+            exact = latencies[int(q * len(latencies))]
+            assert abs(histogram.quantile(q) - exact) <= 0.2 * exact + 1
+
+    def test_last_bin(self):
+        histogram = LatencyHistogram()
+        histogram += [1000, 2000]
+        assert histogram.quantile(0.5) == BIN_EDGES[-1]
+
+    def test_merge(self):
+        a = LatencyHistogram()
+        a += [1, 5, 30]
+        b = LatencyHistogram()
+        b += [5, 800]
+
+        merged = a.merge(b)
+        expected = LatencyHistogram()
+        expected += [1, 5, 30, 5, 800]
+        assert merged == expected
+        assert len(a) == 3 and len(b) == 2
+
+    def test_series(self):
+        a = LatencyHistogram()
+        a += [3]
+        histograms = [(-2, a), (-1, LatencyHistogram()), (0, a.merge(a))]
+
+        assert quantile_series(histograms, 0.5) == [(-2, a.quantile(0.5)), (0, a.quantile(0.5))]
+        assert len(total_histogram(histograms)) == 3
+
+
+class TestLearnedToMatureDays:
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", [(7, 52), (31, None)])
+    def test_same_pass(self, table, bucket_size_days, num_buckets):
+        del table.queries[:]
+        stats = get_metric_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS,
+                                 STANDARD_METRICS + ["learned_to_mature_days"], num_buckets)
+        assert len([query for query in table.queries if "bucket_index" in query]) == 1
+
+        histograms = stats["learned_to_mature_days"]
+        assert [bucket_index for bucket_index, histogram in histograms] == \
+            [bucket_index for bucket_index, value in stats["matured_reviews"]]
+        for (bucket_index, histogram), (_, matured_reviews) in zip(histograms, stats["matured_reviews"]):
+            assert len(histogram) <= matured_reviews
+
+    def test_latencies(self, table):
+        stats = get_metric_stats(table, 1, DAY_CUTOFF_SECONDS, ["learned_to_mature_days"])
+
+        expected = LatencyHistogram()
+        expected += [(matured_id - learned_id) / 86400000.0 for matured_id, learned_id in table.all("""\
+            SELECT rl.id, learned.id FROM revlog rl
+            JOIN (SELECT cid, min(id) AS id FROM revlog WHERE ivl > 0 AND lastIvl < 0 GROUP BY cid) learned
+              ON learned.cid = rl.cid
+            WHERE rl.lastIvl < 21 AND rl.ivl >= 21 AND rl.id >= learned.id""")]
+
+        assert len(expected) > 0
+        assert total_histogram(stats["learned_to_mature_days"]) == expected
@@ -0,0 +1,116 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import json
+import math
+import random
+
+import pytest
+
+from progress_stats.compute import get_stats
+from progress_stats.partial import PartialStats, get_partial_stats, iter_deck_life_stats
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews
+
+
+PARAMS = [(1, 31), (7, 52), (31, None), (0.5, 40)]
+
+DECK_FILTER = "cid in (select id from cards where did = 1)"
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(1), num_cards=80, num_days=300, num_decks=2)
+    return table
+
+
+def _time_ranges(table, rng, num_ranges):
+    "Returns the PartialStats arguments (start_id, end_id) for ranges of the reviews split at random reviews."
+    ids = [_id for (_id,) in table.conn.execute("SELECT id FROM revlog ORDER BY id")]
+    bounds = [None] + sorted(rng.sample(ids, num_ranges - 1)) + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+class TestPartialStats:
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    @pytest.mark.parametrize("additional_filter", [None, DECK_FILTER])
+    def test_time_ranges(self, table, bucket_size_days, num_buckets, additional_filter):
+        partials = [get_partial_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, additional_filter,
+                                      start_id, end_id)
+                    for start_id, end_id in _time_ranges(table, random.Random(2), 6)]
+
+        assert functools.reduce(PartialStats.merge, partials).stats_by_name(num_buckets) == \
+            get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, additional_filter)
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_card_shards(self, table, bucket_size_days, num_buckets):
+        partials = [get_partial_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, "rl.cid %% 3 = %d" % i)
+                    for i in range(3)]
+
+        expected = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+        assert functools.reduce(PartialStats.merge, partials).stats_by_name(num_buckets) == expected
+        assert functools.reduce(PartialStats.merge, reversed(partials)).stats_by_name(num_buckets) == expected
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_associative(self, table, seed):
+        rng = random.Random(seed)
+        bucket_size_days, num_buckets = rng.choice(PARAMS)
+        a, b, c = [get_partial_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, None, start_id, end_id)
+                   for start_id, end_id in _time_ranges(table, rng, 3)]
+
+        assert a.merge(b).merge(c) == a.merge(b.merge(c))
+        assert a.merge(PartialStats()) == a == PartialStats().merge(a)
+
+    def test_merge_leaves_inputs_unchanged(self, table):
+        a, b = [get_partial_stats(table, 1, DAY_CUTOFF_SECONDS, 31, None, start_id, end_id)
+                for start_id, end_id in _time_ranges(table, random.Random(3), 2)]
+        a_dict, b_dict = a.to_dict(), b.to_dict()
+        a.merge(b)
+        assert a.to_dict() == a_dict and b.to_dict() == b_dict
+
+    def test_to_dict(self, table):
+        partial = get_partial_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        assert PartialStats.from_dict(json.loads(json.dumps(partial.to_dict()))) == partial
+
+    def test_empty(self):
+        assert get_partial_stats(RevlogTable(), 1, DAY_CUTOFF_SECONDS, 31).stats_by_name(31) == {}
+
+
+class TestIterDeckLifeStats:
+
+    @pytest.mark.parametrize("bucket_size_days", [1, 7, 31])
+    @pytest.mark.parametrize("additional_filter", [None, DECK_FILTER])
+    def test_ends_with_all_reviews(self, table, bucket_size_days, additional_filter):
+        all_stats = list(iter_deck_life_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, additional_filter, 4))
+
+        assert all_stats[-1] == get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, None, additional_filter)
+
+        # The number of buckets doubles each time.
+        first_bucket_indexes = [stats["learned_cards"][0][0] for stats in all_stats]
+        assert first_bucket_indexes[0] >= -3
+        assert first_bucket_indexes == sorted(first_bucket_indexes, reverse=True)
+        assert len(all_stats) <= 3 + int(math.log2(300 / bucket_size_days))
+
+    def test_recent_buckets_first(self, table):
+        first_stats = next(iter_deck_life_stats(table, 7, DAY_CUTOFF_SECONDS, num_recent_buckets=10))
+        expected = get_stats(table, 7, DAY_CUTOFF_SECONDS)
+
+        # The matured reviews only depend on the review itself, so they are right for the buckets read so far.
+        assert first_stats["matured_reviews"] == expected["matured_reviews"][-10:]
+
+    def test_empty(self):
+        assert list(iter_deck_life_stats(RevlogTable(), 31, DAY_CUTOFF_SECONDS)) == [{}]
@@ -0,0 +1,87 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from progress_stats.checkpoint import StatsCheckpoint
+from progress_stats.compute import get_multi_stats, get_stats
+from progress_stats.profile import NO_PROFILE, StatsProfile
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(2), num_cards=40)
+    return table
+
+
+class TestStatsProfile:
+
+    def test_python_engine(self, table):
+        profile = StatsProfile()
+        stats = get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, profile=profile)
+
+        assert stats == get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        assert [phase.name for phase in profile.phases] == ["query", "bucketing", "aggregate"]
+        query, bucketing, aggregate = profile.phases
+        assert query.rows == bucketing.rows == len(table.all("SELECT * FROM revlog WHERE id >= %d" % (
+            (DAY_CUTOFF_SECONDS - 7 * 52 * 86400) * 1000)))
+        assert aggregate.buckets == 52
+        assert all(phase.seconds >= 0 and phase.peak_bytes is None for phase in profile.phases)
+
+    @pytest.mark.parametrize("engine", ["streaming", "sql", "numpy"])
+    def test_other_engines(self, table, engine):
+        profile = StatsProfile()
+        get_stats(table, 1, DAY_CUTOFF_SECONDS, 31, engine=engine, profile=profile)
+
+        # The sql and numpy engines fall back to the python engine if they can't be used.
+        assert [phase.name for phase in profile.phases] in ([engine], ["query", "bucketing", "aggregate"])
+        assert profile.phases[-1].buckets == 31
+
+    def test_multi_stats(self, table):
+        for compute in [get_multi_stats, StatsCheckpoint().get_multi_stats]:
+            profile = StatsProfile()
+            compute(table, [(1, 31), (7, 52)], DAY_CUTOFF_SECONDS, profile=profile)
+
+            phases = dict((phase.name, phase) for phase in profile.phases)
+            assert phases["query"].rows > 0
+            assert phases["aggregate"].buckets == 31 + 52
+
+    def test_callback_and_memory(self, table):
+        phases = []
+        profile = StatsProfile(callback=phases.append, trace_memory=True)
+        get_stats(table, 31, DAY_CUTOFF_SECONDS, profile=profile)
+
+        assert phases == profile.phases
+        assert all(phase.peak_bytes > 0 for phase in phases)
+
+        summary = profile.summary()
+        assert summary.startswith("query ")
+        assert "buckets" in summary and "MB" in summary and "total" in summary
+
+    def test_failed_phase_not_recorded(self):
+        profile = StatsProfile()
+        with pytest.raises(ZeroDivisionError):
+            with profile.phase("broken"):
+                1 / 0
+        assert profile.phases == []
+
+    def test_no_profile(self):
+        with NO_PROFILE.phase("query") as phase:
+            phase.rows = 10
+        assert not hasattr(phase, "rows")
@@ -0,0 +1,106 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from progress_stats.review_store import ReviewStore
+
+
+# (id, bucket_index, cid, ease, ivl, lastIvl, type) in ascending id order, with the reviews of cards 20 and 10
+# interleaved within bucket -1.
+ROWS = [
+    (100, -1, 20, 3, -600, -60, 0),
+    (101, -1, 10, 3, 1, -600, 0),
+    (102, -1, 20, 3, 1, -600, 0),
+    (103, -1, 10, 1, -600, 1, 2),
+    (200, 0, 10, 3, 1, -600, 2),
+    (201, 0, 30, 4, 25, 10, 1),
+]
+
+
+def _groups(store):
+    "Returns (bucket_index, cid, ids of the reviews) for each group."
+    return [(store.bucket_indexes[g], store.cids[g], list(store.ids[store.starts[g]:store.starts[g + 1]]))
+            for g in range(len(store))]
+
+
+class TestReviewStore:
+
+    def test_groups(self):
+        store = ReviewStore()
+        store.add_rows(ROWS)
+
+        # The groups are in bucket order, and within a bucket in the order of each card's first review.
+        assert _groups(store) == [(-1, 20, [100, 102]), (-1, 10, [101, 103]), (0, 10, [200]), (0, 30, [201])]
+        assert list(store.starts) == [0, 2, 4, 5, 6]
+        assert len(store) == 4
+        assert store.num_reviews() == 6
+
+    def test_columns(self):
+        store = ReviewStore()
+        store.add_rows(ROWS)
+
+        rows_by_id = dict((row[0], row) for row in ROWS)
+        for i, _id in enumerate(store.ids):
+            _, bucket_index, cid, ease, ivl, lastIvl, _type = rows_by_id[_id]
+            assert (store.eases[i], store.ivls[i], store.last_ivls[i], store.types[i]) == (ease, ivl, lastIvl, _type)
+
+    def test_first_learned(self):
+        store = ReviewStore()
+        store.add_rows(ROWS)
+
+        # Card 10 is relearned in bucket 0, which isn't when it was first learned.  Card 30 was never learned.
+        assert store.first_learned == {10: 101, 20: 102}
+
+    def test_first_learned_given(self):
+        "Cards learned before the reviews in the store keep the id they were first learned at."
+        first_learned = {10: 50}
+        store = ReviewStore(first_learned)
+        store.add_rows(ROWS)
+
+        assert store.first_learned is first_learned
+        assert first_learned == {10: 50, 20: 102}
+
+    def test_add_rows_again(self):
+        "Later buckets can be added after the earlier ones, e.g. as the reviews are streamed."
+        store = ReviewStore()
+        store.add_rows(ROWS[:4])
+        store.add_rows(ROWS[4:])
+
+        expected = ReviewStore()
+        expected.add_rows(ROWS)
+        assert _groups(store) == _groups(expected)
+        assert list(store.starts) == list(expected.starts)
+
+    def test_clear(self):
+        store = ReviewStore()
+        store.add_rows(ROWS[:4])
+        store.clear()
+
+        assert len(store) == 0
+        assert store.num_reviews() == 0
+        assert list(store.starts) == [0]
+        columns = [store.ids, store.eases, store.ivls, store.last_ivls, store.types, store.bucket_indexes, store.cids]
+        assert all(len(column) == 0 for column in columns)
+        # The cards learned so far are kept, so that relearning them later isn't counted.
+        assert store.first_learned == {10: 101, 20: 102}
+
+        store.add_rows(ROWS[4:])
+        assert _groups(store) == [(0, 10, [200]), (0, 30, [201])]
+        assert list(store.starts) == [0, 1, 2]
+        assert store.first_learned == {10: 101, 20: 102}
+
+    def test_empty(self):
+        store = ReviewStore()
+        store.add_rows([])
+        assert len(store) == 0
+        assert list(store.starts) == [0]
@@ -0,0 +1,185 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from progress_stats.compute import get_stats
+from progress_stats.rollup import StatsRollup
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews, full_scans
+
+
+PARAMS = [(1, 31), (7, 52), (30, 12), (31, None)]
+
+
+@pytest.fixture
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(1), num_cards=80, num_decks=3)
+    return table
+
+
+def _fetches(table):
+    "Returns the queries that fetched reviews to add to the rollup."
+    return [query for query in table.queries if query.startswith("SELECT id, cid, ivl, lastIvl FROM revlog")]
+
+
+class TestStatsRollup:
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_matches_get_stats(self, table, bucket_size_days, num_buckets):
+        rollup = StatsRollup()
+        for additional_filter in [None, "cid in (select id from cards where did in (1, 3))"]:
+            assert rollup.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, additional_filter) == \
+                get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, additional_filter)
+
+    def test_add_latest(self, table):
+        rollup = StatsRollup()
+        rollup.rebuild(table, DAY_CUTOFF_SECONDS)
+
+        rng = random.Random(2)
+        cids = [cid for (cid,) in table.conn.execute("SELECT DISTINCT cid FROM revlog ORDER BY cid")]
+        _id = table.conn.execute("SELECT max(id) FROM revlog").fetchone()[0]
+        for _ in range(30):
+            _id += rng.randrange(1000, 3600000)
+            cid = rng.choice(cids)
+            table.add_review(_id, cid, ivl=rng.choice([-600, 5, 30]), lastIvl=rng.choice([-600, 5, 30]))
+            rollup.add_latest(table, cid)
+
+        # The answers were all added, so showing the stats only checks that the rollup is up to date, which doesn't
+        # read all of revlog.
+        for bucket_size_days, num_buckets in PARAMS:
+            del table.queries[:]
+            stats = rollup.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+            assert full_scans(table) == [] and _fetches(table) == []
+            assert stats == get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+
+    def test_new_reviews_added(self, table):
+        rollup = StatsRollup()
+        rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        day_cutoff_seconds = DAY_CUTOFF_SECONDS + 86400 * 2
+        add_random_reviews(table, random.Random(3), num_cards=5, num_days=1, end_seconds=day_cutoff_seconds)
+
+        del table.queries[:]
+        stats = rollup.get_stats(table, 7, day_cutoff_seconds, 52)
+        fetches = _fetches(table)
+        assert len(fetches) == 1 and "WHERE id > " in fetches[0]
+        assert full_scans(table) == []
+        assert stats == get_stats(table, 7, day_cutoff_seconds, 52)
+
+    @pytest.mark.parametrize("change", ["undo", "sync", "undo_and_sync"])
+    def test_rebuilt_after_divergence(self, table, change):
+        rollup = StatsRollup()
+        rollup.rebuild(table, DAY_CUTOFF_SECONDS)
+        max_id = table.conn.execute("SELECT max(id) FROM revlog").fetchone()[0]
+        table.add_card(12345)
+
+        if change == "undo":
+            table.conn.execute("DELETE FROM revlog WHERE id IN (SELECT id FROM revlog ORDER BY id DESC LIMIT 3)")
+        elif change == "sync":
+            # The sync brings in the card maturing 9 weeks ago, and sets the usn of the reviews made here.
+            table.add_review((DAY_CUTOFF_SECONDS - 86400 * 60) * 1000 + 1, 12345, ivl=30, lastIvl=5, usn=1)
+            table.conn.execute("UPDATE revlog SET usn = 1 WHERE usn = -1")
+        else:
+            # A card matures today and the answer is undone, then a sync brings in the card maturing a day earlier,
+            # which leaves as many reviews from yesterday on as the rollup has.
+            table.add_review(max_id + 1000, 12345, ivl=30, lastIvl=5)
+            rollup.add_latest(table, 12345)
+            table.conn.execute("DELETE FROM revlog WHERE id = %d" % (max_id + 1000))
+            table.add_review(max_id - 86400000, 12345, ivl=30, lastIvl=5, usn=1)
+
+        del table.queries[:]
+        stats = rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        assert "SELECT id, cid, ivl, lastIvl FROM revlog ORDER BY id" in table.queries
+        assert stats == get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+
+    def test_check(self, table):
+        "A review rewritten by a tool isn't noticed when the stats are shown, but check notices it."
+        rollup = StatsRollup()
+        rollup.rebuild(table, DAY_CUTOFF_SECONDS)
+        assert rollup.check(table)
+
+        table.conn.execute("""UPDATE revlog SET ivl = 30 WHERE id = (
+                                SELECT max(id) FROM revlog WHERE ivl > 0 AND ivl < 21 AND lastIvl < 21)""")
+        rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        assert not rollup.check(table)
+
+        rollup.rebuild(table, DAY_CUTOFF_SECONDS)
+        assert rollup.check(table)
+        assert rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52) == get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", PARAMS)
+    def test_day_end_reviews(self, bucket_size_days, num_buckets):
+        """Reviews exactly at the day cutoff, at the start of the graphed period and at the end of days after the
+        day cutoff are in the same buckets as get_stats puts them in, whether the rollup is rebuilt or the reviews
+        are answered one at a time."""
+        day_cutoff_ms = DAY_CUTOFF_SECONDS * 1000
+        days = set([60, 31, 12, 7, 1, 0, -1, -2])
+        if num_buckets:
+            days.add(bucket_size_days * num_buckets)
+        ids = sorted(day_cutoff_ms - 86400000 * day for day in days)
+
+        table = RevlogTable()
+        rollup = StatsRollup()
+        rollup.rebuild(table, DAY_CUTOFF_SECONDS)
+        ivls = [(-600, 0), (5, -600), (25, 5), (-600, 25), (30, -600)]
+        for cid in [1, 2]:
+            table.add_card(cid)
+        for i, _id in enumerate(ids):
+            cid = 1 + i % 2
+            ivl, lastIvl = ivls[i // 2 % len(ivls)]
+            table.add_review(_id, cid, ivl, lastIvl)
+            rollup.add_latest(table, cid)
+
+        expected = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets)
+        assert rollup.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets) == expected
+        rollup.rebuild(table, DAY_CUTOFF_SECONDS)
+        assert rollup.get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets) == expected
+
+    def test_old_schema(self, table, tmpdir):
+        "A rollup saved before the fingerprint was kept is rebuilt."
+        path = str(tmpdir.join("rollup.db"))
+        rollup = StatsRollup(path)
+        rollup.conn.executescript("""\
+          DROP TABLE rollup_state;
+          CREATE TABLE rollup_state (id INTEGER PRIMARY KEY, ref_cutoff_ms INTEGER NOT NULL,
+                                     high_water_id INTEGER NOT NULL, num_reviews INTEGER NOT NULL);
+          INSERT INTO rollup_state VALUES (1, 0, 0, 0);
+          PRAGMA user_version = 0;""")
+        rollup.close()
+
+        rollup = StatsRollup(path)
+        assert rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52) == get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+        rollup.close()
+
+    def test_day_cutoff_changes(self, table):
+        rollup = StatsRollup()
+        rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52)
+
+        # The next day reuses the rollup.
+        del table.queries[:]
+        stats = rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS + 86400, 52)
+        assert full_scans(table) == [] and _fetches(table) == []
+        assert stats == get_stats(table, 7, DAY_CUTOFF_SECONDS + 86400, 52)
+
+        # Changing when the next day starts requires a rebuild.
+        day_cutoff_seconds = DAY_CUTOFF_SECONDS + 3600
+        assert rollup.get_stats(table, 7, day_cutoff_seconds, 52) == get_stats(table, 7, day_cutoff_seconds, 52)
+
+    def test_unsupported(self, table):
+        rollup = StatsRollup()
+        assert rollup.get_stats(table, 0.5, DAY_CUTOFF_SECONDS, 52) is None
+        assert rollup.get_stats(table, 7, DAY_CUTOFF_SECONDS, 52, "ease = 1") is None
@@ -0,0 +1,105 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from progress_stats.compute import get_stats
+from progress_stats.sampling import get_sampled_stats, sample_filter
+
+from .helpers import DAY_CUTOFF_SECONDS, RevlogTable, add_random_reviews
+
+
+DECK_FILTER = "cid in (select id from cards where did = 1)"
+
+
+@pytest.fixture(scope="module")
+def table():
+    table = RevlogTable()
+    add_random_reviews(table, random.Random(1), num_cards=1000, num_days=200, num_decks=2)
+    return table
+
+
+class TestSampledStats:
+
+    def test_sample_filter(self):
+        assert sample_filter(10) == "rl.cid % 10 = 0"
+        assert sample_filter(10, DECK_FILTER) == "rl.cid %% 10 = 0 AND (%s)" % DECK_FILTER
+
+    @pytest.mark.parametrize("bucket_size_days,num_buckets", [(1, 31), (31, None)])
+    @pytest.mark.parametrize("additional_filter", [None, DECK_FILTER])
+    def test_scaled_sample(self, table, bucket_size_days, num_buckets, additional_filter):
+        sampled = get_sampled_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets, additional_filter,
+                                    sample_rate=4)
+        sample = get_stats(table, bucket_size_days, DAY_CUTOFF_SECONDS, num_buckets,
+                           sample_filter(4, additional_filter))
+
+        assert sampled.sample_rate == 4
+        assert set(sampled.stats) == set(sample)
+        for name, values in sample.items():
+            assert sampled.stats[name] == [(bucket_index, value * 4) for bucket_index, value in values]
+
+    def test_deterministic(self, table):
+        assert get_sampled_stats(table, 7, DAY_CUTOFF_SECONDS, 20) == \
+            get_sampled_stats(table, 7, DAY_CUTOFF_SECONDS, 20)
+
+    def test_intervals(self, table):
+        sampled = get_sampled_stats(table, 7, DAY_CUTOFF_SECONDS, 20, sample_rate=5)
+
+        for name, estimates in sampled.stats.items():
+            intervals = sampled.intervals[name]
+            assert [bucket_index for bucket_index, low, high in intervals] == \
+                [bucket_index for bucket_index, value in estimates]
+            for (bucket_index, low, high), (_, value) in zip(intervals, estimates):
+                assert low <= value < high
+                if name != "net_matured_cards":
+                    assert low >= 0
+
+    def test_intervals_cover_exact_stats(self, table):
+        exact = get_stats(table, 7, DAY_CUTOFF_SECONDS, 20)
+
+        num_covered = num_buckets = 0
+        for sample_rate in [3, 5]:
+            sampled = get_sampled_stats(table, 7, DAY_CUTOFF_SECONDS, 20, sample_rate=sample_rate)
+            for name in ["learned_cards", "matured_cards", "matured_reviews", "lost_matured_card", "net_matured_cards"]:
+                for (bucket_index, low, high), (_, value) in zip(sampled.intervals[name], exact[name]):
+                    num_covered += low <= value <= high
+                    num_buckets += 1
+
+        # The intervals are for 95% confidence, but leave some room for the normal approximation.
+        assert num_covered >= 0.85 * num_buckets
+
+    def test_matured_reviews_interval(self):
+        "A card maturing several times in a bucket adds the square of its count to the variance, not the count."
+        table = RevlogTable()
+        for cid in [2, 4, 5]:
+            table.add_card(cid)
+        day_ms = 86400000
+        _id = (DAY_CUTOFF_SECONDS - 20 * 86400) * 1000
+        # Card 2 matures three times within a week, card 4 once and card 5 isn't sampled.
+        for cid, ivl, lastIvl in [(2, 30, 5), (2, -600, 30), (2, 30, -600), (2, -600, 30), (2, 30, -600),
+                                  (4, 30, 5), (5, 30, 5)]:
+            _id += day_ms // 2
+            table.add_review(_id, cid, ivl, lastIvl)
+
+        sampled = get_sampled_stats(table, 7, DAY_CUTOFF_SECONDS, 4, sample_rate=2)
+        [(bucket_index, estimate)] = [value for value in sampled.stats["matured_reviews"] if value[1]]
+        assert estimate == 8
+        half_width = 1.96 * 2 * (10 * 0.5) ** 0.5
+        assert dict((b, (low, high)) for b, low, high in sampled.intervals["matured_reviews"])[bucket_index] == \
+            pytest.approx((max(8 - half_width, 0), 8 + half_width))
+        # The matured_cards interval is still binomial.
+        assert dict((b, high) for b, low, high in sampled.intervals["matured_cards"])[bucket_index] == \
+            pytest.approx(2 * 2 + 1.96 * 2 * (2 * 0.5) ** 0.5)
@@ -0,0 +1,74 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from progress_stats.series import downsample, summarize
+
+
+def _random_series(seed, length):
+    rng = random.Random(seed)
+    return [(x, rng.randint(-50, 100)) for x in range(-length + 1, 1)]
+
+
+class TestSummarize:
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matches_naive(self, seed):
+        data = _random_series(seed, 200)
+        summary = summarize(data)
+
+        cumulative = [(x, sum(y for _, y in data[:i + 1])) for i, (x, _) in enumerate(data)]
+        assert summary.cumulative == cumulative
+        assert summary.total == sum(y for x, y in data)
+        assert summary.min_value == min(y for x, y in data)
+        assert summary.max_value == max(y for x, y in data)
+        assert summary.min_cumulative == min(y for x, y in cumulative)
+        assert summary.max_cumulative == max(y for x, y in cumulative)
+
+    def test_single_point(self):
+        assert summarize([(0, 5)]) == ([(0, 5)], 5, 5, 5, 5, 5)
+
+
+class TestDownsample:
+
+    @pytest.mark.parametrize("max_points", [3, 10, 100])
+    def test_length_and_endpoints(self, max_points):
+        data = _random_series(1, 500)
+        sampled = downsample(data, max_points)
+
+        assert len(sampled) == max_points
+        assert sampled[0] == data[0] and sampled[-1] == data[-1]
+        assert sampled == sorted(set(sampled))
+        assert set(sampled) <= set(data)
+
+    def test_keeps_spike(self):
+        data = [(x, 0) for x in range(1000)]
+        data[437] = (437, 1000)
+        data[801] = (801, -1000)
+
+        sampled = downsample(data, 20)
+        assert (437, 1000) in sampled
+        assert (801, -1000) in sampled
+
+    @pytest.mark.parametrize("max_points", [0, 2, 50, 60])
+    def test_unchanged(self, max_points):
+        data = _random_series(2, 50)
+        assert downsample(data, max_points) is data
+
+    def test_deterministic(self):
+        data = _random_series(3, 300)
+        assert downsample(data, 40) == downsample(list(data), 40)
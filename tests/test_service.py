@@ -0,0 +1,165 @@
+# Copyright 2016-2020 Matthew Hayes
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from progress_stats import service
+from progress_stats.cli import day_cutoff_seconds
+from progress_stats.compute import get_stats
+from progress_stats.service import StatsService
+
+from benchmarks.synthetic import DAY_CUTOFF_SECONDS, create_collection
+
+from .helpers import Table
+
+
+@pytest.fixture(scope="module")
+def paths(tmpdir_factory):
+    tmpdir = tmpdir_factory.mktemp("service")
+    paths = []
+    for seed in range(2):
+        path = str(tmpdir.join("collection%d.anki2" % seed))
+        create_collection(path, 2000, seed).close()
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def stats_service():
+    stats_service = StatsService(max_workers=4)
+    yield stats_service
+    stats_service.close()
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _expected(path, bucket_size_days, day_cutoff, num_buckets=None, additional_filter=None):
+    stats = get_stats(Table(sqlite3.connect(path)), bucket_size_days, day_cutoff, num_buckets, additional_filter)
+    return json.loads(json.dumps(stats))
+
+
+class TestStatsService:
+
+    def test_stats(self, paths, stats_service):
+        assert _run(stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS, 52)) == \
+            _expected(paths[0], 7, DAY_CUTOFF_SECONDS, 52)
+        assert _run(stats_service.stats(paths[1], 31, DAY_CUTOFF_SECONDS, None, "cid % 2 = 0")) == \
+            _expected(paths[1], 31, DAY_CUTOFF_SECONDS, None, "cid % 2 = 0")
+
+    def test_json(self, paths, stats_service):
+        stats_json = _run(stats_service.stats_json(paths[0], 1, DAY_CUTOFF_SECONDS, 31))
+        assert json.loads(stats_json) == _expected(paths[0], 1, DAY_CUTOFF_SECONDS, 31)
+
+    def test_collection_day_cutoff(self, paths, stats_service):
+        cutoff = day_cutoff_seconds(Table(sqlite3.connect(paths[0])))
+        assert _run(stats_service.stats(paths[0], 7, None, 52)) == _expected(paths[0], 7, cutoff, 52)
+
+    def test_coalesce(self, paths, stats_service):
+        async def requests():
+            return await asyncio.gather(*[stats_service.stats_json(path, 7, DAY_CUTOFF_SECONDS, 52)
+                                          for path in paths * 5])
+
+        results = _run(requests())
+
+        assert stats_service.num_computed == 2
+        assert stats_service.num_coalesced == 8
+        assert results == [results[0], results[1]] * 5
+        assert json.loads(results[1]) == _expected(paths[1], 7, DAY_CUTOFF_SECONDS, 52)
+        assert stats_service._in_flight == {} and stats_service._semaphores == {}
+
+        # Requests made after the stats were computed compute them again, as they may have changed.
+        _run(stats_service.stats_json(paths[0], 7, DAY_CUTOFF_SECONDS, 52))
+        assert stats_service.num_computed == 3
+
+    def test_different_requests(self, paths, stats_service):
+        async def requests():
+            return await asyncio.gather(stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS, 52),
+                                        stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS, 26),
+                                        stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS + 86400, 52),
+                                        stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS, 52, "cid % 2 = 0"))
+
+        results = _run(requests())
+
+        assert stats_service.num_computed == 4 and stats_service.num_coalesced == 0
+        assert results[1] == _expected(paths[0], 7, DAY_CUTOFF_SECONDS, 26)
+        assert results[2] == _expected(paths[0], 7, DAY_CUTOFF_SECONDS + 86400, 52)
+
+    def test_error(self, tmpdir, paths, stats_service):
+        broken = tmpdir.join("broken.anki2")
+        broken.write("not a database")
+
+        async def requests():
+            return await asyncio.gather(*[stats_service.stats(str(broken), 7, DAY_CUTOFF_SECONDS, 52)
+                                          for i in range(3)], return_exceptions=True)
+
+        errors = _run(requests())
+        assert stats_service.num_computed == 1
+        assert all(isinstance(error, sqlite3.DatabaseError) for error in errors)
+        assert stats_service._in_flight == {}
+
+    def test_cancel_waiter(self, paths, stats_service):
+        async def requests():
+            first = asyncio.ensure_future(stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS, 52))
+            second = asyncio.ensure_future(stats_service.stats(paths[0], 7, DAY_CUTOFF_SECONDS, 52))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert _run(requests()) == _expected(paths[0], 7, DAY_CUTOFF_SECONDS, 52)
+        assert stats_service.num_computed == 1
+
+
+class TestConcurrency:
+
+    @pytest.mark.parametrize("max_per_collection", [1, 2])
+    def test_per_collection_limit(self, monkeypatch, paths, max_per_collection):
+        lock = threading.Lock()
+        running = {}
+        max_running = {}
+
+        def compute(path, *args):
+            with lock:
+                running[path] = running.get(path, 0) + 1
+                max_running[path] = max(max_running.get(path, 0), running[path])
+            time.sleep(0.05)
+            with lock:
+                running[path] -= 1
+            return "{}"
+
+        monkeypatch.setattr(service, "_compute", compute)
+        stats_service = StatsService(max_workers=8, max_per_collection=max_per_collection)
+
+        async def requests():
+            return await asyncio.gather(*[stats_service.stats(path, 7, DAY_CUTOFF_SECONDS, num_buckets)
+                                          for path in paths for num_buckets in range(1, 5)])
+
+        try:
+            assert _run(requests()) == [{}] * 8
+        finally:
+            stats_service.close()
+
+        assert stats_service.num_computed == 8
+        assert max_running == dict((path, max_per_collection) for path in paths)